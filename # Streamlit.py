@@ -2,167 +2,102 @@
 # RAG 
 import json
 import logging
-import re
 import streamlit as st
 import uuid
 import base64
 from datetime import datetime, date
-from snowflake.snowpark.functions import call_udf, concat, lit
-from snowflake.snowpark.context import get_active_session
-from snowflake.core import Root
+from connection import (
+    DB_NAME, SCHEMA_NAME,
+    get_session, get_active_service_name, mark_startup_complete
+)
+from prefetch import prefetch_search
+from answer_cache import load_prewarmed_answers, match_prewarmed_answer
+from citations import render_citations
+from document_delivery import cached_document_url, get_document_url, reconstruct_document_text
+from history_browser import (
+    PAGE_SIZE, ensure_sessions_table, record_session_activity, delete_session_summaries,
+    fetch_sessions_page, search_questions_page
+)
+from profiling import PROFILE_MODES, start_rerun_profile, finish_rerun_profile, wait_timer
+from reranking import RERANK_DEFAULTS, rerank_results
+from singleflight import completion_key, coalescing_metrics
+from completion_scheduler import COMPLETION_TIMEOUT_SECONDS, get_scheduler
+from query_tags import install_query_tagging, set_query_context, query_stage, tag
+from rag_pipeline import (
+    FIXED_MODEL, MIN_CHUNKS, MAX_CHUNKS, GENERAL_SYSTEM_MESSAGE,
+    determine_chunk_count, get_complexity_explanation, build_date_filter,
+    build_rag_system_message, build_full_prompt,
+    format_conversation_history, sources_to_json
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Get the active Snowflake session
-session = get_active_session()
-logging.info("Active Snowflake session retrieved.")
+# Profile this rerun when switched on from the sidebar or MH_PROFILE (see profiling.py).
+# The browser session's key lets the next run close a profile this one never finishes
+# (st.stop(), an uncaught error), even when it runs on another thread.
+if "profile_session_key" not in st.session_state:
+    st.session_state.profile_session_key = str(uuid.uuid4())
+rerun_profile = start_rerun_profile(
+    st.session_state.get("profile_reruns", False),
+    st.session_state.get("session_id", "new"),
+    st.session_state.get("profile_mode", "cprofile"),
+    session_key=st.session_state.profile_session_key
+)
+
+# Get the Snowflake session (created once per process and reused across reruns)
+session = get_session()
 
-# Define database, schema, and search service names
-# Update these parameters as needed for your specific Snowflake setup
-db_name = 'MH_PUBLICATIONS'
-schema_name = 'DATA'
-search_service_name = 'MH_PUBLICATIONS_SEARCH_SERVICE'
-
-# Set up the Cortex Search Service Root
-root = Root(session)
-
-#------------------------------------------------------------------------------
-# DYNAMIC CHUNK CALCULATION FUNCTIONS
-#------------------------------------------------------------------------------
+# Initialize chat messages in session state if not already set
+if "messages" not in st.session_state:
+    st.session_state.messages = [{"role": "assistant", "content": "How can I help you?"}]
 
-def calculate_question_complexity(question):
-    """
-    Calculate the complexity of a question based on various factors.
-    Returns a complexity score between 1 and 10.
-    """
-    complexity_score = 1  # Base score
-    
-    # Factor 1: Question length (longer questions tend to be more complex)
-    word_count = len(question.split())
-    if word_count > 50:
-        complexity_score += 3
-    elif word_count > 30:
-        complexity_score += 2
-    elif word_count > 15:
-        complexity_score += 1
-    
-    # Factor 2: Multiple question indicators
-    question_indicators = ['?', 'what', 'how', 'why', 'when', 'where', 'who', 'which']
-    question_count = sum(1 for indicator in question_indicators if indicator in question.lower())
-    if question_count > 3:
-        complexity_score += 2
-    elif question_count > 2:
-        complexity_score += 1
-    
-    # Factor 3: Complex keywords that suggest detailed answers needed
-    complex_keywords = [
-        'compare', 'contrast', 'analyze', 'explain', 'describe', 'detail', 'comprehensive',
-        'thorough', 'complete', 'all', 'every', 'various', 'different', 'multiple',
-        'process', 'procedure', 'steps', 'requirements', 'criteria', 'conditions',
-        'eligibility', 'qualification', 'documentation', 'application', 'enrollment',
-        'benefits', 'coverage', 'services', 'options', 'alternatives', 'exceptions'
-    ]
-    
-    complex_keyword_count = sum(1 for keyword in complex_keywords if keyword in question.lower())
-    if complex_keyword_count > 5:
-        complexity_score += 3
-    elif complex_keyword_count > 3:
-        complexity_score += 2
-    elif complex_keyword_count > 1:
-        complexity_score += 1
-    
-    # Factor 4: Conjunctions suggesting multiple parts
-    conjunctions = [' and ', ' or ', ' but ', ' also ', ' additionally', ' furthermore', ' moreover']
-    conjunction_count = sum(1 for conj in conjunctions if conj in question.lower())
-    if conjunction_count > 2:
-        complexity_score += 2
-    elif conjunction_count > 0:
-        complexity_score += 1
-    
-    # Factor 5: Specific complex question patterns
-    complex_patterns = [
-        r'what are (?:all )?the .* for',  # "what are all the requirements for"
-        r'how (?:do|can) i .* and .*',    # "how do i apply and what documents"
-        r'what is the difference between',  # comparison questions
-        r'can you (?:explain|describe|list) (?:all|the)',  # comprehensive requests
-        r'what (?:steps|process|procedure)',  # process questions
-        r'(?:list|show|tell me about) (?:all|every|the various)'  # comprehensive lists
-    ]
-    
-    pattern_matches = sum(1 for pattern in complex_patterns if re.search(pattern, question.lower()))
-    if pattern_matches > 0:
-        complexity_score += 2
-    
-    # Cap the score at 10
-    return min(complexity_score, 10)
+# Initialize session ID if not exists (before any query, so the first run's are tagged with it)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 
-def determine_chunk_count(question, base_chunks=3, max_chunks=12):
-    """
-    Determine the optimal number of chunks based on question complexity.
-    
-    Args:
-        question (str): The user's question
-        base_chunks (int): Minimum number of chunks
-        max_chunks (int): Maximum number of chunks
-    
-    Returns:
-        int: Number of chunks to use
-    """
-    complexity = calculate_question_complexity(question)
-    
-    # Map complexity (1-10) to chunk count (base_chunks to max_chunks)
-    chunk_count = base_chunks + int((complexity - 1) * (max_chunks - base_chunks) / 9)
-    
-    return max(base_chunks, min(chunk_count, max_chunks))
+# Tag every query with its app stage, chat session and turn (see query_tags.py)
+install_query_tagging()
+set_query_context(
+    st.session_state.session_id,
+    sum(1 for m in st.session_state.messages if m["role"] == "user")
+)
 
-def get_complexity_explanation(question):
-    """
-    Get a human-readable explanation of why a certain complexity was assigned.
-    """
-    complexity = calculate_question_complexity(question)
-    word_count = len(question.split())
-    
-    explanations = []
-    
-    if word_count > 30:
-        explanations.append(f"Long question ({word_count} words)")
-    elif word_count > 15:
-        explanations.append(f"Medium-length question ({word_count} words)")
-    
-    complex_keywords = [
-        'compare', 'contrast', 'analyze', 'explain', 'describe', 'detail', 'comprehensive',
-        'thorough', 'complete', 'all', 'every', 'various', 'different', 'multiple',
-        'process', 'procedure', 'steps', 'requirements', 'criteria', 'conditions'
-    ]
-    
-    found_keywords = [kw for kw in complex_keywords if kw in question.lower()]
-    if found_keywords:
-        explanations.append(f"Complex keywords detected: {', '.join(found_keywords[:3])}")
-    
-    if 'what are' in question.lower() and ('all' in question.lower() or 'every' in question.lower()):
-        explanations.append("Comprehensive information request")
-    
-    if len(explanations) == 0:
-        explanations.append("Simple, direct question")
-    
-    return f"Complexity: {complexity}/10 ({'; '.join(explanations)})"
+# Database, schema, and search service names (configured in connection.py).
+# The search service is the currently active version, swapped by search_service_admin.py
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+search_service_name = get_active_service_name()
 
 #------------------------------------------------------------------------------
 # CHAT HISTORY FUNCTIONS
 #------------------------------------------------------------------------------
 
+def resolve_user_id():
+    """The signed-in Snowflake user, or None when it can't be determined"""
+    try:
+        user_info = st.experimental_user
+        return user_info.get("user_name") or user_info.get("email") or None
+    except Exception:
+        return None
+
+def get_current_user_id():
+    """User ID recorded on saved rows (falls back to the shared 'anonymous')"""
+    return resolve_user_id() or "anonymous"
+
 def save_chat_to_history(session_id, user_question, assistant_response, sources_used=None):
-    """Save Q&A pair to CHAT_HISTORY table"""
+    """Save Q&A pair to CHAT_HISTORY table. Returns the new row's chat_id, or False on failure"""
+    chat_id = str(uuid.uuid4())
     try:
         # Use parameterized query to handle special characters
         history_query = f"""
         INSERT INTO {db_name}.{schema_name}.CHAT_HISTORY 
-        (session_id, user_question, assistant_response, sources_used, created_timestamp)
-        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP())
+        (chat_id, session_id, user_question, assistant_response, sources_used, created_timestamp, user_id)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP(), ?)
         """
-        session.sql(history_query, params=[session_id, user_question, assistant_response, sources_used]).collect()
-        return True
+        session.sql(history_query, params=[chat_id, session_id, user_question, assistant_response, sources_used, get_current_user_id()]).collect(statement_params=tag("history_insert"))
+        update_session_summary(session_id, user_question)
+        return chat_id
     except Exception as e:
         # Create table if it doesn't exist
         try:
@@ -178,59 +113,62 @@ def save_chat_to_history(session_id, user_question, assistant_response, sources_
                 PRIMARY KEY (chat_id)
             )
             """
-            session.sql(create_table_query).collect()
+            session.sql(create_table_query).collect(statement_params=tag("history_table_create"))
             # Try inserting again
-            session.sql(history_query, params=[session_id, user_question, assistant_response, sources_used]).collect()
-            return True
+            session.sql(history_query, params=[chat_id, session_id, user_question, assistant_response, sources_used, get_current_user_id()]).collect(statement_params=tag("history_insert"))
+            update_session_summary(session_id, user_question)
+            return chat_id
         except Exception as e2:
             st.error(f"Error saving chat history: {str(e2)}")
             return False
 
-def get_recent_chat_sessions(limit=10):
-    """Get the most recent 10 chat sessions"""
+def replace_chat_in_history(chat_id, assistant_response, sources_used=None):
+    """Overwrite the answer stored for an existing turn (used when a cached answer is regenerated)"""
     try:
-        # Get distinct sessions with their latest timestamp and first question as preview
-        query = f"""
-        WITH ranked_chats AS (
-            SELECT 
-                session_id,
-                user_question,
-                created_timestamp,
-                ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY created_timestamp ASC) as rn_first,
-                ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY created_timestamp DESC) as rn_latest
-            FROM {db_name}.{schema_name}.CHAT_HISTORY
-        ),
-        session_previews AS (
-            SELECT 
-                session_id,
-                user_question as first_question,
-                created_timestamp as session_start
-            FROM ranked_chats 
-            WHERE rn_first = 1
-        ),
-        latest_timestamps AS (
-            SELECT 
-                session_id,
-                created_timestamp as last_activity
-            FROM ranked_chats 
-            WHERE rn_latest = 1
-        )
-        SELECT 
-            sp.session_id,
-            sp.first_question,
-            sp.session_start,
-            lt.last_activity
-        FROM session_previews sp
-        JOIN latest_timestamps lt ON sp.session_id = lt.session_id
-        ORDER BY lt.last_activity DESC
-        LIMIT {limit}
+        update_query = f"""
+        UPDATE {db_name}.{schema_name}.CHAT_HISTORY
+        SET assistant_response = ?, sources_used = ?, created_timestamp = CURRENT_TIMESTAMP()
+        WHERE chat_id = ?
         """
-        
-        result = session.sql(query).collect()
-        return [dict(row.asDict()) for row in result]
+        session.sql(update_query, params=[assistant_response, sources_used, chat_id]).collect(statement_params=tag("history_update"))
+        st.session_state.history_stale = True
+        return chat_id
     except Exception as e:
-        logging.error(f"Error fetching recent chat sessions: {str(e)}")
-        return []
+        st.error(f"Error updating chat history: {str(e)}")
+        return False
+
+def update_session_summary(session_id, user_question):
+    """Keep the CHAT_SESSIONS summary row current and refresh the sidebar listing"""
+    try:
+        with query_stage("session_summary"):
+            record_session_activity(session, session_id, user_question, get_current_user_id())
+    except Exception as e:
+        logging.error(f"Error updating chat session summary: {str(e)}")
+    st.session_state.history_stale = True
+
+@st.cache_resource(show_spinner=False)
+def prepare_history_tables():
+    """Create and backfill the CHAT_SESSIONS summary table once per process"""
+    try:
+        with query_stage("history_setup"):
+            ensure_sessions_table(session)
+    except Exception as e:
+        logging.error(f"Error preparing chat session summaries: {str(e)}")
+
+def get_chat_sessions_page(cursor=None, search_text=""):
+    """
+    Get one page of chat sessions (or question search matches), newest first.
+    Returns (rows, next_cursor); next_cursor is None when there are no more pages.
+    """
+    try:
+        if search_text:
+            with query_stage("history_search"):
+                return search_questions_page(session, search_text, cursor, PAGE_SIZE)
+        with query_stage("history_page"):
+            return fetch_sessions_page(session, cursor, PAGE_SIZE)
+    except Exception as e:
+        logging.error(f"Error fetching chat sessions: {str(e)}")
+        return [], None
 
 def load_chat_session(session_id):
     """Load a complete chat session from history"""
@@ -246,19 +184,29 @@ def load_chat_session(session_id):
         ORDER BY created_timestamp ASC
         """
         
-        result = session.sql(query, params=[session_id]).collect()
+        result = session.sql(query, params=[session_id]).collect(statement_params=tag("history_load"))
         return [dict(row.asDict()) for row in result]
     except Exception as e:
         logging.error(f"Error loading chat session: {str(e)}")
         return []
 
 def delete_chat_history():
-    """Delete all chat history from the database"""
+    """Delete all of the current user's chat history from the database"""
+    # Never delete by the shared 'anonymous' fallback: it would remove every
+    # unidentified user's chats, not just this user's
+    user_id = resolve_user_id()
+    if user_id is None:
+        st.error("Your user could not be identified, so chat history was not deleted.")
+        return False
     try:
         delete_query = f"""
         DELETE FROM {db_name}.{schema_name}.CHAT_HISTORY
+        WHERE user_id = ?
         """
-        session.sql(delete_query).collect()
+        with query_stage("history_delete"):
+            session.sql(delete_query, params=[user_id]).collect(statement_params=tag("history_delete"))
+            delete_session_summaries(session, user_id=user_id)
+        st.session_state.history_stale = True
         return True
     except Exception as e:
         st.error(f"Error deleting chat history: {str(e)}")
@@ -271,7 +219,10 @@ def delete_specific_chat_session(session_id):
         DELETE FROM {db_name}.{schema_name}.CHAT_HISTORY 
         WHERE session_id = ?
         """
-        session.sql(delete_query, params=[session_id]).collect()
+        with query_stage("history_delete"):
+            session.sql(delete_query, params=[session_id]).collect(statement_params=tag("history_delete"))
+            delete_session_summaries(session, session_id)
+        st.session_state.history_stale = True
         return True
     except Exception as e:
         st.error(f"Error deleting chat session: {str(e)}")
@@ -292,8 +243,27 @@ st.sidebar.subheader("💬 Recent Chats")
 if "loading_chat" not in st.session_state:
     st.session_state.loading_chat = False
 
-# Get recent chat sessions
-recent_sessions = get_recent_chat_sessions(10)
+prepare_history_tables()
+
+# Search over past questions (empty shows all sessions)
+history_search = st.sidebar.text_input(
+    "Search chats",
+    key="history_search",
+    placeholder="Search past questions...",
+    label_visibility="collapsed"
+).strip()
+
+# Pages already loaded are kept in session state; the listing restarts from
+# the first page when a chat is saved or deleted, or the search changes
+if (st.session_state.get("history_stale", True)
+        or st.session_state.get("history_loaded_search") != history_search):
+    rows, cursor = get_chat_sessions_page(None, history_search)
+    st.session_state.history_rows = rows
+    st.session_state.history_cursor = cursor
+    st.session_state.history_loaded_search = history_search
+    st.session_state.history_stale = False
+
+recent_sessions = st.session_state.history_rows
 
 if recent_sessions:
     for i, chat_session in enumerate(recent_sessions):
@@ -353,6 +323,16 @@ if recent_sessions:
                     st.session_state.loading_chat = False
                     st.rerun()
 
+    # Load the next page, continuing after the last row shown
+    if st.session_state.history_cursor is not None:
+        if st.sidebar.button("⬇️ Load more", key="load_more_chats", use_container_width=True):
+            rows, cursor = get_chat_sessions_page(st.session_state.history_cursor, history_search)
+            st.session_state.history_rows = recent_sessions + rows
+            st.session_state.history_cursor = cursor
+            st.rerun()
+
+elif history_search:
+    st.sidebar.info("No matching questions found")
 else:
     st.sidebar.info("No previous chats found")
 
@@ -366,10 +346,10 @@ if st.sidebar.button("✨ New Chat", key="new_chat_button", use_container_width=
     st.session_state.feedback_given = {}
     st.rerun()
 
-# Clear All chat history button
-if st.sidebar.button("🗑️ Clear All Chat History", key="delete_all_chats", help="Delete all chat history", use_container_width=True):
+# Clear All chat history button (only the current user's chats, so hidden when the user is unknown)
+if resolve_user_id() is not None and st.sidebar.button("🗑️ Clear All Chat History", key="delete_all_chats", help="Delete all of your chat history", use_container_width=True):
     if delete_chat_history():
-        st.success("All chat history deleted!")
+        st.success("Your chat history was deleted!")
         st.rerun()
 
 # ============================================================================
@@ -392,7 +372,7 @@ try:
     FROM {db_name}.{schema_name}.DOCS_CHUNKS_TABLE 
     WHERE eff_code_final_date IS NOT NULL
     """
-    date_range_result = session.sql(date_range_query).collect()
+    date_range_result = session.sql(date_range_query).collect(statement_params=tag("date_range"))
     
     if date_range_result and date_range_result[0]['MIN_DATE'] and date_range_result[0]['MAX_DATE']:
         min_date = date_range_result[0]['MIN_DATE']
@@ -451,11 +431,51 @@ except Exception as e:
     start_date = None
     end_date = None
 
-# Fixed model (no user selection) and Auto-enable Cortex Search
-FIXED_MODEL = 'llama3.1-70b'
+# Fixed model (no user selection, see rag_pipeline.FIXED_MODEL) and Auto-enable Cortex Search
 cortex_search_on = True  # Always enabled
 show_sources = True      # Always enabled
 
+# Source diversity (MMR reranking of search results, see reranking.py)
+st.sidebar.markdown("---")
+st.sidebar.subheader("🔀 Source Diversity")
+rerank_enabled = st.sidebar.toggle(
+    "Diversify sources",
+    value=RERANK_DEFAULTS["enabled"],
+    key="rerank_enabled",
+    help="Avoid filling every source slot with chunks from the same publication"
+)
+rerank_lambda = RERANK_DEFAULTS["lambda"]
+if rerank_enabled:
+    rerank_lambda = st.sidebar.slider(
+        "Relevance vs. diversity",
+        min_value=0.0,
+        max_value=1.0,
+        value=RERANK_DEFAULTS["lambda"],
+        step=0.05,
+        key="rerank_lambda",
+        help="1.0 keeps the search ranking as is; lower values favor sources from different documents and dates"
+    )
+rerank_settings = {"enabled": rerank_enabled, "lambda": rerank_lambda}
+
+
+# Profiling (takes effect from the next rerun)
+st.sidebar.markdown("---")
+st.sidebar.subheader("🧪 Diagnostics")
+st.sidebar.toggle(
+    "Profile reruns",
+    key="profile_reruns",
+    help="Profile each script run and save a report under the profiles directory"
+)
+if st.session_state.profile_reruns:
+    st.sidebar.selectbox("Profiler", PROFILE_MODES, key="profile_mode")
+if st.session_state.get("last_profile_summary"):
+    with st.sidebar.expander("Last rerun profile"):
+        st.code(st.session_state.last_profile_summary)
+with st.sidebar.expander("Coalesced searches"):
+    # Process-wide counts of duplicate searches that shared one call (shared completions are under Completion queue)
+    st.json(coalescing_metrics())
+with st.sidebar.expander("Completion queue"):
+    st.json(get_scheduler().metrics())
 
 # Add app reset button
 st.sidebar.markdown("---")
@@ -471,14 +491,6 @@ if st.sidebar.button("🔄 Reset App", help="Clear all session data and restart"
 # App title
 st.title("📄 MassHealth Publications AI Research Assistant")
 
-# Initialize chat messages in session state if not already set
-if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "How can I help you?"}]
-
-# Initialize session ID if not exists
-if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
-
 # Initialize feedback state if not exists
 if "feedback_given" not in st.session_state:
     st.session_state.feedback_given = {}
@@ -502,10 +514,10 @@ def save_feedback_to_snowflake(session_id, message_index, user_question, assista
         # Use parameterized query to handle special characters
         feedback_query = f"""
         INSERT INTO {db_name}.{schema_name}.CHAT_FEEDBACK 
-        (session_id, message_index, user_question, assistant_response, feedback_type)
-        VALUES (?, ?, ?, ?, ?)
+        (session_id, message_index, user_question, assistant_response, feedback_type, user_id)
+        VALUES (?, ?, ?, ?, ?, ?)
         """
-        session.sql(feedback_query, params=[session_id, message_index, user_question, assistant_response, feedback_type]).collect()
+        session.sql(feedback_query, params=[session_id, message_index, user_question, assistant_response, feedback_type, get_current_user_id()]).collect(statement_params=tag("feedback_insert"))
         return True
     except Exception as e:
         # Create table if it doesn't exist
@@ -522,9 +534,9 @@ def save_feedback_to_snowflake(session_id, message_index, user_question, assista
                 user_id VARCHAR DEFAULT 'anonymous'
             )
             """
-            session.sql(create_table_query).collect()
+            session.sql(create_table_query).collect(statement_params=tag("feedback_table_create"))
             # Try inserting again
-            session.sql(feedback_query, params=[session_id, message_index, user_question, assistant_response, feedback_type]).collect()
+            session.sql(feedback_query, params=[session_id, message_index, user_question, assistant_response, feedback_type, get_current_user_id()]).collect(statement_params=tag("feedback_insert"))
             return True
         except Exception as e2:
             st.error(f"Error saving feedback: {str(e2)}")
@@ -570,48 +582,41 @@ def display_feedback_buttons(message_index, user_question, assistant_response):
                 st.session_state.feedback_given[feedback_key] = 'negative'
                 st.rerun()
 
-def highlight_citations(text, show_sources=True):
+@st.cache_data(ttl=600, show_spinner=False)
+def get_prewarmed_answers():
+    """Load pre-computed answers (see answer_cache.py), refreshed every 10 minutes"""
+    with query_stage("prewarmed_answers"):
+        return load_prewarmed_answers(session)
+
+def display_cached_answer_label(message_index, user_question):
+    """Mark a pre-computed answer and offer to regenerate it with a live search"""
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.caption("⚡ Cached answer - pre-computed for a frequently asked question")
+    with col2:
+        if st.button("🔄 Regenerate", key=f"regenerate_{message_index}", help="Run a fresh search and answer"):
+            # Drop the cached turn and re-ask the question without the cache; the
+            # new answer replaces the cached one's CHAT_HISTORY row
+            st.session_state.regenerate_chat_id = st.session_state.messages[message_index].get("chat_id")
+            del st.session_state.messages[message_index - 1:message_index + 1]
+            st.session_state.regenerate_prompt = user_question
+            st.rerun()
+
+def highlight_citations(text, show_sources=True, num_sources=None):
     """
     Process text to highlight and make citation markers clickable.
     
     Args:
         text (str): The text containing citation markers like [1], [2,3], etc.
         show_sources (bool): Whether to make citations clickable links to sources
+        num_sources (int): Number of sources available; out-of-range markers are flagged
     """
-    # Split text into paragraphs to preserve formatting
-    paragraphs = text.split('\n')
+    # Rendered once per message content (see citations.py) and written as a single element
+    rendered, invalid_citations = render_citations(text, num_sources, show_sources)
+    st.markdown(rendered, unsafe_allow_html=True)
     
-    for paragraph in paragraphs:
-        if not paragraph.strip():
-            # Empty line, just add a line break
-            st.write("")
-            continue
-            
-        # Process each paragraph to replace citations with HTML
-        processed_paragraph = ""
-        parts = re.split(r'(\[\d+(?:,\s*\d+)*\])', paragraph)
-        
-        for part in parts:
-            # If this part is a citation marker
-            if re.match(r'\[\d+(?:,\s*\d+)*\]', part):
-                # Extract the numbers from the citation
-                citation_nums = re.findall(r'\d+', part)
-                
-                # Add the citation as HTML
-                if show_sources:
-                    # If sources are shown, make citations clickable
-                    citation_html = f'<span style="color: #ff4b4b; font-weight: bold;"><a href="#source_{"_".join(citation_nums)}" style="color: #ff4b4b; text-decoration: none;">{part}</a></span>'
-                else:
-                    # If sources are hidden, still highlight but don't make clickable
-                    citation_html = f'<span style="color: #ff4b4b; font-weight: bold;">{part}</span>'
-                processed_paragraph += citation_html
-            else:
-                # Regular text
-                if part:
-                    processed_paragraph += part
-        
-        # Write the entire processed paragraph as a single markdown element
-        st.markdown(processed_paragraph, unsafe_allow_html=True)
+    if invalid_citations:
+        st.caption(f"⚠️ Citation(s) {', '.join(f'[{n}]' for n in invalid_citations)} do not match any listed source")
 
 def display_copy_button(text_to_copy, message_index=None):
     """
@@ -637,6 +642,52 @@ def display_copy_button(text_to_copy, message_index=None):
         key=unique_key
     )
     
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_document_text(relative_path):
+    """Fallback full-document text rebuilt from chunks (cached for an hour)"""
+    with query_stage("document_text"):
+        return reconstruct_document_text(session, relative_path)
+
+def display_document_link(relative_path, key_suffix):
+    """
+    Offer the original document through a presigned URL.
+    The URL is generated on first click and shared across sessions until it
+    expires; the text rebuilt from chunks is only used if no URL can be made.
+    """
+    url = cached_document_url(relative_path)
+    if "document_fallbacks" not in st.session_state:
+        st.session_state.document_fallbacks = set()
+    
+    if not url and relative_path not in st.session_state.document_fallbacks:
+        if st.button("📁 Get Full Document", key=f"get_document_{key_suffix}", help=f"Open the original document: {relative_path}"):
+            try:
+                with query_stage("document_url"):
+                    url = get_document_url(session, relative_path)
+            except Exception as e:
+                logging.error(f"Error generating document URL for {relative_path}: {str(e)}")
+            if not url:
+                st.session_state.document_fallbacks.add(relative_path)
+    
+    if url:
+        st.link_button("📁 Open Full Document", url, help=f"Open the original document: {relative_path}")
+    elif relative_path in st.session_state.document_fallbacks:
+        try:
+            full_document = get_document_text(relative_path)
+            if full_document:
+                # Create safe filename
+                safe_filename = relative_path.replace('/', '_').replace('\\', '_').replace(':', '_')
+                
+                st.download_button(
+                    label="📁 Download Full Document",
+                    data=full_document,
+                    file_name=f"{safe_filename}.txt",
+                    mime="text/plain",
+                    key=f"download_full_{key_suffix}",
+                    help=f"Download the document text: {relative_path}"
+                )
+        except Exception as e:
+            st.error(f"Error preparing download for {relative_path}: {str(e)}")
+
 def display_sources(sources, message_index=None, chunk_info=None):
     """
     Display source documents in expandable sections with download buttons inside.
@@ -699,43 +750,53 @@ def display_sources(sources, message_index=None, chunk_info=None):
             with col2:
                 # Add download button inside the expander
                 if relative_path:
-                    try:
-                        # Get full document
-                        full_doc_query = f"""
-                        SELECT chunk 
-                        FROM {db_name}.{schema_name}.DOCS_CHUNKS_TABLE 
-                        WHERE relative_path = '{relative_path}'
-                        """
-                        
-                        full_doc_result = session.sql(full_doc_query).collect()
-                        
-                        if full_doc_result:
-                            # Reconstruct full document
-                            full_document = "\n".join([row['CHUNK'] for row in full_doc_result])
-                            full_document = full_document.replace('\\\"\\\"', '"')
-                            full_document = full_document.replace('\\\"', '"')
-                            full_document = full_document.replace('\\n', '\n')
-                            
-                            # Create safe filename
-                            safe_filename = relative_path.replace('/', '_').replace('\\', '_').replace(':', '_')
-                            
-                            # Download button inside the expander
-                            st.download_button(
-                                label="📁 Download Full Document",
-                                data=full_document,
-                                file_name=f"{safe_filename}.txt",
-                                mime="text/plain",
-                                key=get_unique_key(f"download_full_{message_index}_{i}"),
-                                help=f"Download the complete document: {relative_path}"
-                            )
-                            
-                    except Exception as e:
-                        st.error(f"Error preparing download for {relative_path}: {str(e)}")
+                    display_document_link(relative_path, f"{message_index}_{i}")
                 else:
                     st.caption("Download not available")
 
 st.markdown("---")
 
+#------------------------------------------------------------------------------
+# READ USER INPUT AND START RETRIEVAL EARLY
+#------------------------------------------------------------------------------
+
+# Get user input (chat_input is always pinned to the bottom of the page, so
+# reading it here does not change the layout)
+prompt = st.chat_input("Ask a question...")
+
+# A "Regenerate" click on a cached answer re-asks the question, bypassing the cache
+bypass_answer_cache = False
+regenerate_chat_id = None
+if not prompt and st.session_state.get("regenerate_prompt"):
+    prompt = st.session_state.pop("regenerate_prompt")
+    regenerate_chat_id = st.session_state.pop("regenerate_chat_id", None)
+    bypass_answer_cache = True
+
+# Queries from here on belong to the turn answering this prompt
+if prompt:
+    set_query_context(
+        st.session_state.session_id,
+        sum(1 for m in st.session_state.messages if m["role"] == "user") + 1
+    )
+
+# Serve frequent questions from the pre-computed store. Stored answers are
+# unfiltered and ignore earlier turns, so only use them for the first question
+# of a chat with no date filter.
+cached_entry = None
+if prompt and not bypass_answer_cache and not date_filter_enabled and len(st.session_state.messages) <= 1:
+    cached_entry = match_prewarmed_answer(prompt, get_prewarmed_answers())
+
+# Retrieval does not depend on the history rendering below, so start the
+# search now and only wait for it when building the context
+search_future = None
+if prompt and cortex_search_on and not cached_entry:
+    # Build filter dictionary with date filtering only
+    if date_filter_enabled:
+        filter_dict = build_date_filter(start_date, end_date)
+    else:
+        filter_dict = None
+    search_future = prefetch_search(prompt, filter_dict, search_service_name)
+
 #------------------------------------------------------------------------------
 # DISPLAY CHAT HISTORY
 #------------------------------------------------------------------------------
@@ -745,8 +806,11 @@ for i, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         if message["role"] == "assistant":
             # Display the message with citations
+            if message.get("cached"):
+                display_cached_answer_label(i, st.session_state.messages[i-1]["content"])
+            
             if "source_data" in message:
-                highlight_citations(message["content"], show_sources)
+                highlight_citations(message["content"], show_sources, len(message["source_data"]))
                 
                 # Add download response button BEFORE sources
                 if i > 0:  # Don't show button for initial greeting
@@ -778,15 +842,44 @@ for i, message in enumerate(st.session_state.messages):
 # HANDLE USER INPUT
 #------------------------------------------------------------------------------
 
-# Get user input
-prompt = st.chat_input("Ask a question...")
+# Serve a pre-computed answer for a frequent question
+if prompt and cached_entry:
+    # Add user message to chat history
+    st.session_state.messages.append({"role": "user", "content": prompt})
+    
+    # Display user message
+    with st.chat_message("user"):
+        st.write(prompt)
+    
+    full_response = cached_entry["answer"]
+    chunk_info_display = "pre-computed answer"
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": full_response,
+        "source_data": cached_entry["sources"],
+        "chunk_info": chunk_info_display,
+        "cached": True
+    })
+    
+    # Save the Q&A pair to the database
+    st.session_state.messages[-1]["chat_id"] = save_chat_to_history(
+        st.session_state.session_id, prompt, full_response, json.dumps(cached_entry["sources"])
+    )
+    
+    new_message_index = len(st.session_state.messages) - 1
+    
+    with st.chat_message("assistant"):
+        display_cached_answer_label(new_message_index, prompt)
+        highlight_citations(full_response, show_sources, len(cached_entry["sources"]))
+        display_copy_button(full_response, message_index=new_message_index)
+        display_sources(cached_entry["sources"], message_index=new_message_index, chunk_info=chunk_info_display)
+    
+    display_feedback_buttons(new_message_index, prompt, full_response)
 
 # Process the user input
-if prompt:
+elif prompt:
     # Always use dynamic chunks with maximum range (3-15) for comprehensive context
-    min_chunks = 3
-    max_chunks = 15
-    actual_num_chunks = determine_chunk_count(prompt, min_chunks, max_chunks)
+    actual_num_chunks = determine_chunk_count(prompt, MIN_CHUNKS, MAX_CHUNKS)
     complexity_info = get_complexity_explanation(prompt)
     chunk_info_display = f"{actual_num_chunks} chunks selected dynamically"
     
@@ -803,68 +896,19 @@ if prompt:
     
     # Build conversation history using ALL messages in current chat session
     recent_messages = st.session_state.messages[:-1]  # Exclude the current prompt
-    
-    # Format conversation history
-    conversation_history = ""
-    for message in recent_messages:
-        role = "User" if message["role"] == "user" else "Assistant"
-        conversation_history += f"{role}: {message['content']}\n\n"
+    conversation_history = format_conversation_history(recent_messages)
     
     # Initialize variables for search results
-    context = ""
     error_occurred = False
     
     #--------------------------------------------------------------------------
     # CORTEX SEARCH WITH FUNCTIONAL DATE FILTERING
     #--------------------------------------------------------------------------
     if cortex_search_on:
-        # Build filter dictionary with date filtering only
-        filter_conditions = []
-        
-        # Date filter (now functional)
-        if date_filter_enabled and start_date and end_date:
-            # Convert dates to string format for filtering
-            start_date_str = start_date.strftime("%Y-%m-%d")
-            end_date_str = end_date.strftime("%Y-%m-%d")
-            
-            # Add date range filter
-            filter_conditions.append({
-                "@and": [
-                    {"@gte": {"eff_code_final_date": start_date_str}},
-                    {"@lte": {"eff_code_final_date": end_date_str}}
-                ]
-            })
-        
-        # Combine filters
-        if len(filter_conditions) == 0:
-            filter_dict = None
-        elif len(filter_conditions) == 1:
-            filter_dict = filter_conditions[0]
-        else:
-            filter_dict = {"@and": filter_conditions}
-
-        # Query the Cortex Search Service
+        # Wait for the search started before the history was rendered
         try:
-            cortex_service = root.databases[db_name].schemas[schema_name].cortex_search_services[search_service_name]
-            
-            # Set a high limit for comprehensive search
-            SEARCH_LIMIT = 1000
-
-            question_response = cortex_service.search(
-                prompt, 
-                ["chunk","relative_path", "eff_code_final_date"], 
-                filter=filter_dict if filter_dict else None,
-                limit=SEARCH_LIMIT
-            )
-
-            # Cortex Search returns results ranked by relevance score
-
-            # Build context string from search results using dynamic chunk count
-            for i, result in enumerate(question_response.results[:actual_num_chunks]):
-                doc_title = result.get('relative_path', 'Unknown')
-                eff_date = result.get('eff_code_final_date', '')
-                date_display = f" (Effective Date: {eff_date})" if eff_date else ""
-                context += f"Source {i+1} - {doc_title}{date_display}:\n{result['chunk']}\n\n"
+            with wait_timer("search"):
+                question_response = search_future.result()
 
         except Exception as e:
             st.error(f"An error occurred while querying Cortex Search: {str(e)}")
@@ -874,79 +918,47 @@ if prompt:
     # BUILD SYSTEM MESSAGE
     #--------------------------------------------------------------------------
     if cortex_search_on and not error_occurred:
-        # Create source previews for citation guidance
-        source_list = ""
-        for i, result in enumerate(question_response.results[:actual_num_chunks]):
-            # Get the first 100 characters of each source as a preview
-            preview = result['chunk'][:100] + "..." if len(result['chunk']) > 100 else result['chunk']
-            source_list += f"Source {i+1}: {preview}\n\n"
-        
-        # RAG-specific system message - moved outside f-string to avoid backslash issue
-        context_section = f"Context:\n{context}"
-        sources_section = f"Sources:\n{source_list}"
-        
-        system_message = f"""You are an AI assistant specifically designed to answer questions based solely on the provided context. Your knowledge is limited to the information below.
-        
-{context_section}
-
-{sources_section}
-
-These sources are chunks from documents. Sources with the same number prefix come from the same document. The sources are already ranked by relevance, with Source 1 being the most relevant to the user's question. The sources include documents from various effective dates to provide comprehensive coverage. The number of sources provided ({actual_num_chunks}) was automatically selected based on the complexity of the question.
-
-Instructions:
-1. Carefully analyze the provided context.
-2. Answer questions only based on the above information.
-3. If the context lacks sufficient details, state specifically what information is missing. For example: "The provided sources mention X but don't specify Y, which would be needed to fully answer this question."
-4. Maintain a professional and concise tone.
-5. IMPORTANT: For each claim or piece of information in your response, add a citation marker like [1], [2], etc. that corresponds to the source number in the context. If a claim comes from multiple sources, include all relevant numbers like [1,3].
-6. Only cite sources that directly support your statement. Don't cite sources that weren't used.
-7. Be precise with your citations - make sure each citation points to a source that actually contains that specific information.
-8. Structure your answers in this format when possible:
-   - Start with a direct answer to the question
-   - Provide supporting details with proper citations
-   - If appropriate, include a brief summary at the end
-9. When answering complex questions, briefly explain your reasoning, showing how you arrived at the answer based on the provided sources.
-10. Be precise in your statements. Don't generalize beyond what the sources explicitly state. Maintain factual accuracy at all costs.
-11. Each source may include additional metadata, such as "Effective Date" which is stored as yyyy-mm-dd. If the question refers to effective dates or timeframes, use the "Effective Date" value from the relevant source(s) and cite them precisely. You can also infer the effective date from the title of the document if necessary. 
-12. When multiple sources with different effective dates contain relevant information, include information from all relevant sources and note the different effective dates in your response.
-13. Use all {actual_num_chunks} sources effectively - this number was specifically chosen based on the complexity of the question to provide comprehensive coverage.
-"""
+        # Pick a relevant but varied set of sources for the context
+        selected_results = rerank_results(question_response.results, actual_num_chunks, rerank_settings)
+        system_message = build_rag_system_message(selected_results, actual_num_chunks)
     else:
         # General-purpose system message (when Cortex Search is off)
-        system_message = """You are an advanced AI assistant designed to provide exceptional support. You have been trained on a wide range of knowledge and can answer questions across many domains.
-
-Instructions:
-1. Answer questions to the best of your abilities using your internal knowledge.
-2. Express uncertainty when you don't know something rather than making up information.
-3. Maintain a professional and concise tone in your responses.
-4. Structure your answers in this format when possible:
-   - Start with a direct answer to the question - Format so it is easy to read and understand
-   - Provide supporting details and explanations if needed
-   - If appropriate, include a brief summary at the end - YOU DO NOT ALWAYS HAVE TO DO THIS
-5. When answering complex questions, briefly explain your reasoning to help the user understand your thought process.
-6. Be precise in your statements and make clear distinctions between facts, opinions, and speculations.
-7. Consider the context of the conversation when formulating your responses.
-8. If the user asks for creative content like code, stories, or business ideas, feel free to be imaginative while ensuring practical usefulness.
-"""
+        system_message = GENERAL_SYSTEM_MESSAGE
     
     #--------------------------------------------------------------------------
     # GENERATE AND DISPLAY RESPONSE
     #--------------------------------------------------------------------------
     # Combine system instructions with conversation history and the new prompt
-    full_prompt = f"{system_message}\n{conversation_history}\nUser: {prompt}"
+    full_prompt = build_full_prompt(system_message, conversation_history, prompt)
     
+    # Shows this user's place in line while the completion scheduler is busy
+    queue_status = st.empty()
+
+    def show_queue_position(position):
+        if position:
+            queue_status.info(f"⏳ The assistant is busy - you are #{position} in line for an answer...")
+        else:
+            queue_status.empty()
+
     # Call the Cortex complete UDF
     try:
-        # Generate response using fixed model
-        response_df = session.create_dataframe([full_prompt]).select(
-            call_udf('snowflake.cortex.complete', FIXED_MODEL, concat(lit(full_prompt)))
-        )
-        full_response = response_df.collect()[0][0]
+        # Generate response using fixed model, queued behind other users' completions
+        # (the scheduler may switch long prompts to a smaller model when the queue is deep)
+        with wait_timer("complete"), query_stage("complete"):
+            # Joins the queued or running job of any session sending the identical
+            # prompt right now; this session still draws its own place in line
+            full_response, model_used = get_scheduler().complete(
+                get_current_user_id(), full_prompt, FIXED_MODEL,
+                timeout=COMPLETION_TIMEOUT_SECONDS,
+                on_position=show_queue_position,
+                key=completion_key(full_prompt, FIXED_MODEL)
+            )
+        queue_status.empty()
         
         # Store the response with source data if available
-        response_message = {"role": "assistant", "content": full_response}
+        response_message = {"role": "assistant", "content": full_response, "model": model_used}
         if cortex_search_on and not error_occurred and 'question_response' in locals():
-            response_message["source_data"] = question_response.results[:actual_num_chunks]
+            response_message["source_data"] = selected_results
             response_message["chunk_info"] = chunk_info_display
         
         # Add response to chat history
@@ -955,39 +967,46 @@ Instructions:
         # Save Q&A to CHAT_HISTORY table
         sources_json = None
         if cortex_search_on and not error_occurred and 'question_response' in locals():
-            try:
-                # Convert sources to JSON for storage
-                sources_data = []
-                for result in question_response.results[:actual_num_chunks]:
-                    sources_data.append({
-                        'chunk': result.get('chunk', ''),
-                        'relative_path': result.get('relative_path', ''),
-                        'eff_code_final_date': str(result.get('eff_code_final_date', ''))
-                    })
-                sources_json = json.dumps(sources_data)
-            except:
-                sources_json = None
+            sources_json = sources_to_json(selected_results)
         
-        # Save the Q&A pair to the database
-        save_chat_to_history(st.session_state.session_id, prompt, full_response, sources_json)
+        # Save the Q&A pair to the database (a regenerated answer replaces its cached turn's row)
+        if regenerate_chat_id:
+            response_message["chat_id"] = replace_chat_in_history(regenerate_chat_id, full_response, sources_json)
+        else:
+            response_message["chat_id"] = save_chat_to_history(st.session_state.session_id, prompt, full_response, sources_json)
         
         # Get the message index for the new response
         new_message_index = len(st.session_state.messages) - 1
         
         # Display the response with clickable citation links
         with st.chat_message("assistant"):
-            highlight_citations(full_response, show_sources)
+            num_sources = len(response_message["source_data"]) if "source_data" in response_message else None
+            highlight_citations(full_response, show_sources, num_sources)
+            if model_used != FIXED_MODEL:
+                st.caption(f"Answered with {model_used} because many questions were waiting.")
             
             # Add download response button BEFORE sources
             display_copy_button(full_response, message_index=new_message_index)
             
-            # Display sources if enabled (already ranked by relevance)
+            # Display sources if enabled (in the order they were selected)
             if cortex_search_on and not error_occurred and 'question_response' in locals():
-                display_sources(question_response.results[:actual_num_chunks], message_index=new_message_index, chunk_info=chunk_info_display)
+                display_sources(selected_results, message_index=new_message_index, chunk_info=chunk_info_display)
                 
         # Add feedback buttons for the new response
         user_question = prompt
         display_feedback_buttons(new_message_index, user_question, full_response)
                 
+    except TimeoutError:
+        queue_status.empty()
+        st.error("The assistant is very busy right now and your question timed out. Please try again in a minute.")
     except Exception as e:
+        queue_status.empty()
         st.error(f"An error occurred while processing the response: {str(e)}")
+
+# Log cold-start timings once per process
+mark_startup_complete()
+
+# Save this rerun's profile; its summary is shown in the sidebar on the next run
+profile_summary = finish_rerun_profile(rerun_profile)
+if profile_summary:
+    st.session_state.last_profile_summary = profile_summary
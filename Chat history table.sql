@@ -0,0 +1,40 @@
+-- Create chat history table in Snowflake
+CREATE TABLE IF NOT EXISTS MH_PUBLICATIONS.DATA.CHAT_HISTORY (
+    chat_id VARCHAR DEFAULT UUID_STRING(),
+    session_id VARCHAR,
+    user_question VARCHAR(16777216),
+    assistant_response VARCHAR(16777216),
+    sources_used VARCHAR(16777216),
+    created_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+    user_id VARCHAR DEFAULT 'anonymous',
+    PRIMARY KEY (chat_id)
+);
+
+-- Full-text index for the sidebar's question search (SEARCH(user_question, ...))
+ALTER TABLE MH_PUBLICATIONS.DATA.CHAT_HISTORY ADD SEARCH OPTIMIZATION ON FULL_TEXT(user_question);
+
+-- One row per chat session, used for keyset-paginated history browsing
+CREATE TABLE IF NOT EXISTS MH_PUBLICATIONS.DATA.CHAT_SESSIONS (
+    session_id VARCHAR,
+    first_question VARCHAR(16777216),
+    session_start TIMESTAMP,
+    last_activity TIMESTAMP,
+    user_id VARCHAR DEFAULT 'anonymous',
+    PRIMARY KEY (session_id)
+)
+CLUSTER BY (TO_DATE(last_activity));
+
+-- Backfill session summaries from existing history (skips sessions already present)
+INSERT INTO MH_PUBLICATIONS.DATA.CHAT_SESSIONS
+    (session_id, first_question, session_start, last_activity, user_id)
+SELECT
+    h.session_id,
+    MIN_BY(h.user_question, h.created_timestamp),
+    MIN(h.created_timestamp),
+    MAX(h.created_timestamp),
+    MAX(h.user_id)
+FROM MH_PUBLICATIONS.DATA.CHAT_HISTORY h
+WHERE NOT EXISTS (
+    SELECT 1 FROM MH_PUBLICATIONS.DATA.CHAT_SESSIONS s WHERE s.session_id = h.session_id
+)
+GROUP BY h.session_id;
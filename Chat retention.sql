@@ -0,0 +1,27 @@
+-- Retention for CHAT_HISTORY and CHAT_FEEDBACK (see retention.py)
+
+-- Cluster by day and user so date-bounded purges only touch the affected micro-partitions
+ALTER TABLE MH_PUBLICATIONS.DATA.CHAT_HISTORY CLUSTER BY (TO_DATE(created_timestamp), user_id);
+ALTER TABLE MH_PUBLICATIONS.DATA.CHAT_FEEDBACK CLUSTER BY (TO_DATE(feedback_timestamp), user_id);
+
+-- Register the purge as a stored procedure
+-- Upload the code first, e.g. from SnowSQL:
+--   PUT file://retention.py @MH_PUBLICATIONS.DATA.CODE_STAGE AUTO_COMPRESS = FALSE OVERWRITE = TRUE;
+--   PUT file://connection.py @MH_PUBLICATIONS.DATA.CODE_STAGE AUTO_COMPRESS = FALSE OVERWRITE = TRUE;
+CREATE OR REPLACE PROCEDURE MH_PUBLICATIONS.DATA.PURGE_CHAT_HISTORY(retention_days INTEGER, batch_days INTEGER, archive BOOLEAN)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.10'
+PACKAGES = ('snowflake-snowpark-python', 'snowflake.core')
+IMPORTS = ('@MH_PUBLICATIONS.DATA.CODE_STAGE/retention.py', '@MH_PUBLICATIONS.DATA.CODE_STAGE/connection.py')
+HANDLER = 'retention.purge_procedure'
+EXECUTE AS OWNER;
+
+-- Run it nightly: keep one year, purge a week per batch, archive what is removed
+CREATE OR REPLACE TASK MH_PUBLICATIONS.DATA.PURGE_CHAT_HISTORY_NIGHTLY
+    WAREHOUSE = AIPILOT_WH
+    SCHEDULE = 'USING CRON 0 3 * * * America/New_York'
+AS
+    CALL MH_PUBLICATIONS.DATA.PURGE_CHAT_HISTORY(365, 7, TRUE);
+
+ALTER TASK MH_PUBLICATIONS.DATA.PURGE_CHAT_HISTORY_NIGHTLY RESUME;
@@ -1,33 +1,181 @@
 # Search service set up 
+# Batch question answering over the Cortex Search Service.
+#
+# Single query:
+#   python "Search service set up.py" --query "<your query here>"
+#
+# Batch (CSV with a "question" column and optional "id" column, or JSONL with the same fields):
+#   python "Search service set up.py" --input questions.csv --output answers.jsonl --concurrency 4
+#
+# Each answer is appended to the output JSONL as soon as it completes, so an
+# interrupted run picks up where it left off when started again with the same output file.
+import argparse
+import csv
+import json
+import logging
 import os
-from snowflake.core import Root
-from snowflake.snowpark import Session
-
-CONNECTION_PARAMETERS = {
-	"account": os.environ["your_account_info"],
-	"user": os.environ["your_username"],
-	"password": os.environ["your_password"],
-	"role": "test_role",
-	"warehouse": "test_warehouse",
-	"database": "MH_PUBLICATIONS",
-	"schema": "DATA",
-}
-
-session = Session.builder.configs(CONNECTION_PARAMETERS).create()
-root = Root(session)
-
-# fetch service
-my_service = (root
-	.databases["MH_PUBLICATIONS"]
-	.schemas["DATA"]
-	.cortex_search_services["MH_PUBLICATIONS_SEARCH_SERVICE"]
-)
-
-# query service
-resp = my_service.search(
-	query="<your query here>",
-	columns=["CHUNK", "RELATIVE_PATH", "CHUNK_ORDER", "EFF_CODE_FINAL_DATE"],
-	limit=10,
-)
-
-print(resp.to_json())
\ No newline at end of file
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from connection import get_session, get_search_service
+from rag_pipeline import FIXED_MODEL, answer_question
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+#------------------------------------------------------------------------------
+# INPUT / OUTPUT
+#------------------------------------------------------------------------------
+
+def read_questions(input_path):
+	"""
+	Read questions from a CSV or JSONL file.
+	Each question gets an id from its "id" field, or its row number if there is none.
+	Raises ValueError on duplicate ids, which would collide in the output checkpoint.
+	"""
+	questions = []
+	seen = {}
+	if input_path.lower().endswith(".jsonl"):
+		with open(input_path, encoding="utf-8") as f:
+			rows = [json.loads(line) for line in f if line.strip()]
+	else:
+		with open(input_path, newline="", encoding="utf-8") as f:
+			rows = list(csv.DictReader(f))
+
+	for row_number, row in enumerate(rows, start=1):
+		question = (row.get("question") or "").strip()
+		if not question:
+			continue
+		question_id = row.get("id")
+		# 0 is a valid id; only a missing or blank one falls back to the row number
+		if question_id is None or str(question_id).strip() == "":
+			question_id = row_number
+		question_id = str(question_id).strip()
+		seen.setdefault(question_id, []).append(row_number)
+		questions.append({"id": question_id, "question": question})
+
+	duplicates = {question_id: rows for question_id, rows in seen.items() if len(rows) > 1}
+	if duplicates:
+		details = ", ".join(f"{question_id} (rows {', '.join(map(str, rows))})" for question_id, rows in list(duplicates.items())[:10])
+		raise ValueError(f"{len(duplicates)} duplicate question ids in {input_path}: {details}")
+	return questions
+
+def load_completed_ids(output_path):
+	"""Return the ids already answered in an existing output file (the checkpoint)"""
+	completed = set()
+	if not os.path.exists(output_path):
+		return completed
+	with open(output_path, encoding="utf-8") as f:
+		for line in f:
+			try:
+				completed.add(json.loads(line)["id"])
+			except (ValueError, KeyError):
+				# Partial last line from an interrupted write
+				continue
+	return completed
+
+def append_result(f, record):
+	"""Append one result and flush it to disk so it survives an interrupted run"""
+	f.write(json.dumps(record, default=str) + "\n")
+	f.flush()
+	os.fsync(f.fileno())
+
+#------------------------------------------------------------------------------
+# BATCH RUN
+#------------------------------------------------------------------------------
+
+def run_one(session, cortex_service, item, model):
+	"""Answer one question and shape it into an output record"""
+	start = time.perf_counter()
+	result = answer_question(session, cortex_service, item["question"], model=model)
+	return {
+		"id": item["id"],
+		"question": item["question"],
+		"answer": result["answer"],
+		"sources": [
+			{
+				"relative_path": source.get("relative_path", ""),
+				"eff_code_final_date": source.get("eff_code_final_date", ""),
+			}
+			for source in result["results"]
+		],
+		"num_chunks": result["num_chunks"],
+		"model": model,
+		"search_seconds": round(result["search_seconds"], 3),
+		"complete_seconds": round(result["complete_seconds"], 3),
+		"total_seconds": round(time.perf_counter() - start, 3),
+	}
+
+def run_batch(session, cortex_service, questions, output_path, concurrency=4, model=FIXED_MODEL):
+	"""
+	Answer questions with bounded concurrency over one shared session.
+	Questions already present in the output file are skipped.
+	Returns a summary dict with throughput and latency figures.
+	"""
+	completed_ids = load_completed_ids(output_path)
+	pending = [q for q in questions if q["id"] not in completed_ids]
+	logging.info(f"{len(questions)} questions, {len(completed_ids)} already answered, {len(pending)} to run")
+
+	latencies = []
+	failures = 0
+	batch_start = time.perf_counter()
+
+	# Results are written from this thread only, so no lock is needed on the file
+	with open(output_path, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=concurrency) as executor:
+		futures = {executor.submit(run_one, session, cortex_service, item, model): item for item in pending}
+		for done_count, future in enumerate(as_completed(futures), start=1):
+			item = futures[future]
+			try:
+				record = future.result()
+			except Exception as e:
+				failures += 1
+				logging.error(f"Question {item['id']} failed: {str(e)}")
+				continue
+			append_result(f, record)
+			latencies.append(record["total_seconds"])
+			if done_count % 10 == 0 or done_count == len(pending):
+				logging.info(f"{done_count}/{len(pending)} done")
+
+	elapsed = time.perf_counter() - batch_start
+	return {
+		"answered": len(latencies),
+		"failed": failures,
+		"skipped": len(questions) - len(pending),
+		"elapsed_seconds": round(elapsed, 1),
+		"questions_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+		"latency_p50_seconds": round(statistics.median(latencies), 2) if latencies else None,
+		"latency_p95_seconds": round(sorted(latencies)[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+	}
+
+#------------------------------------------------------------------------------
+# MAIN
+#------------------------------------------------------------------------------
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Query the MassHealth publications Cortex Search Service")
+	parser.add_argument("--query", help="Run a single search and print the raw response")
+	parser.add_argument("--input", help="CSV or JSONL file of questions to answer")
+	parser.add_argument("--output", default="answers.jsonl", help="JSONL file for answers (also the resume checkpoint)")
+	parser.add_argument("--concurrency", type=int, default=4, help="Questions answered in parallel")
+	parser.add_argument("--model", default=FIXED_MODEL, help="Model passed to snowflake.cortex.complete")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+	args = parse_args()
+
+	session = get_session()
+
+	# fetch service
+	my_service = get_search_service()
+
+	if args.input:
+		summary = run_batch(session, my_service, read_questions(args.input), args.output, args.concurrency, args.model)
+		print(json.dumps(summary, indent=2))
+	else:
+		# query service
+		resp = my_service.search(
+			query=args.query or "<your query here>",
+			columns=["CHUNK", "RELATIVE_PATH", "CHUNK_ORDER", "EFF_CODE_FINAL_DATE"],
+			limit=10,
+		)
+
+		print(resp.to_json())
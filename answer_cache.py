@@ -0,0 +1,290 @@
+# Answer cache
+# Pre-computed answers for the questions staff ask most often.
+#
+# The offline job clusters questions rated 👍 in CHAT_FEEDBACK, answers one
+# representative question per top cluster and stores the answer with its
+# sources in PREWARMED_ANSWERS. Re-running it refreshes answers whose source
+# documents changed on the stage.
+#
+#   python answer_cache.py --top 30
+#   python answer_cache.py --refresh-only
+#
+# The app loads the stored answers once and matches incoming prompts against
+# them in memory.
+import argparse
+import hashlib
+import json
+import logging
+import re
+from connection import DB_NAME, SCHEMA_NAME, get_session, get_search_service
+from rag_pipeline import FIXED_MODEL, answer_question, sources_to_json
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+stage_name = '@upload_070225'
+
+# Questions at least this similar are put in the same cluster
+CLUSTER_SIMILARITY = 0.6
+
+# An incoming prompt must be at least this similar to a clustered question to be served from the store
+MATCH_SIMILARITY = 0.75
+
+# Member questions kept per cluster for matching
+MAX_MEMBERS_PER_CLUSTER = 50
+
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'do', 'does', 'did',
+    'i', 'we', 'you', 'my', 'our', 'me', 'to', 'of', 'in', 'on', 'for', 'at', 'by',
+    'with', 'and', 'or', 'can', 'could', 'would', 'should', 'what', 'how', 'please',
+    'tell', 'about', 'there', 'it', 'this', 'that', 'if', 'any',
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+#------------------------------------------------------------------------------
+# QUESTION SIMILARITY
+#------------------------------------------------------------------------------
+
+def question_tokens(question):
+    """Normalized content words of a question"""
+    return frozenset(t for t in _TOKEN_PATTERN.findall(question.lower()) if t not in STOPWORDS)
+
+def token_similarity(tokens_a, tokens_b):
+    """Jaccard similarity between two token sets"""
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+def cluster_questions(questions, similarity=CLUSTER_SIMILARITY):
+    """
+    Greedy single-pass clustering of questions.
+    The most frequently asked questions are seen first and become cluster leaders.
+    Returns clusters sorted by size, largest first, as dicts with
+    "representative", "members" and "size".
+    """
+    counts = {}
+    for question in questions:
+        key = question.strip()
+        if key:
+            counts[key] = counts.get(key, 0) + 1
+
+    clusters = []
+    for question, count in sorted(counts.items(), key=lambda item: -item[1]):
+        tokens = question_tokens(question)
+        for cluster in clusters:
+            if token_similarity(tokens, cluster["tokens"]) >= similarity:
+                cluster["members"].append(question)
+                cluster["size"] += count
+                break
+        else:
+            clusters.append({"representative": question, "tokens": tokens, "members": [question], "size": count})
+
+    clusters.sort(key=lambda c: -c["size"])
+    return clusters
+
+#------------------------------------------------------------------------------
+# STORE
+#------------------------------------------------------------------------------
+
+def ensure_table(session):
+    """Create the PREWARMED_ANSWERS table if it doesn't exist"""
+    session.sql(f"""
+    CREATE TABLE IF NOT EXISTS {db_name}.{schema_name}.PREWARMED_ANSWERS (
+        cluster_id VARCHAR,
+        representative_question VARCHAR(16777216),
+        member_questions VARCHAR(16777216),
+        cluster_size INTEGER,
+        assistant_response VARCHAR(16777216),
+        sources_used VARCHAR(16777216),
+        documents_fingerprint VARCHAR,
+        model VARCHAR,
+        created_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+        PRIMARY KEY (cluster_id)
+    )
+    """).collect()
+
+def load_positive_questions(session):
+    """Questions users rated 👍"""
+    rows = session.sql(f"""
+    SELECT user_question
+    FROM {db_name}.{schema_name}.CHAT_FEEDBACK
+    WHERE feedback_type = 'positive' AND user_question IS NOT NULL
+    """).collect()
+    return [row['USER_QUESTION'] for row in rows]
+
+def documents_fingerprint(session, relative_paths):
+    """
+    Hash of the stage's MD5 and last-modified time for each source document.
+    Changes whenever one of the documents behind an answer is replaced.
+    """
+    paths = sorted(set(p for p in relative_paths if p))
+    if not paths:
+        return ""
+    placeholders = ", ".join("?" for _ in paths)
+    rows = session.sql(f"""
+    SELECT REGEXP_REPLACE(relative_path, '^\\\\.', '') AS relative_path, md5, last_modified
+    FROM directory({stage_name})
+    WHERE REGEXP_REPLACE(relative_path, '^\\\\.', '') IN ({placeholders})
+    ORDER BY relative_path
+    """, params=paths).collect()
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(f"{row['RELATIVE_PATH']}|{row['MD5']}|{row['LAST_MODIFIED']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def cluster_id_for(representative_question):
+    """Stable id for a cluster, derived from its representative question's content words"""
+    key = " ".join(sorted(question_tokens(representative_question)))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def store_answer(session, cluster, result, fingerprint, model):
+    """Insert or replace the stored answer for one cluster"""
+    session.sql(f"""
+    MERGE INTO {db_name}.{schema_name}.PREWARMED_ANSWERS t
+    USING (SELECT ? AS cluster_id, ? AS representative_question, ? AS member_questions, ? AS cluster_size,
+                  ? AS assistant_response, ? AS sources_used, ? AS documents_fingerprint, ? AS model) s
+    ON t.cluster_id = s.cluster_id
+    WHEN MATCHED THEN UPDATE SET
+        representative_question = s.representative_question,
+        member_questions = s.member_questions,
+        cluster_size = s.cluster_size,
+        assistant_response = s.assistant_response,
+        sources_used = s.sources_used,
+        documents_fingerprint = s.documents_fingerprint,
+        model = s.model,
+        created_timestamp = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT
+        (cluster_id, representative_question, member_questions, cluster_size,
+         assistant_response, sources_used, documents_fingerprint, model)
+        VALUES (s.cluster_id, s.representative_question, s.member_questions, s.cluster_size,
+                s.assistant_response, s.sources_used, s.documents_fingerprint, s.model)
+    """, params=[
+        cluster_id_for(cluster["representative"]),
+        cluster["representative"],
+        json.dumps(cluster["members"][:MAX_MEMBERS_PER_CLUSTER]),
+        cluster["size"],
+        result["answer"],
+        sources_to_json(result["results"]),
+        fingerprint,
+        model,
+    ]).collect()
+
+def remove_other_clusters(session, cluster_ids):
+    """
+    Delete stored answers for clusters not in this build: clusters that dropped
+    out of the top N, or whose representative question (and so id) changed.
+    """
+    if not cluster_ids:
+        session.sql(f"DELETE FROM {db_name}.{schema_name}.PREWARMED_ANSWERS").collect()
+        return
+    placeholders = ", ".join("?" for _ in cluster_ids)
+    session.sql(f"""
+    DELETE FROM {db_name}.{schema_name}.PREWARMED_ANSWERS
+    WHERE cluster_id NOT IN ({placeholders})
+    """, params=list(cluster_ids)).collect()
+
+def load_prewarmed_answers(session):
+    """
+    Load every stored answer, with member-question tokens precomputed for matching.
+    Returns [] if the table doesn't exist yet.
+    """
+    try:
+        rows = session.sql(f"""
+        SELECT cluster_id, representative_question, member_questions, cluster_size,
+               assistant_response, sources_used, documents_fingerprint, created_timestamp
+        FROM {db_name}.{schema_name}.PREWARMED_ANSWERS
+        """).collect()
+    except Exception as e:
+        logging.warning(f"Pre-warmed answers unavailable: {str(e)}")
+        return []
+
+    entries = []
+    for row in rows:
+        try:
+            members = json.loads(row['MEMBER_QUESTIONS'] or '[]')
+            sources = json.loads(row['SOURCES_USED'] or '[]')
+        except ValueError:
+            continue
+        entries.append({
+            "cluster_id": row['CLUSTER_ID'],
+            "representative_question": row['REPRESENTATIVE_QUESTION'],
+            "members": members,
+            "cluster_size": row['CLUSTER_SIZE'],
+            "member_tokens": [question_tokens(q) for q in members],
+            "answer": row['ASSISTANT_RESPONSE'],
+            "sources": sources,
+            "documents_fingerprint": row['DOCUMENTS_FINGERPRINT'],
+            "created_timestamp": row['CREATED_TIMESTAMP'],
+        })
+    return entries
+
+def match_prewarmed_answer(prompt, entries, threshold=MATCH_SIMILARITY):
+    """Return the stored entry whose cluster best matches the prompt, or None"""
+    tokens = question_tokens(prompt)
+    if not tokens:
+        return None
+    best_entry, best_score = None, threshold
+    for entry in entries:
+        for member_tokens in entry["member_tokens"]:
+            score = token_similarity(tokens, member_tokens)
+            if score >= best_score:
+                best_entry, best_score = entry, score
+    return best_entry
+
+#------------------------------------------------------------------------------
+# OFFLINE JOB
+#------------------------------------------------------------------------------
+
+def build_prewarmed_answers(session, cortex_service, top_n=30, model=FIXED_MODEL):
+    """Cluster 👍 questions and (re)compute answers for the top clusters"""
+    ensure_table(session)
+    clusters = cluster_questions(load_positive_questions(session))[:top_n]
+    logging.info(f"Answering {len(clusters)} top question clusters")
+    remove_other_clusters(session, [cluster_id_for(cluster["representative"]) for cluster in clusters])
+    for cluster in clusters:
+        try:
+            result = answer_question(session, cortex_service, cluster["representative"], model=model)
+            fingerprint = documents_fingerprint(session, [r.get('relative_path', '') for r in result["results"]])
+            store_answer(session, cluster, result, fingerprint, model)
+        except Exception as e:
+            logging.error(f"Could not pre-compute answer for '{cluster['representative']}': {str(e)}")
+
+def refresh_stale_answers(session, cortex_service, model=FIXED_MODEL):
+    """Regenerate stored answers whose source documents changed since they were computed"""
+    ensure_table(session)
+    refreshed = 0
+    for entry in load_prewarmed_answers(session):
+        paths = [s.get('relative_path', '') for s in entry["sources"]]
+        if documents_fingerprint(session, paths) == entry["documents_fingerprint"]:
+            continue
+        cluster = {
+            "representative": entry["representative_question"],
+            "members": entry["members"],
+            "size": entry["cluster_size"],
+        }
+        try:
+            result = answer_question(session, cortex_service, cluster["representative"], model=model)
+            fingerprint = documents_fingerprint(session, [r.get('relative_path', '') for r in result["results"]])
+            store_answer(session, cluster, result, fingerprint, model)
+            refreshed += 1
+        except Exception as e:
+            logging.error(f"Could not refresh answer for '{cluster['representative']}': {str(e)}")
+    logging.info(f"Refreshed {refreshed} stale answer(s)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-compute answers for frequent 👍 questions")
+    parser.add_argument("--top", type=int, default=30, help="Number of largest question clusters to answer")
+    parser.add_argument("--refresh-only", action="store_true", help="Only regenerate answers whose documents changed")
+    parser.add_argument("--model", default=FIXED_MODEL, help="Model passed to snowflake.cortex.complete")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    session = get_session()
+    cortex_service = get_search_service()
+    if args.refresh_only:
+        refresh_stale_answers(session, cortex_service, args.model)
+    else:
+        build_prewarmed_answers(session, cortex_service, args.top, args.model)
@@ -0,0 +1,121 @@
+# Chunker benchmark
+# Measures chunker.py throughput on a sample corpus.
+#
+# Pull a sample of PDFs through PARSE_DOCUMENT (LAYOUT) once and keep the JSON locally:
+#   python benchmark_chunker.py --corpus sample_corpus --from-stage 50
+# Then benchmark against the saved corpus (any *.json LAYOUT results, *.md or *.txt files):
+#   python benchmark_chunker.py --corpus sample_corpus
+# With no corpus, a synthetic policy-style document set is generated.
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import time
+from chunker import chunk_layout, count_tokens
+
+# (chunk_size, overlap) pairs benchmarked by default
+DEFAULT_CONFIGS = [(256, 32), (512, 64), (1024, 128)]
+
+def fetch_stage_sample(corpus_dir, sample_size):
+    """Parse a sample of staged documents with PARSE_DOCUMENT and save the LAYOUT JSON"""
+    from connection import get_session
+
+    session = get_session()
+    os.makedirs(corpus_dir, exist_ok=True)
+    rows = session.sql(f"""
+    SELECT relative_path,
+           TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@upload_070225, relative_path, {{'mode': 'LAYOUT'}})) AS layout
+    FROM (SELECT relative_path FROM directory(@upload_070225) WHERE relative_path ILIKE '%.pdf' LIMIT {int(sample_size)})
+    """).collect()
+    for row in rows:
+        safe_filename = row['RELATIVE_PATH'].replace('/', '_').replace('\\', '_').replace(':', '_')
+        with open(os.path.join(corpus_dir, f"{safe_filename}.json"), "w", encoding="utf-8") as f:
+            f.write(row['LAYOUT'])
+    print(f"Saved {len(rows)} parsed documents to {corpus_dir}")
+
+def load_corpus(corpus_dir):
+    """Read every LAYOUT JSON, markdown and text file in a directory"""
+    documents = []
+    for pattern in ("*.json", "*.md", "*.txt"):
+        for path in sorted(glob.glob(os.path.join(corpus_dir, pattern))):
+            with open(path, encoding="utf-8") as f:
+                documents.append(f.read())
+    return documents
+
+def synthetic_corpus(num_documents=200, seed=7, form_every=20):
+    """
+    Policy-bulletin-like LAYOUT documents with headings, paragraphs, lists and
+    tables. Every form_every-th document is instead one long run of text with
+    no sentence punctuation, like PARSE_DOCUMENT output for forms and
+    non-markdown tables, which can only be split between words.
+    """
+    rng = random.Random(seed)
+    words = ("member eligibility coverage MassHealth provider enrollment benefit service "
+             "application income household premium requirement effective date bulletin").split()
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(8, 25))).capitalize() + "."
+
+    documents = []
+    for n in range(num_documents):
+        if form_every and n % form_every == form_every - 1:
+            form_text = " ".join(rng.choice(words) for _ in range(rng.randint(5000, 20000)))
+            documents.append(json.dumps({"content": f"## Form {n}\n\n{form_text}", "metadata": {"pageCount": 1}}))
+            continue
+        parts = []
+        for section in range(rng.randint(3, 8)):
+            parts.append(f"## Section {section + 1}")
+            parts.append(" ".join(sentence() for _ in range(rng.randint(3, 20))))
+            parts.append("\n".join(f"- {sentence()}" for _ in range(rng.randint(0, 6))))
+            if rng.random() < 0.4:
+                rows = [f"| {rng.choice(words)} | {rng.randint(1, 999)} | {sentence()} |" for _ in range(rng.randint(3, 40))]
+                parts.append("\n".join(["| Item | Amount | Notes |", "|---|---|---|"] + rows))
+        documents.append(json.dumps({"content": "\n\n".join(parts), "metadata": {"pageCount": 1}}))
+    return documents
+
+def benchmark(documents, chunk_size, overlap, repeats=3):
+    """Chunk every document `repeats` times and report the best run"""
+    total_bytes = sum(len(d.encode("utf-8")) for d in documents)
+    best = None
+    chunk_tokens = []
+    for _ in range(repeats):
+        chunk_tokens = []
+        start = time.perf_counter()
+        for document in documents:
+            for _, chunk in chunk_layout(document, chunk_size, overlap):
+                chunk_tokens.append(count_tokens(chunk))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "documents": len(documents),
+        "chunks": len(chunk_tokens),
+        "seconds": best,
+        "docs_per_second": len(documents) / best if best else 0.0,
+        "mb_per_second": total_bytes / 1e6 / best if best else 0.0,
+        "mean_tokens": statistics.mean(chunk_tokens) if chunk_tokens else 0,
+        "max_tokens": max(chunk_tokens) if chunk_tokens else 0,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the layout-aware chunker")
+    parser.add_argument("--corpus", help="Directory of LAYOUT JSON / markdown / text files")
+    parser.add_argument("--from-stage", type=int, metavar="N", help="First parse N staged PDFs into --corpus")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per configuration (best is reported)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.from_stage:
+        fetch_stage_sample(args.corpus or "sample_corpus", args.from_stage)
+    documents = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    print(f"Corpus: {len(documents)} documents, {sum(len(d) for d in documents) / 1e6:.1f} MB")
+    print(f"{'size':>6} {'overlap':>8} {'chunks':>8} {'seconds':>8} {'docs/s':>9} {'MB/s':>7} {'mean tok':>9} {'max tok':>8}")
+    for chunk_size, overlap in DEFAULT_CONFIGS:
+        r = benchmark(documents, chunk_size, overlap, args.repeats)
+        print(f"{r['chunk_size']:>6} {r['overlap']:>8} {r['chunks']:>8} {r['seconds']:>8.3f} "
+              f"{r['docs_per_second']:>9.1f} {r['mb_per_second']:>7.2f} {r['mean_tokens']:>9.1f} {r['max_tokens']:>8}")
@@ -0,0 +1,77 @@
+# Reranking benchmark
+# Measures the cost of reranking.py on 100-1000 candidates and how much it
+# diversifies the selected sources compared with the plain top k.
+#
+#   python benchmark_reranking.py
+#   python benchmark_reranking.py --sizes 100 500 1000 --k 15 --repeats 50
+#
+# Candidates are synthetic policy-style chunks in which a few long publications
+# dominate the top ranks, like a strong single-document match in production.
+import argparse
+import random
+import statistics
+import time
+from reranking import RERANK_DEFAULTS, rerank_results
+
+DEFAULT_SIZES = [100, 250, 500, 1000]
+
+def synthetic_candidates(num_candidates, seed=11):
+    """Ranked chunks where the top results mostly come from a handful of documents"""
+    rng = random.Random(seed)
+    words = ("member eligibility coverage MassHealth provider enrollment benefit service "
+             "application income household premium requirement effective date bulletin "
+             "pharmacy dental transportation hospital nursing facility managed care").split()
+    dominant = [f"manuals/provider-manual-{i}.pdf" for i in range(3)]
+    others = [f"bulletins/{topic}-bulletin-{year}-{n:02d}.pdf"
+              for topic in ("pharmacy", "dental", "eligibility", "hospital")
+              for year in (22, 23, 24, 25) for n in range(1, 5)]
+
+    candidates = []
+    for rank in range(num_candidates):
+        # The first ranks are mostly chunks of the dominant documents
+        if rng.random() < max(0.1, 0.9 - rank / 40):
+            path = rng.choice(dominant)
+        else:
+            path = rng.choice(others)
+        year = 2000 + int(path.split("-")[-2]) if path.startswith("bulletins") else 2024
+        candidates.append({
+            "chunk": " ".join(rng.choice(words) for _ in range(rng.randint(150, 400))),
+            "relative_path": path,
+            "eff_code_final_date": f"{year}-{rng.randint(1, 12):02d}-01",
+        })
+    return candidates
+
+def benchmark(candidates, k, repeats, config):
+    """Time rerank_results over all candidates and compare document spread with the top k"""
+    timings = []
+    selected = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        selected = rerank_results(candidates, k, config)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "candidates": len(candidates),
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(0.95 * len(timings)))],
+        "top_k_documents": len({c["relative_path"] for c in candidates[:k]}),
+        "reranked_documents": len({c["relative_path"] for c in selected}),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark diversity reranking")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Candidate counts to benchmark")
+    parser.add_argument("--k", type=int, default=15, help="Results selected for the context")
+    parser.add_argument("--repeats", type=int, default=20, help="Runs per size")
+    parser.add_argument("--lambda", dest="mmr_lambda", type=float, default=RERANK_DEFAULTS["lambda"], help="MMR relevance weight")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"{'candidates':>10} {'median ms':>10} {'p95 ms':>8} {'top-k docs':>11} {'reranked docs':>14}")
+    for size in args.sizes:
+        # The whole candidate list is the shortlist here, to measure the worst case
+        config = {"lambda": args.mmr_lambda, "shortlist": size}
+        r = benchmark(synthetic_candidates(size), args.k, args.repeats, config)
+        print(f"{r['candidates']:>10} {r['median_ms']:>10.2f} {r['p95_ms']:>8.2f} "
+              f"{r['top_k_documents']:>11} {r['reranked_documents']:>14}")
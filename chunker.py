@@ -0,0 +1,295 @@
+# Chunker
+# Layout-aware, streaming text chunker for PARSE_DOCUMENT LAYOUT output.
+#
+# Reads the LAYOUT JSON directly ({"content": "<markdown>", "metadata": {...}},
+# or a "pages" list when page_split is on), splits the markdown into headings,
+# tables, lists and paragraphs, and packs those blocks into chunks of a
+# configurable token size with overlap. Tables are split between rows with the
+# header repeated, lists between items, and paragraphs between sentences.
+#
+# Runs locally (chunk_layout / chunk_text generators) and inside Snowflake as a
+# vectorized UDTF (LayoutChunkerUDTF, registered in tablecreation_chunking.sql).
+import json
+import re
+
+# Default chunk size and overlap, in tokens
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 64
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s+")
+_TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?$")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])")
+
+def count_tokens(text):
+    """
+    Approximate token count: words and punctuation marks.
+    Close to (slightly above) what subword tokenizers report for English policy text.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+#------------------------------------------------------------------------------
+# LAYOUT PARSING
+#------------------------------------------------------------------------------
+
+def layout_pages(layout):
+    """
+    Yield the markdown content of a PARSE_DOCUMENT LAYOUT result, page by page.
+    Accepts the JSON string or the already-parsed dict. Plain text that is not
+    JSON is treated as a single page of markdown.
+    """
+    if isinstance(layout, str):
+        try:
+            layout = json.loads(layout)
+        except ValueError:
+            yield layout
+            return
+    if not isinstance(layout, dict):
+        return
+    if layout.get("pages"):
+        for page in layout["pages"]:
+            yield page.get("content", "")
+    else:
+        yield layout.get("content", "")
+
+def layout_blocks(markdown):
+    """
+    Split LAYOUT markdown into structural blocks.
+    Yields (kind, lines) tuples where kind is "heading", "table", "list" or "paragraph".
+    """
+    kind, lines = None, []
+    for raw_line in markdown.splitlines():
+        line = raw_line.rstrip()
+        if not line.strip():
+            if kind in ("paragraph", "table"):
+                yield kind, lines
+                kind, lines = None, []
+            continue
+
+        if _HEADING_PATTERN.match(line):
+            if lines:
+                yield kind, lines
+            yield "heading", [line]
+            kind, lines = None, []
+            continue
+
+        if line.lstrip().startswith("|"):
+            line_kind = "table"
+        elif _LIST_ITEM_PATTERN.match(line):
+            line_kind = "list"
+        elif kind == "list" and raw_line[:1].isspace():
+            # Indented continuation of the previous list item
+            line_kind = "list"
+        else:
+            line_kind = "paragraph"
+
+        if line_kind != kind and lines:
+            yield kind, lines
+            lines = []
+        kind = line_kind
+        lines.append(line)
+
+    if lines:
+        yield kind, lines
+
+#------------------------------------------------------------------------------
+# SPLITTING OVERSIZED BLOCKS
+#------------------------------------------------------------------------------
+
+def _split_units(kind, lines):
+    """
+    Break a block into the smallest units it may be split between.
+    Returns (units, repeat_prefix): repeat_prefix is the table header that is
+    repeated at the top of every piece of a split table.
+    """
+    if kind == "table":
+        header = lines[:2] if len(lines) > 1 and _TABLE_SEPARATOR_PATTERN.match(lines[1].strip()) else lines[:1]
+        rows = lines[len(header):]
+        if not rows:
+            return header, ""
+        # The first piece carries the header with it
+        return ["\n".join(header + rows[:1])] + rows[1:], "\n".join(header)
+    if kind == "list":
+        items = []
+        for line in lines:
+            if _LIST_ITEM_PATTERN.match(line) or not items:
+                items.append(line)
+            else:
+                items[-1] += "\n" + line
+        return items, ""
+    return [s for s in _SENTENCE_PATTERN.split(" ".join(lines)) if s], ""
+
+def _split_words(text, max_tokens, token_counter):
+    """
+    Last resort for a single sentence or row longer than a chunk. Tokens are
+    counted per word and summed (tokens never span a space), so this is linear
+    in the text; a piece only exceeds max_tokens if one word does.
+    """
+    piece, piece_tokens = [], 0
+    for word in text.split(" "):
+        word_tokens = token_counter(word)
+        if piece and piece_tokens + word_tokens > max_tokens:
+            yield " ".join(piece)
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += word_tokens
+    if piece:
+        yield " ".join(piece)
+
+def _last_within(pieces, max_tokens, token_counter):
+    """The longest run of trailing pieces whose summed token counts fit in max_tokens"""
+    kept, used = [], 0
+    for piece in reversed(pieces):
+        piece_tokens = token_counter(piece)
+        if used + piece_tokens > max_tokens:
+            break
+        kept.append(piece)
+        used += piece_tokens
+    return " ".join(reversed(kept))
+
+def _tail(text, max_tokens, token_counter):
+    """The last sentences of text within max_tokens, or its last words if no sentence fits"""
+    sentences = [s for s in _SENTENCE_PATTERN.split(text) if s]
+    return (_last_within(sentences, max_tokens, token_counter)
+            or _last_within(text.split(" "), max_tokens, token_counter))
+
+#------------------------------------------------------------------------------
+# CHUNKING
+#------------------------------------------------------------------------------
+
+def chunk_markdown(markdown, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                   token_counter=count_tokens, include_headings=True):
+    """
+    Pack layout blocks into chunks of at most chunk_size tokens.
+
+    A heading always starts a new chunk, and each chunk is prefixed with the
+    heading it falls under so it stays self-describing. Blocks too large for
+    one chunk are split between rows, items or sentences. Consecutive chunks in
+    the same section share up to `overlap` tokens of trailing units.
+
+    Yields chunk strings.
+    """
+    heading = ""
+    units = []         # (separator, text, tokens) pieces in the current chunk
+    used = 0
+
+    def heading_prefix():
+        return heading + "\n\n" if include_headings and heading else ""
+
+    def flush():
+        body = "".join(sep + text for sep, text, _ in units).lstrip("\n ")
+        return (heading_prefix() + body).strip()
+
+    def carry_overlap():
+        # Keep whole trailing units that fit within the overlap budget, then
+        # the tail (last sentences or words) of the first unit that doesn't
+        carried, carried_tokens = [], 0
+        for unit in reversed(units):
+            if carried_tokens + unit[2] > overlap:
+                separator, text, _ = unit
+                # Table rows are never cut; a partial row is meaningless
+                if not text.lstrip().startswith("|"):
+                    tail = _tail(text, overlap - carried_tokens, token_counter)
+                    if tail:
+                        tail_tokens = token_counter(tail)
+                        carried.insert(0, (separator, tail, tail_tokens))
+                        carried_tokens += tail_tokens
+                break
+            carried.insert(0, unit)
+            carried_tokens += unit[2]
+        return carried, carried_tokens
+
+    for kind, lines in layout_blocks(markdown):
+        if kind == "heading":
+            if units:
+                yield flush()
+            units, used = [], 0
+            heading = lines[0]
+            continue
+
+        # Leave room for the heading prefix, but never squeeze the body below half a chunk
+        budget = max(chunk_size - token_counter(heading_prefix()), chunk_size // 2)
+        joiner = " " if kind == "paragraph" else "\n"
+        block_text = joiner.join(lines)
+
+        if token_counter(block_text) <= budget:
+            block_units, repeat_prefix = [block_text], ""
+        else:
+            block_units, repeat_prefix = _split_units(kind, lines)
+        prefix_tokens = token_counter(repeat_prefix) if repeat_prefix else 0
+
+        separator = "\n\n"
+        for unit in block_units:
+            unit_tokens = token_counter(unit)
+            if unit_tokens + prefix_tokens > budget:
+                sub_units = _split_words(unit, max(1, budget - prefix_tokens), token_counter)
+            else:
+                sub_units = [unit]
+            for sub_unit in sub_units:
+                sub_tokens = token_counter(sub_unit)
+                if units and used + sub_tokens > budget:
+                    yield flush()
+                    if repeat_prefix:
+                        # Table rows stand alone: repeat the header instead of overlapping rows
+                        units, used = [("\n\n", repeat_prefix, prefix_tokens)], prefix_tokens
+                    else:
+                        units, used = carry_overlap()
+                        if used + sub_tokens > budget:
+                            units, used = [], 0
+                units.append((separator, sub_unit, sub_tokens))
+                used += sub_tokens
+                separator = joiner
+
+    if units:
+        yield flush()
+
+def chunk_layout(layout, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                 token_counter=count_tokens, include_headings=True):
+    """
+    Chunk a PARSE_DOCUMENT LAYOUT result (JSON string or dict).
+    Yields (chunk_order, chunk) tuples, numbered from 1 across all pages.
+    """
+    chunk_order = 0
+    for page in layout_pages(layout):
+        for chunk in chunk_markdown(page, chunk_size, overlap, token_counter, include_headings):
+            chunk_order += 1
+            yield chunk_order, chunk
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Chunk plain text or markdown that did not come from PARSE_DOCUMENT"""
+    return chunk_layout({"content": text}, chunk_size, overlap)
+
+#------------------------------------------------------------------------------
+# SNOWFLAKE UDTF
+#------------------------------------------------------------------------------
+
+class LayoutChunkerUDTF:
+    """
+    Vectorized UDTF handler: chunks every document in a partition in one call.
+    Input columns are (relative_path, layout, chunk_size, overlap); output rows
+    are (relative_path, chunk_order, chunk). A NULL chunk_size or overlap uses
+    the module defaults.
+    """
+
+    def end_partition(self, df):
+        import pandas
+
+        rows = []
+        for values in df.itertuples(index=False):
+            relative_path, layout = values[0], values[1]
+            chunk_size = int(values[2]) if len(values) > 2 and values[2] else CHUNK_SIZE
+            overlap = int(values[3]) if len(values) > 3 and values[3] is not None else CHUNK_OVERLAP
+            if not layout:
+                continue
+            for chunk_order, chunk in chunk_layout(layout, chunk_size, overlap):
+                rows.append((relative_path, chunk_order, chunk))
+        return pandas.DataFrame(rows, columns=["RELATIVE_PATH", "CHUNK_ORDER", "CHUNK"])
+
+try:
+    # Only available inside Snowflake's Python runtime
+    from _snowflake import vectorized
+    import pandas
+    LayoutChunkerUDTF.end_partition = vectorized(input=pandas.DataFrame)(LayoutChunkerUDTF.end_partition)
+except ImportError:
+    pass
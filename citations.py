@@ -0,0 +1,49 @@
+# Citations
+# Renders citation markers like [1] or [2,3] in assistant answers as
+# highlighted links, in one regex pass per message, and checks them against
+# the number of sources the answer was given.
+import re
+from functools import lru_cache
+
+_CITATION_PATTERN = re.compile(r'\[(\d+(?:,\s*\d+)*)\]')
+_NUMBER_PATTERN = re.compile(r'\d+')
+
+CITATION_STYLE = "color: #ff4b4b; font-weight: bold;"
+INVALID_CITATION_STYLE = "color: #999999; font-weight: bold; text-decoration: line-through;"
+
+@lru_cache(maxsize=1024)
+def render_citations(text, num_sources=None, show_sources=True):
+    """
+    Convert an answer into a single markdown/HTML block with highlighted citations.
+
+    Args:
+        text (str): The answer text containing citation markers like [1], [2,3]
+        num_sources (int): Number of sources the answer was given; markers outside
+            1..num_sources are flagged. None skips the check.
+        show_sources (bool): Whether to make citations clickable links to sources
+
+    Returns:
+        tuple: (markdown string, sorted tuple of out-of-range citation numbers)
+
+    Results are memoized on the message content, so re-rendering history on
+    every rerun does no regex work for messages already seen.
+    """
+    invalid = set()
+
+    def replace(match):
+        part = match.group(0)
+        citation_nums = _NUMBER_PATTERN.findall(match.group(1))
+        bad = [n for n in citation_nums if num_sources is not None and not 1 <= int(n) <= num_sources]
+        if bad:
+            invalid.update(int(n) for n in bad)
+            return f'<span style="{INVALID_CITATION_STYLE}" title="Source {", ".join(bad)} not available">{part}</span>'
+        if show_sources:
+            # If sources are shown, make citations clickable
+            return f'<span style="{CITATION_STYLE}"><a href="#source_{"_".join(citation_nums)}" style="color: #ff4b4b; text-decoration: none;">{part}</a></span>'
+        # If sources are hidden, still highlight but don't make clickable
+        return f'<span style="{CITATION_STYLE}">{part}</span>'
+
+    # Each non-empty line becomes its own paragraph so line breaks survive in one block
+    lines = [line for line in text.split('\n') if line.strip()]
+    rendered = _CITATION_PATTERN.sub(replace, "\n\n".join(lines))
+    return rendered, tuple(sorted(invalid))
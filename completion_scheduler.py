@@ -0,0 +1,359 @@
+# Completion scheduler
+# Admission control and fair scheduling for snowflake.cortex.complete calls.
+#
+# Every session used to call complete as soon as its prompt was built, so a
+# burst of users saturated the warehouse and ran into Cortex rate limits. Now
+# at most MAX_CONCURRENT_COMPLETIONS calls run at once across the process.
+# Waiting requests are queued per user and served round-robin, so one user
+# with several open tabs can't starve everyone else. Callers can poll their
+# place in line while they wait. A request that waits past its timeout is
+# cancelled, and long prompts are sent to a smaller model while the queue is
+# deep. Calls rejected for rate limiting are retried with backoff.
+#
+# Requests submitted with the same key while a job for it is queued or running
+# (e.g. many staff asking about a bulletin that just landed) share that job.
+# Each caller still waits on it and polls its position separately, so every
+# session draws its own status and keeps its own timeout; the job is only
+# cancelled once no caller is waiting on it.
+#
+# FakeCompletionBackend simulates Cortex latency and rate limiting so the
+# scheduler can be exercised without a warehouse.
+import logging
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from query_tags import current_query_context, use_query_context
+
+# Completions allowed to run at once (override with MH_MAX_CONCURRENT_COMPLETIONS)
+MAX_CONCURRENT_COMPLETIONS = int(os.environ.get("MH_MAX_CONCURRENT_COMPLETIONS", "4"))
+
+# Seconds a request may wait and run in total before it is cancelled
+COMPLETION_TIMEOUT_SECONDS = 180
+
+# With at least this many requests waiting, prompts longer than LONG_PROMPT_CHARS go to SMALL_MODEL
+DEEP_QUEUE = 8
+LONG_PROMPT_CHARS = 24000
+SMALL_MODEL = 'llama3.1-8b'
+
+# Retries for calls rejected by Cortex rate limiting, with exponential backoff
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF_SECONDS = 2.0
+RATE_LIMIT_MARKERS = ("429", "rate limit", "too many requests")
+
+# How often a waiting caller is told its position
+POSITION_POLL_SECONDS = 0.5
+
+def is_rate_limit_error(error):
+    """True if an exception looks like Cortex rejecting the call for rate limiting"""
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+class CompletionJob:
+    """One queued completion request"""
+
+    def __init__(self, user_id, prompt, model, requested_model, key=None):
+        self.user_id = user_id
+        self.prompt = prompt
+        self.model = model
+        self.requested_model = requested_model
+        self.key = key
+        self.waiters = 1  # callers sharing the job (guarded by the scheduler's lock)
+        self.future = Future()
+        self.cancelled = threading.Event()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        # The submitter's query tag context, so the completion query is tagged like its caller's
+        self.query_context = current_query_context()
+
+    @property
+    def rerouted(self):
+        """True if the job was sent to the smaller model because the queue was deep"""
+        return self.model != self.requested_model
+
+class CompletionScheduler:
+    """
+    Runs completions through a backend with a concurrency cap and per-user fair queuing.
+
+    Args:
+        backend (callable): backend(prompt, model) -> response text
+        max_concurrent (int): Completions allowed to run at once
+        deep_queue (int): Queue depth at which long prompts are rerouted
+        long_prompt_chars (int): Prompt length considered long
+        small_model (str): Model used for rerouted prompts
+    """
+
+    def __init__(self, backend, max_concurrent=MAX_CONCURRENT_COMPLETIONS, deep_queue=DEEP_QUEUE,
+                 long_prompt_chars=LONG_PROMPT_CHARS, small_model=SMALL_MODEL,
+                 rate_limit_retries=RATE_LIMIT_RETRIES, rate_limit_backoff=RATE_LIMIT_BACKOFF_SECONDS):
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.deep_queue = deep_queue
+        self.long_prompt_chars = long_prompt_chars
+        self.small_model = small_model
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_backoff = rate_limit_backoff
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()  # user_id -> deque of waiting jobs, in round-robin order
+        self._shared = {}  # key -> queued or running job that identical requests join
+        self._running = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="complete")
+        self._metrics = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0, "timed_out": 0,
+                         "rerouted": 0, "rate_limited": 0}
+
+    #--------------------------------------------------------------------------
+    # QUEUEING
+    #--------------------------------------------------------------------------
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def submit(self, user_id, prompt, model, key=None):
+        """
+        Queue a completion and return its CompletionJob. With a key, a job
+        already queued or running for the same key is returned instead.
+        """
+        with self._lock:
+            shared = self._shared.get(key) if key is not None else None
+            if shared is not None and not shared.future.done():
+                shared.waiters += 1
+                self._metrics["coalesced"] += 1
+                return shared
+            depth = sum(len(q) for q in self._queues.values())
+            routed_model = model
+            if depth >= self.deep_queue and len(prompt) > self.long_prompt_chars and model != self.small_model:
+                routed_model = self.small_model
+                self._metrics["rerouted"] += 1
+            job = CompletionJob(user_id, prompt, routed_model, model, key)
+            if key is not None:
+                self._shared[key] = job
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._metrics["submitted"] += 1
+            self._dispatch_locked()
+        if job.rerouted:
+            logging.info(f"Queue depth {depth}: long prompt for {user_id} sent to {routed_model}.")
+        return job
+
+    def position(self, job):
+        """
+        Place in line: 0 once the job is running or done, otherwise how many
+        jobs will start before it (1 means it is next).
+        """
+        with self._lock:
+            queue = self._queues.get(job.user_id)
+            if not queue or job not in queue:
+                return 0
+            # Round-robin serves one job per user per round, in rotation order,
+            # so every earlier round and the users ahead in this round go first
+            round_index = queue.index(job)
+            ahead = 0
+            ahead_in_round = True
+            for user_id, user_queue in self._queues.items():
+                if user_id == job.user_id:
+                    ahead_in_round = False
+                ahead += min(len(user_queue), round_index)
+                if ahead_in_round and len(user_queue) > round_index:
+                    ahead += 1
+            return ahead + 1
+
+    def cancel(self, job):
+        """
+        Drop a waiting job, or flag a running one so its result is discarded.
+        A Cortex call already in progress can't be interrupted: a running job
+        keeps its slot until the call returns, but makes no further rate-limit
+        retries.
+        """
+        job.cancelled.set()
+        with self._lock:
+            self._forget_locked(job)
+            queue = self._queues.get(job.user_id)
+            if queue and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.user_id]
+        if not job.future.done():
+            job.future.cancel()
+
+    def _forget_locked(self, job):
+        """Stop new requests from joining the job"""
+        if job.key is not None and self._shared.get(job.key) is job:
+            del self._shared[job.key]
+
+    def _next_job_locked(self):
+        """Take the first waiting job of the next user in the rotation"""
+        while self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            # Move the user to the back of the rotation (or out of it when empty)
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            if not job.cancelled.is_set():
+                return job
+        return None
+
+    def _dispatch_locked(self):
+        while self._running < self.max_concurrent:
+            job = self._next_job_locked()
+            if job is None:
+                return
+            self._running += 1
+            job.started_at = time.monotonic()
+            self._executor.submit(self._run, job)
+
+    #--------------------------------------------------------------------------
+    # EXECUTION
+    #--------------------------------------------------------------------------
+
+    def _run(self, job):
+        try:
+            attempt = 0
+            while True:
+                if job.cancelled.is_set():
+                    return
+                try:
+                    with use_query_context(job.query_context):
+                        result = self.backend(job.prompt, job.model)
+                    break
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.rate_limit_retries:
+                        raise
+                    with self._lock:
+                        self._metrics["rate_limited"] += 1
+                    delay = self.rate_limit_backoff * (2 ** attempt)
+                    logging.warning(f"Cortex rate limit hit, retrying in {delay:.1f}s.")
+                    attempt += 1
+                    # Sleep in the slot so the backoff also eases load on Cortex
+                    job.cancelled.wait(delay)
+            with self._lock:
+                self._metrics["completed"] += 1
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_result(result)
+        except Exception as e:
+            with self._lock:
+                self._metrics["failed"] += 1
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._forget_locked(job)
+                self._running -= 1
+                self._dispatch_locked()
+
+    def wait(self, job, timeout=COMPLETION_TIMEOUT_SECONDS, on_position=None):
+        """
+        Wait for a job's result, reporting its place in line while it waits.
+        Call once per submit(); each caller of a shared job waits separately.
+        However the wait ends, the job is cancelled if no other caller is still
+        waiting on it.
+
+        Args:
+            job (CompletionJob): Job returned by submit
+            timeout (float): Seconds to wait before giving up
+            on_position (callable): Called with the position (see position()) whenever it changes
+
+        Raises:
+            TimeoutError: if the job did not finish in time
+        """
+        deadline = time.monotonic() + timeout
+        last_position = None
+        try:
+            while True:
+                position = self.position(job)
+                if on_position and position != last_position:
+                    on_position(position)
+                    last_position = position
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self._metrics["timed_out"] += 1
+                    raise TimeoutError(f"Completion did not finish within {timeout} seconds")
+                try:
+                    return job.future.result(timeout=min(POSITION_POLL_SECONDS, remaining))
+                except FutureTimeoutError:
+                    continue
+        finally:
+            # However the caller left (timeout, a Streamlit rerun or stop raised
+            # from on_position, ...), a job nobody waits on gives up its place
+            with self._lock:
+                job.waiters -= 1
+                abandoned = job.waiters == 0 and not job.future.done()
+                if abandoned:
+                    self._forget_locked(job)
+            if abandoned:
+                self.cancel(job)
+
+    def complete(self, user_id, prompt, model, timeout=COMPLETION_TIMEOUT_SECONDS, on_position=None, key=None):
+        """Submit (joining any job for the same key) and wait; returns (response text, model actually used)"""
+        job = self.submit(user_id, prompt, model, key)
+        return self.wait(job, timeout, on_position), job.model
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics, running=self._running, queued=sum(len(q) for q in self._queues.values()))
+
+#------------------------------------------------------------------------------
+# BACKENDS
+#------------------------------------------------------------------------------
+
+def snowflake_backend(prompt, model):
+    """Run the Cortex complete UDF on the shared session"""
+    from connection import get_session, run_with_reconnect
+    from rag_pipeline import complete
+
+    return run_with_reconnect(lambda: complete(get_session(), prompt, model))
+
+class FakeCompletionBackend:
+    """
+    Local stand-in for Cortex complete that simulates latency and rate limiting.
+
+    Args:
+        latency (float): Seconds each call takes (smaller models take half)
+        max_concurrent (int): Calls running at once beyond which calls are rejected
+        max_per_second (float): Calls started per second beyond which calls are rejected
+    """
+
+    def __init__(self, latency=0.2, max_concurrent=4, max_per_second=None, small_models=(SMALL_MODEL,)):
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.max_per_second = max_per_second
+        self.small_models = small_models
+        self._lock = threading.Lock()
+        self._running = 0
+        self._starts = deque()
+        self.peak_concurrency = 0
+        self.rejected = 0
+        self.calls = []  # (prompt, model) of each accepted call
+
+    def __call__(self, prompt, model):
+        with self._lock:
+            now = time.monotonic()
+            while self._starts and now - self._starts[0] > 1.0:
+                self._starts.popleft()
+            over_rate = self.max_per_second is not None and len(self._starts) >= self.max_per_second
+            if self._running >= self.max_concurrent or over_rate:
+                self.rejected += 1
+                raise RuntimeError("429 Too Many Requests: Cortex rate limit exceeded")
+            self._running += 1
+            self._starts.append(now)
+            self.peak_concurrency = max(self.peak_concurrency, self._running)
+            self.calls.append((prompt, model))
+        try:
+            time.sleep(self.latency / 2 if model in self.small_models else self.latency)
+            return f"[{model}] answer to: {prompt[-80:]}"
+        finally:
+            with self._lock:
+                self._running -= 1
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """The process-wide scheduler over the Snowflake backend"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CompletionScheduler(snowflake_backend)
+        return _scheduler
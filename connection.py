@@ -0,0 +1,200 @@
+# Connection
+# Lazily creates and caches the Snowpark session, the snowflake.core Root and
+# Cortex Search Service handles once per process, and resolves which versioned
+# search service is currently active (see search_service_admin.py). The Streamlit app, the batch
+# CLI and the evaluation runner all get their handles from here.
+import logging
+import os
+import threading
+import time
+from snowflake.core import Root
+from snowflake.snowpark import Session
+from query_tags import tag
+
+# Define database, schema, and search service names
+# Update these parameters as needed for your specific Snowflake setup
+DB_NAME = 'MH_PUBLICATIONS'
+SCHEMA_NAME = 'DATA'
+SEARCH_SERVICE_NAME = 'MH_PUBLICATIONS_SEARCH_SERVICE'
+
+# Table mapping the service alias above to the versioned service currently serving
+# (maintained by search_service_admin.py), and how long a lookup of it is reused
+SERVICE_REGISTRY_TABLE = 'SEARCH_SERVICE_REGISTRY'
+ACTIVE_SERVICE_TTL = 60
+
+# Seconds between health-check pings of a cached session
+HEALTH_CHECK_INTERVAL = 60
+
+# Error fragments Snowflake returns when a session or its token has expired
+EXPIRED_SESSION_MARKERS = (
+    "390114",  # Authentication token has expired
+    "390112",  # Your session has expired
+    "session no longer exists",
+    "authentication token has expired",
+)
+
+# Recorded when this module is first imported, i.e. when the process starts serving
+PROCESS_START = time.perf_counter()
+
+_lock = threading.RLock()
+_session = None
+_root = None
+_services = {}
+_last_health_check = 0.0
+_active_service = None  # (service name, monotonic time it was looked up)
+
+# Seconds spent on each one-time startup step (session, root, service lookups, first render)
+startup_timings = {}
+
+def connection_parameters():
+    """Connection parameters for running outside Snowflake (read from the environment)"""
+    return {
+        "account": os.environ["your_account_info"],
+        "user": os.environ["your_username"],
+        "password": os.environ["your_password"],
+        "role": "test_role",
+        "warehouse": "test_warehouse",
+        "database": DB_NAME,
+        "schema": SCHEMA_NAME,
+    }
+
+def _create_session():
+    """Use the active session inside Streamlit in Snowflake, otherwise connect with credentials"""
+    try:
+        from snowflake.snowpark.context import get_active_session
+        return get_active_session()
+    except Exception:
+        return Session.builder.configs(connection_parameters()).create()
+
+def _record_timing(name, start):
+    # Only the first (cold) occurrence is kept
+    startup_timings.setdefault(name, time.perf_counter() - start)
+
+def reset():
+    """Drop all cached handles so the next call reconnects"""
+    global _session, _root, _last_health_check, _active_service
+    with _lock:
+        _session = None
+        _root = None
+        _services.clear()
+        _last_health_check = 0.0
+        _active_service = None
+    logging.info("Cached Snowflake handles cleared.")
+
+def is_session_expired_error(error):
+    """True if an exception looks like an expired session or token"""
+    message = str(error).lower()
+    return any(marker in message for marker in EXPIRED_SESSION_MARKERS)
+
+def _is_healthy(session):
+    try:
+        session.sql("SELECT 1").collect(statement_params=tag("health_check"))
+        return True
+    except Exception as e:
+        logging.warning(f"Snowflake session health check failed: {str(e)}")
+        return False
+
+def get_session():
+    """
+    Return the process-wide Snowpark session, creating it on first use.
+    The cached session is pinged at most every HEALTH_CHECK_INTERVAL seconds
+    and replaced if the ping fails.
+    """
+    global _session, _last_health_check
+    with _lock:
+        now = time.monotonic()
+        if _session is not None and now - _last_health_check > HEALTH_CHECK_INTERVAL:
+            if not _is_healthy(_session):
+                reset()
+            _last_health_check = now
+
+        if _session is None:
+            start = time.perf_counter()
+            _session = _create_session()
+            _last_health_check = time.monotonic()
+            _record_timing("session_seconds", start)
+            logging.info("Snowflake session created.")
+        return _session
+
+def get_root():
+    """Return the cached snowflake.core Root for the current session"""
+    global _root
+    with _lock:
+        session = get_session()
+        if _root is None:
+            start = time.perf_counter()
+            _root = Root(session)
+            _record_timing("root_seconds", start)
+        return _root
+
+def get_active_service_name(alias=SEARCH_SERVICE_NAME):
+    """
+    Return the versioned search service the alias currently points to.
+    The registry is re-read at most every ACTIVE_SERVICE_TTL seconds, so a swap
+    reaches every running process within that time. Falls back to the alias
+    itself when there is no registry yet (the original unversioned service,
+    which search_service_admin never drops).
+    """
+    global _active_service
+    with _lock:
+        now = time.monotonic()
+        if _active_service is not None and now - _active_service[1] < ACTIVE_SERVICE_TTL:
+            return _active_service[0]
+
+        session = get_session()
+        try:
+            rows = session.sql(f"""
+            SELECT service_name
+            FROM {DB_NAME}.{SCHEMA_NAME}.{SERVICE_REGISTRY_TABLE}
+            WHERE alias = ?
+            """, params=[alias]).collect()
+            name = rows[0]['SERVICE_NAME'] if rows else alias
+        except Exception as e:
+            if _active_service is not None:
+                # Keep serving the last known version rather than failing the request
+                logging.warning(f"Could not read the search service registry: {str(e)}")
+                return _active_service[0]
+            name = alias
+        if _active_service is not None and name != _active_service[0]:
+            logging.info(f"Search service switched from {_active_service[0]} to {name}.")
+            _services.pop(_active_service[0], None)
+        _active_service = (name, now)
+        return name
+
+def get_search_service(service_name=None):
+    """Return the cached Cortex Search Service handle (the active version if no name is given)"""
+    with _lock:
+        if service_name is None:
+            service_name = get_active_service_name()
+        root = get_root()
+        if service_name not in _services:
+            start = time.perf_counter()
+            _services[service_name] = (root
+                .databases[DB_NAME]
+                .schemas[SCHEMA_NAME]
+                .cortex_search_services[service_name]
+            )
+            _record_timing("search_service_seconds", start)
+        return _services[service_name]
+
+def run_with_reconnect(fn, *args, **kwargs):
+    """
+    Call fn, and if it fails because the session expired, reconnect and retry once.
+    fn should fetch its handles through this module so the retry picks up new ones.
+    """
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        if not is_session_expired_error(e):
+            raise
+        logging.warning("Snowflake session expired, reconnecting.")
+        reset()
+        return fn(*args, **kwargs)
+
+def mark_startup_complete():
+    """Record the time from process start to the first completed script run (cold start)"""
+    if "cold_start_seconds" not in startup_timings:
+        startup_timings["cold_start_seconds"] = time.perf_counter() - PROCESS_START
+        summary = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in startup_timings.items())
+        logging.info(f"Cold start timings: {summary}")
+    return startup_timings
@@ -303,8 +303,12 @@ SET eff_code_final_date = COALESCE(
 -- ============================================================================
 
 -- Clean chunk content
+-- (only needed for chunks produced by text_chunker; layout_chunker output is already clean)
 UPDATE docs_chunks_table SET chunk = REPLACE(chunk, '\\n', '\n') WHERE chunk LIKE '%\\n%';
-UPDATE docs_chunks_table SET CHUNK = REGEXP_REPLACE(CHUNK, '\\|\\|\\|', '');
+-- '|||' is a text_chunker artifact, but also an empty cell in a markdown table,
+-- so leave chunks that contain a table (a '|---' or '|:--' separator row) alone
+UPDATE docs_chunks_table SET CHUNK = REGEXP_REPLACE(CHUNK, '\\|\\|\\|', '')
+WHERE CHUNK LIKE '%|||%' AND CHUNK NOT LIKE '%|---%' AND CHUNK NOT LIKE '%|:--%';
 UPDATE docs_chunks_table SET CHUNK = REGEXP_REPLACE(CHUNK, '{"content":"', '');
 UPDATE docs_chunks_table SET CHUNK = REGEXP_REPLACE(CHUNK, '","metadata":', '');
 
@@ -354,6 +358,9 @@ LIMIT 10;
 
 
 -- CREATE CORTEX SEARCH SERVICE
+-- Initial setup only. To pick up new documents, run `python search_service_admin.py --refresh`,
+-- which builds a new versioned service, warms it up and swaps it in through
+-- SEARCH_SERVICE_REGISTRY instead of replacing this one while it is being queried.
 create or replace CORTEX SEARCH SERVICE MH_PUBLICATIONS_SEARCH_SERVICE
 ON chunk
 ATTRIBUTES RELATIVE_PATH, CHUNK_ORDER, EFF_CODE_FINAL_DATE
@@ -0,0 +1,74 @@
+# Document delivery
+# Hands out the original PDF/DOCX for a source through a presigned stage URL.
+#
+# URLs are generated on demand, cached for the whole process and reused by
+# every session until shortly before they expire. Rebuilding a .txt from the
+# document's chunks is kept only as a fallback when no URL can be generated.
+import logging
+import threading
+import time
+from connection import DB_NAME, SCHEMA_NAME
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+stage_name = '@upload_070225'
+
+# Lifetime requested for each presigned URL, in seconds
+URL_EXPIRY_SECONDS = 3600
+
+# Stop handing out a cached URL this many seconds before it expires
+URL_REFRESH_MARGIN = 300
+
+_lock = threading.Lock()
+_url_cache = {}  # relative_path -> (url, expires_at monotonic seconds)
+
+def cached_document_url(relative_path):
+    """Return a still-valid cached URL for the document, or None (never queries)"""
+    with _lock:
+        entry = _url_cache.get(relative_path)
+    if entry and entry[1] - URL_REFRESH_MARGIN > time.monotonic():
+        return entry[0]
+    return None
+
+def get_document_url(session, relative_path, expiry_seconds=URL_EXPIRY_SECONDS):
+    """
+    Return a presigned URL for the original document, generating it if needed.
+    Relative paths in DOCS_CHUNKS_TABLE had their leading dot removed, so the
+    stage file is matched with the same normalization. Returns None if the file
+    is not on the stage.
+    """
+    url = cached_document_url(relative_path)
+    if url:
+        return url
+
+    issued_at = time.monotonic()
+    rows = session.sql(f"""
+    SELECT GET_PRESIGNED_URL({stage_name}, relative_path, ?) AS url
+    FROM directory({stage_name})
+    WHERE REGEXP_REPLACE(relative_path, '^\\\\.', '') = ?
+    LIMIT 1
+    """, params=[expiry_seconds, relative_path]).collect()
+    if not rows or not rows[0]['URL']:
+        logging.warning(f"No staged file found for {relative_path}")
+        return None
+
+    url = rows[0]['URL']
+    with _lock:
+        _url_cache[relative_path] = (url, issued_at + expiry_seconds)
+    return url
+
+def reconstruct_document_text(session, relative_path):
+    """Fallback: rebuild the document's text from its chunks, in chunk order"""
+    rows = session.sql(f"""
+    SELECT chunk
+    FROM {db_name}.{schema_name}.DOCS_CHUNKS_TABLE
+    WHERE relative_path = ?
+    ORDER BY chunk_order
+    """, params=[relative_path]).collect()
+    if not rows:
+        return None
+    full_document = "\n".join([row['CHUNK'] for row in rows])
+    full_document = full_document.replace('\\\"\\\"', '"')
+    full_document = full_document.replace('\\\"', '"')
+    full_document = full_document.replace('\\n', '\n')
+    return full_document
@@ -0,0 +1,334 @@
+# Evaluation
+# Replays questions stored in CHAT_HISTORY / CHAT_FEEDBACK through the RAG
+# pipeline under one or more configurations and compares the results.
+#
+#   python evaluation.py --limit 200 --configs configs.json --report eval_report.md
+#
+# configs.json is a list of configurations, for example:
+#   [{"name": "baseline", "model": "llama3.1-70b"},
+#    {"name": "small-model", "model": "llama3.1-8b", "max_chunks": 10},
+#    {"name": "no-rerank", "model": "llama3.1-70b", "rerank": {"enabled": false}}]
+import argparse
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from connection import DB_NAME, SCHEMA_NAME, get_session, get_search_service, get_active_service_name
+from rag_pipeline import FIXED_MODEL, MIN_CHUNKS, MAX_CHUNKS, search_chunks, answer_question
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+
+# Approximate Cortex credits per million tokens (input + output), used for cost estimates
+CREDITS_PER_MILLION_TOKENS = {
+    'llama3.1-8b': 0.19,
+    'llama3.1-70b': 1.21,
+    'llama3.1-405b': 3.0,
+    'mistral-large2': 1.95,
+}
+
+DEFAULT_CONFIGS = [{"name": "baseline", "model": FIXED_MODEL}]
+
+#------------------------------------------------------------------------------
+# LOADING STORED QUESTIONS
+#------------------------------------------------------------------------------
+
+def load_eval_questions(session, limit=200):
+    """
+    Load stored turns from CHAT_HISTORY along with any feedback given on them.
+    Feedback is matched on session, question and answer text because
+    CHAT_FEEDBACK stores the UI message index rather than the chat_id.
+    """
+    query = f"""
+    SELECT
+        h.chat_id,
+        h.user_question,
+        h.assistant_response,
+        h.sources_used,
+        -- The most recent rating wins when a turn was rated more than once
+        MAX_BY(f.feedback_type, f.feedback_timestamp) AS feedback_type
+    FROM {db_name}.{schema_name}.CHAT_HISTORY h
+    LEFT JOIN {db_name}.{schema_name}.CHAT_FEEDBACK f
+        ON f.session_id = h.session_id
+        AND f.user_question = h.user_question
+        AND f.assistant_response = h.assistant_response
+    GROUP BY h.chat_id, h.user_question, h.assistant_response, h.sources_used, h.created_timestamp
+    ORDER BY h.created_timestamp DESC
+    LIMIT {int(limit)}
+    """
+    rows = session.sql(query).collect()
+
+    questions = []
+    for row in rows:
+        original_paths = []
+        if row['SOURCES_USED']:
+            try:
+                original_paths = [s.get('relative_path', '') for s in json.loads(row['SOURCES_USED'])]
+            except (ValueError, AttributeError):
+                pass  # If JSON parsing fails, treat as no sources
+        questions.append({
+            "chat_id": row['CHAT_ID'],
+            "question": row['USER_QUESTION'],
+            "original_answer": row['ASSISTANT_RESPONSE'],
+            "original_paths": original_paths,
+            "feedback_type": row['FEEDBACK_TYPE'],
+        })
+    return questions
+
+#------------------------------------------------------------------------------
+# SEARCH RESULT CACHE
+#------------------------------------------------------------------------------
+
+class CachedSearchResponse:
+    """Minimal stand-in for a Cortex Search response built from cached results"""
+
+    def __init__(self, results):
+        self.results = results
+
+class SearchCache:
+    """
+    On-disk cache of Cortex Search results, keyed by service and question.
+    Search results do not depend on the model or prompt, so one cached search
+    is shared by every configuration and reused between evaluation runs.
+
+    Args:
+        service_name (str): The versioned search service queried, so results
+            from a different index version are never served
+        cache_dir (str): Directory for cached results
+    """
+
+    def __init__(self, service_name, cache_dir=".eval_cache"):
+        self.service_name = service_name
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, question, filter_dict):
+        key = json.dumps([self.service_name, question, filter_dict], sort_keys=True, default=str)
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def search(self, cortex_service, question, filter_dict=None):
+        """
+        Returns (response, seconds, hit): seconds is how long the Cortex Search
+        call took, or None when the results came from the cache
+        """
+        path = self._path(question, filter_dict)
+        if os.path.exists(path):
+            self.hits += 1
+            with open(path, encoding="utf-8") as f:
+                return CachedSearchResponse(json.load(f)), None, True
+
+        self.misses += 1
+        search_start = time.perf_counter()
+        response = search_chunks(cortex_service, question, filter_dict)
+        seconds = time.perf_counter() - search_start
+        results = [dict(result) for result in response.results]
+        # Write to a temp file first so parallel workers never read a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, default=str)
+        os.replace(tmp_path, path)
+        return CachedSearchResponse(results), seconds, False
+
+#------------------------------------------------------------------------------
+# METRICS
+#------------------------------------------------------------------------------
+
+def retrieval_overlap(original_paths, new_paths):
+    """
+    Compare the documents cited originally with the ones retrieved now.
+    Returns (recall of the original documents, Jaccard overlap), or (None, None)
+    when the original turn had no sources.
+    """
+    original = set(p for p in original_paths if p)
+    new = set(p for p in new_paths if p)
+    if not original:
+        return None, None
+    recall = len(original & new) / len(original)
+    jaccard = len(original & new) / len(original | new)
+    return recall, jaccard
+
+def answer_similarity(original_answer, new_answer):
+    """Similarity ratio (0-1) between two answers, ignoring citation markers and spacing"""
+    def normalize(text):
+        text = re.sub(r'\[\d+(?:,\s*\d+)*\]', '', text or '')
+        return re.sub(r'\s+', ' ', text).strip().lower()
+    return difflib.SequenceMatcher(None, normalize(original_answer), normalize(new_answer)).ratio()
+
+def estimate_tokens(char_count):
+    """Rough token count for a piece of text (about 4 characters per token)"""
+    return max(1, char_count // 4)
+
+#------------------------------------------------------------------------------
+# RUNNING CONFIGURATIONS
+#------------------------------------------------------------------------------
+
+def evaluate_one(session, cortex_service, cache, item, config):
+    """Replay one stored question under one configuration"""
+    # Only searches that reached Cortex are timed; cache reads say nothing about the service
+    search_response, search_seconds, search_cache_hit = cache.search(cortex_service, item["question"])
+
+    result = answer_question(
+        session, cortex_service, item["question"],
+        model=config.get("model", FIXED_MODEL),
+        search_response=search_response,
+        min_chunks=config.get("min_chunks", MIN_CHUNKS),
+        max_chunks=config.get("max_chunks", MAX_CHUNKS),
+        rerank=config.get("rerank"),
+    )
+
+    new_paths = [r.get('relative_path', '') for r in result["results"]]
+    recall, jaccard = retrieval_overlap(item["original_paths"], new_paths)
+    similarity = None
+    if item["feedback_type"] == 'positive':
+        similarity = answer_similarity(item["original_answer"], result["answer"])
+
+    prompt_tokens = estimate_tokens(result["prompt_chars"])
+    completion_tokens = estimate_tokens(len(result["answer"] or ''))
+
+    return {
+        "config": config["name"],
+        "chat_id": item["chat_id"],
+        "question": item["question"],
+        "feedback_type": item["feedback_type"],
+        "source_recall": recall,
+        "source_jaccard": jaccard,
+        "answer_similarity": similarity,
+        "search_seconds": search_seconds,
+        "search_cache_hit": search_cache_hit,
+        "complete_seconds": result["complete_seconds"],
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "answer": result["answer"],
+    }
+
+def run_evaluation(session, cortex_service, questions, configs, cache, concurrency=4):
+    """Replay every question under every configuration in parallel"""
+    jobs = [(item, config) for config in configs for item in questions]
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(evaluate_one, session, cortex_service, cache, item, config) for item, config in jobs]
+        for future, (item, config) in zip(futures, jobs):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error(f"{config['name']}: question {item['chat_id']} failed: {str(e)}")
+    return results
+
+#------------------------------------------------------------------------------
+# REPORTING
+#------------------------------------------------------------------------------
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return statistics.mean(values) if values else None
+
+def _p50(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+def _p95(values):
+    values = sorted(v for v in values if v is not None)
+    return values[min(len(values) - 1, int(0.95 * len(values)))] if values else None
+
+def summarize(results, configs):
+    """Aggregate per-question results into one summary row per configuration"""
+    summary = []
+    for config in configs:
+        rows = [r for r in results if r["config"] == config["name"]]
+        model = config.get("model", FIXED_MODEL)
+        total_tokens = sum(r["prompt_tokens"] + r["completion_tokens"] for r in rows)
+        credits_rate = CREDITS_PER_MILLION_TOKENS.get(model)
+        summary.append({
+            "config": config["name"],
+            "model": model,
+            "questions": len(rows),
+            "source_recall": _mean(r["source_recall"] for r in rows),
+            "source_jaccard": _mean(r["source_jaccard"] for r in rows),
+            "positive_answer_similarity": _mean(r["answer_similarity"] for r in rows),
+            # Over cache misses only (see SearchCache.search)
+            "search_p50_seconds": _p50(r["search_seconds"] for r in rows),
+            "search_p95_seconds": _p95(r["search_seconds"] for r in rows),
+            "search_cache_hit_rate": sum(r["search_cache_hit"] for r in rows) / len(rows) if rows else None,
+            "complete_p50_seconds": _p50(r["complete_seconds"] for r in rows),
+            "complete_p95_seconds": _p95(r["complete_seconds"] for r in rows),
+            "tokens_per_question": total_tokens / len(rows) if rows else None,
+            "estimated_credits": total_tokens / 1_000_000 * credits_rate if credits_rate is not None else None,
+        })
+    return summary
+
+def format_report(summary, cache=None):
+    """Render the configuration comparison as a Markdown table"""
+    def fmt(value, digits=3):
+        if value is None:
+            return "-"
+        return f"{value:.{digits}f}" if isinstance(value, float) else str(value)
+
+    lines = [
+        "# RAG Evaluation Report",
+        "",
+        "| Config | Model | Questions | Source recall | Source Jaccard | Answer similarity (👍) | Search p50 (s) | Search p95 (s) | Search cache hits | Complete p50 (s) | Complete p95 (s) | Tokens / question | Est. credits |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for row in summary:
+        lines.append(
+            f"| {row['config']} | {row['model']} | {row['questions']} | {fmt(row['source_recall'])} "
+            f"| {fmt(row['source_jaccard'])} | {fmt(row['positive_answer_similarity'])} "
+            f"| {fmt(row['search_p50_seconds'], 2)} | {fmt(row['search_p95_seconds'], 2)} "
+            f"| {'-' if row['search_cache_hit_rate'] is None else format(row['search_cache_hit_rate'], '.0%')} "
+            f"| {fmt(row['complete_p50_seconds'], 2)} | {fmt(row['complete_p95_seconds'], 2)} "
+            f"| {fmt(row['tokens_per_question'], 0)} | {fmt(row['estimated_credits'], 4)} |"
+        )
+    if cache is not None:
+        lines += ["", f"Search cache: {cache.hits} hits, {cache.misses} misses. "
+                      "Search latency is measured on misses only."]
+    return "\n".join(lines) + "\n"
+
+#------------------------------------------------------------------------------
+# MAIN
+#------------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay stored chat questions and compare pipeline configurations")
+    parser.add_argument("--limit", type=int, default=200, help="Number of most recent stored turns to replay")
+    parser.add_argument("--configs", help="JSON file with a list of configurations")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions evaluated in parallel")
+    parser.add_argument("--cache-dir", default=".eval_cache", help="Directory for cached search results")
+    parser.add_argument("--results", default="eval_results.jsonl", help="Per-question results output")
+    parser.add_argument("--report", default="eval_report.md", help="Comparison report output")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = json.load(f)
+
+    session = get_session()
+    # Key the search cache on the active version so a rebuilt service is not served stale results
+    search_service_name = get_active_service_name()
+    cortex_service = get_search_service(search_service_name)
+
+    questions = load_eval_questions(session, args.limit)
+    logging.info(f"Replaying {len(questions)} questions under {len(configs)} configuration(s)")
+
+    cache = SearchCache(search_service_name, args.cache_dir)
+    results = run_evaluation(session, cortex_service, questions, configs, cache, args.concurrency)
+
+    with open(args.results, "w", encoding="utf-8") as f:
+        for row in results:
+            f.write(json.dumps(row, default=str) + "\n")
+
+    report = format_report(summarize(results, configs), cache)
+    with open(args.report, "w", encoding="utf-8") as f:
+        f.write(report)
+    print(report)
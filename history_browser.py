@@ -0,0 +1,150 @@
+# History browser
+# Keyset-paginated chat session listing and full-text question search for the
+# sidebar.
+#
+# Sessions are listed from CHAT_SESSIONS, a one-row-per-session summary kept
+# up to date on every saved turn, ordered by (last_activity, session_id). Each
+# page continues from the last row of the previous one, so page 50 costs the
+# same as page 1. Question search uses SEARCH() over CHAT_HISTORY.user_question,
+# served by the table's FULL_TEXT search optimization (see Chat history table.sql).
+import logging
+from connection import DB_NAME, SCHEMA_NAME
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+
+PAGE_SIZE = 10
+
+def ensure_sessions_table(session):
+    """
+    Create CHAT_SESSIONS if needed and backfill it from CHAT_HISTORY while it
+    is empty (e.g. right after Chat history table.sql created it)
+    """
+    session.sql(f"""
+    CREATE TABLE IF NOT EXISTS {db_name}.{schema_name}.CHAT_SESSIONS (
+        session_id VARCHAR,
+        first_question VARCHAR(16777216),
+        session_start TIMESTAMP,
+        last_activity TIMESTAMP,
+        user_id VARCHAR DEFAULT 'anonymous',
+        PRIMARY KEY (session_id)
+    )
+    CLUSTER BY (TO_DATE(last_activity))
+    """).collect()
+
+    # COUNT(*) on a whole table is answered from metadata, so this check is cheap
+    rows = session.sql(f"SELECT COUNT(*) AS n FROM {db_name}.{schema_name}.CHAT_SESSIONS").collect()[0]['N']
+    if rows:
+        return
+
+    # Skip sessions already recorded by a turn saved since the count above
+    session.sql(f"""
+    INSERT INTO {db_name}.{schema_name}.CHAT_SESSIONS
+        (session_id, first_question, session_start, last_activity, user_id)
+    SELECT
+        h.session_id,
+        MIN_BY(h.user_question, h.created_timestamp),
+        MIN(h.created_timestamp),
+        MAX(h.created_timestamp),
+        MAX(h.user_id)
+    FROM {db_name}.{schema_name}.CHAT_HISTORY h
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {db_name}.{schema_name}.CHAT_SESSIONS s WHERE s.session_id = h.session_id
+    )
+    GROUP BY h.session_id
+    """).collect()
+    logging.info("CHAT_SESSIONS backfilled from CHAT_HISTORY.")
+
+def record_session_activity(session, session_id, user_question, user_id='anonymous'):
+    """Upsert the session summary row after a turn is saved"""
+    session.sql(f"""
+    MERGE INTO {db_name}.{schema_name}.CHAT_SESSIONS t
+    USING (SELECT ? AS session_id, ? AS user_question, ? AS user_id) s
+    ON t.session_id = s.session_id
+    WHEN MATCHED THEN UPDATE SET last_activity = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (session_id, first_question, session_start, last_activity, user_id)
+        VALUES (s.session_id, s.user_question, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP(), s.user_id)
+    """, params=[session_id, user_question, user_id]).collect()
+
+def delete_session_summaries(session, session_id=None, user_id=None):
+    """Remove one session's summary row, or every row belonging to a user"""
+    if session_id is not None:
+        session.sql(f"DELETE FROM {db_name}.{schema_name}.CHAT_SESSIONS WHERE session_id = ?", params=[session_id]).collect()
+    elif user_id is not None:
+        session.sql(f"DELETE FROM {db_name}.{schema_name}.CHAT_SESSIONS WHERE user_id = ?", params=[user_id]).collect()
+
+def fetch_sessions_page(session, cursor=None, page_size=PAGE_SIZE):
+    """
+    Get one page of sessions, most recent activity first.
+
+    Args:
+        cursor (tuple): (last_activity, session_id) of the last row already shown,
+            or None for the first page
+
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page.
+        Rows have SESSION_ID, FIRST_QUESTION, SESSION_START and LAST_ACTIVITY.
+    """
+    params = []
+    where = ""
+    if cursor is not None:
+        where = "WHERE last_activity < ? OR (last_activity = ? AND session_id < ?)"
+        params = [cursor[0], cursor[0], cursor[1]]
+    rows = session.sql(f"""
+    SELECT session_id, first_question, session_start, last_activity
+    FROM {db_name}.{schema_name}.CHAT_SESSIONS
+    {where}
+    ORDER BY last_activity DESC, session_id DESC
+    LIMIT {int(page_size) + 1}
+    """, params=params).collect()
+
+    rows = [dict(row.asDict()) for row in rows]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['LAST_ACTIVITY'], rows[-1]['SESSION_ID'])
+    return rows, next_cursor
+
+def search_questions_page(session, search_text, cursor=None, page_size=PAGE_SIZE):
+    """
+    Full-text search over asked questions, one row per matching session (its
+    latest match), newest first, with the same keyset paging.
+
+    Args:
+        cursor (tuple): (created_timestamp, chat_id) of the latest match of the
+            last session already shown
+
+    Returns:
+        tuple: (rows, next_cursor). Rows are shaped like session rows, with the
+        session's latest matching question as FIRST_QUESTION and its time as SESSION_START.
+    """
+    params = [search_text]
+    keyset = ""
+    if cursor is not None:
+        # Applied after picking each session's latest match, so a session never
+        # reappears on a later page through an older match
+        keyset = "WHERE session_start < ? OR (session_start = ? AND chat_id < ?)"
+        params += [cursor[0], cursor[0], cursor[1]]
+    rows = session.sql(f"""
+    SELECT session_id, first_question, session_start, chat_id
+    FROM (
+        SELECT
+            session_id,
+            user_question AS first_question,
+            created_timestamp AS session_start,
+            chat_id
+        FROM {db_name}.{schema_name}.CHAT_HISTORY
+        WHERE SEARCH(user_question, ?)
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY created_timestamp DESC, chat_id DESC) = 1
+    )
+    {keyset}
+    ORDER BY session_start DESC, chat_id DESC
+    LIMIT {int(page_size) + 1}
+    """, params=params).collect()
+
+    rows = [dict(row.asDict()) for row in rows]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['SESSION_START'], rows[-1]['CHAT_ID'])
+    return rows, next_cursor
@@ -0,0 +1,34 @@
+# Prefetch
+# Starts Cortex Search retrieval on a background thread as soon as a question
+# arrives, so the warehouse round trip overlaps with re-rendering the page.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from connection import get_search_service, run_with_reconnect
+from query_tags import current_query_context, query_stage, use_query_context
+from rag_pipeline import search_chunks
+from singleflight import SEARCH_WAIT_SECONDS, search_flight, search_key
+
+# Shared by every session in the process; searches are I/O bound so a few threads suffice
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+def _search(question, filter_dict, service_name, query_context):
+    # Queries run here (session health check, service lookup) are tagged like the caller's
+    with use_query_context(query_context), query_stage("search"):
+        # Identical searches already running for other sessions are shared (see singleflight.py)
+        return search_flight.do(
+            search_key(question, filter_dict, service_name),
+            lambda: run_with_reconnect(
+                lambda: search_chunks(get_search_service(service_name), question, filter_dict)
+            ),
+            SEARCH_WAIT_SECONDS
+        )
+
+def prefetch_search(question, filter_dict=None, service_name=None):
+    """
+    Kick off a Cortex Search query in the background (against the active
+    service version unless service_name is given).
+    Returns a Future; call .result() when the results are needed. Errors from
+    the search are raised from .result(), just like calling search directly.
+    """
+    logging.info("Prefetching search results in the background.")
+    return _executor.submit(_search, question, filter_dict, service_name, current_query_context())
@@ -0,0 +1,276 @@
+# Profiling
+# Optional per-rerun profiling for the Streamlit app.
+#
+# Turn it on for one browser session with the "Profile reruns" sidebar toggle,
+# or for every session with the environment variable MH_PROFILE:
+#   MH_PROFILE=cprofile   deterministic profile (cProfile)
+#   MH_PROFILE=sampling   low-overhead sampling profile
+#
+# Each rerun writes to MH_PROFILE_DIR (default ./profiles):
+#   <run>.prof       pstats file (open with snakeviz or convert with flameprof)
+#   <run>.collapsed  folded stacks for flamegraph.pl / speedscope (sampling mode)
+#   <run>.txt        wall vs CPU vs Snowflake wait summary and the top-N hot functions
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from snowpark_hooks import register_collect_hook
+
+PROFILE_ENV_VAR = "MH_PROFILE"
+PROFILE_DIR = os.environ.get("MH_PROFILE_DIR", "profiles")
+PROFILE_MODES = ("cprofile", "sampling")
+
+# Number of functions listed in the hot-function table
+TOP_N = 25
+
+# Seconds between stack samples in sampling mode
+SAMPLE_INTERVAL = 0.005
+
+# A profile still running after this long belongs to a run that ended without
+# finishing it (uncaught error, st.stop(), closed tab) and is stopped by the next run
+STALE_PROFILE_SECONDS = 600
+
+# The active profile for each script thread (Streamlit runs every session's script on its own thread)
+_state = threading.local()
+
+# Every running profile by browser session, so a later run (on any thread) can
+# close one its own run never finished
+_live_profiles = {}
+_live_lock = threading.Lock()
+
+def env_profile_mode():
+    """Profiling mode requested through the environment, or None"""
+    mode = os.environ.get(PROFILE_ENV_VAR, "").strip().lower()
+    if mode in ("1", "true", "yes"):
+        return "cprofile"
+    return mode if mode in PROFILE_MODES else None
+
+#------------------------------------------------------------------------------
+# SNOWFLAKE WAIT TIMING
+#------------------------------------------------------------------------------
+
+@contextmanager
+def wait_timer(kind):
+    """
+    Attribute the wall time of the enclosed block to waiting on Snowflake.
+    kind is a label such as "sql", "search" or "complete". Does nothing when the
+    current thread is not being profiled. Nested timers only count the outermost.
+    """
+    profile = getattr(_state, "profile", None)
+    if profile is None or profile.stopped or profile.wait_depth > 0:
+        yield
+        return
+    profile.wait_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.wait_depth -= 1
+        profile.waits[kind] = profile.waits.get(kind, 0.0) + time.perf_counter() - start
+        profile.wait_counts[kind] = profile.wait_counts.get(kind, 0) + 1
+
+def _time_collect(kwargs):
+    return wait_timer("sql")
+
+def _patch_dataframe_collect():
+    """
+    Time every DataFrame.collect() as "sql" wait while a profile is active
+    (see snowpark_hooks.py). Outside a profiled thread it only adds an attribute lookup.
+    """
+    register_collect_hook("profiling", _time_collect)
+
+#------------------------------------------------------------------------------
+# SAMPLING PROFILER
+#------------------------------------------------------------------------------
+
+class _StackSampler:
+    """Samples one thread's Python stack on a timer and counts folded stacks"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+    def top_functions(self, n=TOP_N):
+        """Leaf functions by share of samples (self time)"""
+        total = sum(self.counts.values()) or 1
+        leaves = {}
+        for stack, count in self.counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        rows = sorted(leaves.items(), key=lambda item: -item[1])[:n]
+        lines = [f"{'samples':>8} {'self %':>7}  function"]
+        lines += [f"{count:>8} {100 * count / total:>6.1f}%  {leaf}" for leaf, count in rows]
+        return "\n".join(lines)
+
+#------------------------------------------------------------------------------
+# PER-RERUN PROFILE
+#------------------------------------------------------------------------------
+
+class RerunProfile:
+    """Profile of a single script run"""
+
+    def __init__(self, mode, label, session_key=None):
+        self.mode = mode
+        self.label = label
+        self.session_key = session_key
+        self.waits = {}
+        self.wait_counts = {}
+        self.wait_depth = 0
+        self.summary = None
+        self.stopped = False
+        self.started_at = time.monotonic()
+        self._profiler = None
+        self._sampler = None
+        self._thread_id = threading.get_ident()
+
+    def start(self):
+        if self.mode == "cprofile":
+            try:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            except ValueError:
+                # Another session's cProfile is running (only one is allowed per process)
+                logging.info("cProfile busy, falling back to sampling profiler for this rerun.")
+                self._profiler = None
+                self.mode = "sampling"
+        if self.mode == "sampling":
+            self._sampler = _StackSampler(threading.get_ident())
+            self._sampler.start()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+
+    def stop(self, interrupted=False):
+        """
+        Stop profiling, write the output files and return the summary text.
+        May be called from another thread to close a run that never finished;
+        CPU time is then not measured.
+        """
+        if self.stopped:
+            return self.summary
+        self.stopped = True
+        wall = time.perf_counter() - self._wall_start
+        own_thread = threading.get_ident() == self._thread_id
+        cpu = time.thread_time() - self._cpu_start if own_thread else None
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.label)
+
+        if self._profiler is not None:
+            self._profiler.dump_stats(base + ".prof")
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats("tottime").print_stats(TOP_N)
+            hot_functions = stream.getvalue()
+        else:
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                f.write(self._sampler.collapsed())
+            hot_functions = self._sampler.top_functions()
+
+        total_wait = sum(self.waits.values())
+        lines = [
+            f"Rerun {self.label} ({self.mode}){' - interrupted by rerun/stop' if interrupted else ''}",
+            f"Wall time:           {wall:8.3f}s",
+            f"Python CPU time:     {cpu:8.3f}s" if cpu is not None else "Python CPU time:     (closed from another thread)",
+            f"Waiting on Snowflake:{total_wait:8.3f}s",
+        ]
+        for kind, seconds in sorted(self.waits.items()):
+            lines.append(f"  {kind:<18}{seconds:8.3f}s ({self.wait_counts[kind]} calls)")
+        if cpu is not None:
+            lines.append(f"Other (unaccounted): {max(0.0, wall - cpu - total_wait):8.3f}s")
+        self.summary = "\n".join(lines)
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(self.summary + "\n\nHot functions:\n" + hot_functions)
+        logging.info(f"Profile written to {base}.*\n{self.summary}")
+        return self.summary
+
+def _close_unfinished(session_key):
+    """Stop profiles whose run ended without finish_rerun_profile (rerun, st.stop, uncaught error)"""
+    now = time.monotonic()
+    with _live_lock:
+        leftovers = [_live_profiles.pop(session_key)] if session_key in _live_profiles else []
+        for key, profile in list(_live_profiles.items()):
+            if now - profile.started_at > STALE_PROFILE_SECONDS:
+                leftovers.append(_live_profiles.pop(key))
+    previous = getattr(_state, "profile", None)
+    _state.profile = None
+    if previous is not None and previous not in leftovers:
+        leftovers.append(previous)
+    for profile in leftovers:
+        try:
+            profile.stop(interrupted=True)
+        except Exception as e:
+            logging.warning(f"Could not close an unfinished profile: {str(e)}")
+
+def start_rerun_profile(enabled, session_label, mode=None, session_key=None):
+    """
+    Start profiling the current script run if enabled (or forced by MH_PROFILE).
+
+    Any profile the same browser session (session_key) left running is closed
+    first, whichever thread ran it, along with any profile running for longer
+    than STALE_PROFILE_SECONDS. Returns the RerunProfile, or None when
+    profiling is off.
+    """
+    session_key = session_key or session_label
+    _close_unfinished(session_key)
+
+    mode = env_profile_mode() or (mode if enabled else None)
+    if mode not in PROFILE_MODES:
+        return None
+
+    _patch_dataframe_collect()
+    label = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{session_label[:8]}"
+    profile = RerunProfile(mode, label, session_key)
+    _state.profile = profile
+    with _live_lock:
+        _live_profiles[session_key] = profile
+    profile.start()
+    return profile
+
+def finish_rerun_profile(profile):
+    """Stop the profile started for this run. Returns its summary text, or None."""
+    if profile is None:
+        return None
+    with _live_lock:
+        if _live_profiles.get(profile.session_key) is profile:
+            del _live_profiles[profile.session_key]
+    if getattr(_state, "profile", None) is profile:
+        _state.profile = None
+    if profile.stopped:
+        return None
+    return profile.stop()
@@ -0,0 +1,227 @@
+# Query tags
+# Structured QUERY_TAGs on every query the app runs, and a report that
+# attributes warehouse time to app stages from QUERY_HISTORY.
+#
+# Each query carries a JSON tag like
+#   {"app": "mh_publications", "stage": "history_insert", "session": "<uuid>", "turn": 3}
+# Call sites in the app pass tag("<stage>") as statement_params. Queries run
+# inside helper modules pick up the stage from a surrounding query_stage()
+# block, because install_query_tagging() fills in the tag on any
+# DataFrame.collect() that doesn't set one. The session and turn come from
+# set_query_context(), once per rerun. Everything is thread-local; use
+# current_query_context() / use_query_context() to carry it to worker threads.
+#
+# Report on the last 7 days:
+#   python query_tags.py --days 7 --output query_cost_report.md
+#
+# LocalQueryHistory stands in for QUERY_HISTORY so the report can be checked
+# without a warehouse.
+import argparse
+import json
+import logging
+import statistics
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from snowpark_hooks import register_collect_hook
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+APP_TAG = "mh_publications"
+
+# Stage used for queries that run outside any query_stage() block
+DEFAULT_STAGE = "other"
+
+_state = threading.local()
+
+#------------------------------------------------------------------------------
+# TAGGING
+#------------------------------------------------------------------------------
+
+def set_query_context(session_id=None, turn=None):
+    """Set the chat session and turn recorded on this thread's queries"""
+    _state.session_id = session_id
+    _state.turn = turn
+
+def current_query_context():
+    """(session_id, turn, stage) for this thread, to hand to another thread"""
+    return (getattr(_state, "session_id", None), getattr(_state, "turn", None), getattr(_state, "stage", None))
+
+@contextmanager
+def use_query_context(context):
+    """Run a block (e.g. on a worker thread) with a context taken from current_query_context()"""
+    previous = current_query_context()
+    _state.session_id, _state.turn, _state.stage = context
+    try:
+        yield
+    finally:
+        _state.session_id, _state.turn, _state.stage = previous
+
+@contextmanager
+def query_stage(stage):
+    """Tag queries run inside this block (including in helper modules) with the stage"""
+    previous = getattr(_state, "stage", None)
+    _state.stage = stage
+    try:
+        yield
+    finally:
+        _state.stage = previous
+
+def query_tag(stage=None):
+    """The JSON QUERY_TAG for a stage, with this thread's session and turn"""
+    return json.dumps({
+        "app": APP_TAG,
+        "stage": stage or getattr(_state, "stage", None) or DEFAULT_STAGE,
+        "session": getattr(_state, "session_id", None),
+        "turn": getattr(_state, "turn", None),
+    })
+
+def tag(stage=None):
+    """statement_params for DataFrame.collect() carrying the stage's QUERY_TAG"""
+    return {"QUERY_TAG": query_tag(stage)}
+
+@contextmanager
+def _tag_collect(kwargs):
+    statement_params = dict(kwargs.get("statement_params") or {})
+    statement_params.setdefault("QUERY_TAG", query_tag())
+    kwargs["statement_params"] = statement_params
+    yield
+
+def install_query_tagging():
+    """Tag every DataFrame.collect() that doesn't set its own QUERY_TAG (see snowpark_hooks.py)"""
+    register_collect_hook("query_tags", _tag_collect)
+
+#------------------------------------------------------------------------------
+# QUERY HISTORY SOURCES
+#------------------------------------------------------------------------------
+
+class SnowflakeQueryHistory:
+    """Reads the app's tagged queries from SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def fetch(self, days=7):
+        rows = self.session.sql("""
+        SELECT query_tag, bytes_scanned, total_elapsed_time, execution_time,
+               warehouse_name, execution_status, start_time
+        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+        WHERE start_time >= DATEADD('day', ?, CURRENT_TIMESTAMP())
+          AND TRY_PARSE_JSON(query_tag):app::VARCHAR = ?
+        """, params=[-int(days), APP_TAG]).collect(statement_params=tag("query_cost_report"))
+        return [dict(row.asDict()) for row in rows]
+
+class LocalQueryHistory:
+    """In-memory stand-in for QUERY_HISTORY; add() rows shaped like SnowflakeQueryHistory.fetch()"""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, query_tag, bytes_scanned=0, total_elapsed_time=0, execution_time=None,
+            warehouse_name="AIPILOT_WH", execution_status="SUCCESS", start_time=None):
+        self.rows.append({
+            "QUERY_TAG": query_tag,
+            "BYTES_SCANNED": bytes_scanned,
+            "TOTAL_ELAPSED_TIME": total_elapsed_time,
+            "EXECUTION_TIME": total_elapsed_time if execution_time is None else execution_time,
+            "WAREHOUSE_NAME": warehouse_name,
+            "EXECUTION_STATUS": execution_status,
+            "START_TIME": start_time or datetime.now(),
+        })
+
+    def fetch(self, days=7):
+        cutoff = datetime.now() - timedelta(days=days)
+        return [row for row in self.rows if row["START_TIME"] >= cutoff]
+
+#------------------------------------------------------------------------------
+# REPORT
+#------------------------------------------------------------------------------
+
+def parse_tag(query_tag):
+    """The tag dict for one of the app's queries, or None for anything else"""
+    try:
+        parsed = json.loads(query_tag or "")
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict) or parsed.get("app") != APP_TAG:
+        return None
+    return parsed
+
+def build_stage_report(rows):
+    """
+    Aggregate QUERY_HISTORY rows per app stage.
+
+    Returns:
+        list: One dict per stage (queries, failed, sessions, bytes_scanned,
+        elapsed_seconds, execution_seconds, mean_ms, p95_ms, execution_share),
+        most warehouse time first
+    """
+    stages = {}
+    for row in rows:
+        parsed = parse_tag(row["QUERY_TAG"])
+        if parsed is None:
+            continue
+        stage = stages.setdefault(parsed.get("stage") or DEFAULT_STAGE, {
+            "elapsed": [], "execution_ms": 0, "bytes_scanned": 0, "failed": 0, "sessions": set()
+        })
+        stage["elapsed"].append(row["TOTAL_ELAPSED_TIME"] or 0)
+        stage["execution_ms"] += row["EXECUTION_TIME"] or 0
+        stage["bytes_scanned"] += row["BYTES_SCANNED"] or 0
+        if row["EXECUTION_STATUS"] != "SUCCESS":
+            stage["failed"] += 1
+        if parsed.get("session"):
+            stage["sessions"].add(parsed["session"])
+
+    total_execution_ms = sum(s["execution_ms"] for s in stages.values()) or 1
+    report = []
+    for name, s in stages.items():
+        elapsed = sorted(s["elapsed"])
+        report.append({
+            "stage": name,
+            "queries": len(elapsed),
+            "failed": s["failed"],
+            "sessions": len(s["sessions"]),
+            "bytes_scanned": s["bytes_scanned"],
+            "elapsed_seconds": sum(elapsed) / 1000,
+            "execution_seconds": s["execution_ms"] / 1000,
+            "mean_ms": statistics.mean(elapsed),
+            "p95_ms": elapsed[min(len(elapsed) - 1, int(0.95 * len(elapsed)))],
+            # Warehouse credits are billed for running time, so this is the stage's share of them
+            "execution_share": s["execution_ms"] / total_execution_ms,
+        })
+    report.sort(key=lambda r: r["execution_seconds"], reverse=True)
+    return report
+
+def format_report(report, days):
+    """Markdown table of the per-stage report"""
+    lines = [
+        f"# Warehouse usage by app stage (last {days} days)",
+        "",
+        "| Stage | Queries | Failed | Sessions | MB scanned | Elapsed s | Execution s | Mean ms | p95 ms | Share of execution |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for r in report:
+        lines.append(
+            f"| {r['stage']} | {r['queries']} | {r['failed']} | {r['sessions']} | {r['bytes_scanned'] / 1e6:.1f} "
+            f"| {r['elapsed_seconds']:.1f} | {r['execution_seconds']:.1f} | {r['mean_ms']:.0f} | {r['p95_ms']:.0f} "
+            f"| {r['execution_share']:.1%} |"
+        )
+    if not report:
+        lines.append("| (no tagged queries) | | | | | | | | | |")
+    return "\n".join(lines) + "\n"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Attribute warehouse usage to app stages from QUERY_HISTORY")
+    parser.add_argument("--days", type=int, default=7, help="How many days of history to include")
+    parser.add_argument("--output", default="query_cost_report.md", help="Markdown report output")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    from connection import get_session
+
+    args = parse_args()
+    history = SnowflakeQueryHistory(get_session())
+    report_text = format_report(build_stage_report(history.fetch(args.days)), args.days)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(report_text)
+    print(report_text)
@@ -0,0 +1,342 @@
+# RAG pipeline
+# Shared search, prompt and completion steps used by the Streamlit app and
+# the batch question-answering CLI, so both produce answers the same way.
+import json
+import re
+import time
+from snowflake.snowpark.functions import call_udf, concat, lit
+from reranking import rerank_results
+
+# Fixed model used for completions
+FIXED_MODEL = 'llama3.1-70b'
+
+# Columns requested from the Cortex Search Service
+SEARCH_COLUMNS = ["chunk", "relative_path", "eff_code_final_date"]
+
+# Set a high limit for comprehensive search
+SEARCH_LIMIT = 1000
+
+# Always use dynamic chunks with maximum range (3-15) for comprehensive context
+MIN_CHUNKS = 3
+MAX_CHUNKS = 15
+
+#------------------------------------------------------------------------------
+# DYNAMIC CHUNK CALCULATION FUNCTIONS
+#------------------------------------------------------------------------------
+
+def calculate_question_complexity(question):
+    """
+    Calculate the complexity of a question based on various factors.
+    Returns a complexity score between 1 and 10.
+    """
+    complexity_score = 1  # Base score
+    
+    # Factor 1: Question length (longer questions tend to be more complex)
+    word_count = len(question.split())
+    if word_count > 50:
+        complexity_score += 3
+    elif word_count > 30:
+        complexity_score += 2
+    elif word_count > 15:
+        complexity_score += 1
+    
+    # Factor 2: Multiple question indicators
+    question_indicators = ['?', 'what', 'how', 'why', 'when', 'where', 'who', 'which']
+    question_count = sum(1 for indicator in question_indicators if indicator in question.lower())
+    if question_count > 3:
+        complexity_score += 2
+    elif question_count > 2:
+        complexity_score += 1
+    
+    # Factor 3: Complex keywords that suggest detailed answers needed
+    complex_keywords = [
+        'compare', 'contrast', 'analyze', 'explain', 'describe', 'detail', 'comprehensive',
+        'thorough', 'complete', 'all', 'every', 'various', 'different', 'multiple',
+        'process', 'procedure', 'steps', 'requirements', 'criteria', 'conditions',
+        'eligibility', 'qualification', 'documentation', 'application', 'enrollment',
+        'benefits', 'coverage', 'services', 'options', 'alternatives', 'exceptions'
+    ]
+    
+    complex_keyword_count = sum(1 for keyword in complex_keywords if keyword in question.lower())
+    if complex_keyword_count > 5:
+        complexity_score += 3
+    elif complex_keyword_count > 3:
+        complexity_score += 2
+    elif complex_keyword_count > 1:
+        complexity_score += 1
+    
+    # Factor 4: Conjunctions suggesting multiple parts
+    conjunctions = [' and ', ' or ', ' but ', ' also ', ' additionally', ' furthermore', ' moreover']
+    conjunction_count = sum(1 for conj in conjunctions if conj in question.lower())
+    if conjunction_count > 2:
+        complexity_score += 2
+    elif conjunction_count > 0:
+        complexity_score += 1
+    
+    # Factor 5: Specific complex question patterns
+    complex_patterns = [
+        r'what are (?:all )?the .* for',  # "what are all the requirements for"
+        r'how (?:do|can) i .* and .*',    # "how do i apply and what documents"
+        r'what is the difference between',  # comparison questions
+        r'can you (?:explain|describe|list) (?:all|the)',  # comprehensive requests
+        r'what (?:steps|process|procedure)',  # process questions
+        r'(?:list|show|tell me about) (?:all|every|the various)'  # comprehensive lists
+    ]
+    
+    pattern_matches = sum(1 for pattern in complex_patterns if re.search(pattern, question.lower()))
+    if pattern_matches > 0:
+        complexity_score += 2
+    
+    # Cap the score at 10
+    return min(complexity_score, 10)
+
+def determine_chunk_count(question, base_chunks=3, max_chunks=12):
+    """
+    Determine the optimal number of chunks based on question complexity.
+    
+    Args:
+        question (str): The user's question
+        base_chunks (int): Minimum number of chunks
+        max_chunks (int): Maximum number of chunks
+    
+    Returns:
+        int: Number of chunks to use
+    """
+    complexity = calculate_question_complexity(question)
+    
+    # Map complexity (1-10) to chunk count (base_chunks to max_chunks)
+    chunk_count = base_chunks + int((complexity - 1) * (max_chunks - base_chunks) / 9)
+    
+    return max(base_chunks, min(chunk_count, max_chunks))
+
+def get_complexity_explanation(question):
+    """
+    Get a human-readable explanation of why a certain complexity was assigned.
+    """
+    complexity = calculate_question_complexity(question)
+    word_count = len(question.split())
+    
+    explanations = []
+    
+    if word_count > 30:
+        explanations.append(f"Long question ({word_count} words)")
+    elif word_count > 15:
+        explanations.append(f"Medium-length question ({word_count} words)")
+    
+    complex_keywords = [
+        'compare', 'contrast', 'analyze', 'explain', 'describe', 'detail', 'comprehensive',
+        'thorough', 'complete', 'all', 'every', 'various', 'different', 'multiple',
+        'process', 'procedure', 'steps', 'requirements', 'criteria', 'conditions'
+    ]
+    
+    found_keywords = [kw for kw in complex_keywords if kw in question.lower()]
+    if found_keywords:
+        explanations.append(f"Complex keywords detected: {', '.join(found_keywords[:3])}")
+    
+    if 'what are' in question.lower() and ('all' in question.lower() or 'every' in question.lower()):
+        explanations.append("Comprehensive information request")
+    
+    if len(explanations) == 0:
+        explanations.append("Simple, direct question")
+    
+    return f"Complexity: {complexity}/10 ({'; '.join(explanations)})"
+
+#------------------------------------------------------------------------------
+# SEARCH FUNCTIONS
+#------------------------------------------------------------------------------
+
+def build_date_filter(start_date=None, end_date=None):
+    """
+    Build the Cortex Search filter dictionary for an effective date range.
+    Returns None when no filtering is needed.
+    """
+    filter_conditions = []
+
+    if start_date and end_date:
+        # Convert dates to string format for filtering
+        start_date_str = start_date.strftime("%Y-%m-%d")
+        end_date_str = end_date.strftime("%Y-%m-%d")
+
+        # Add date range filter
+        filter_conditions.append({
+            "@and": [
+                {"@gte": {"eff_code_final_date": start_date_str}},
+                {"@lte": {"eff_code_final_date": end_date_str}}
+            ]
+        })
+
+    # Combine filters
+    if len(filter_conditions) == 0:
+        return None
+    elif len(filter_conditions) == 1:
+        return filter_conditions[0]
+    return {"@and": filter_conditions}
+
+def search_chunks(cortex_service, question, filter_dict=None, limit=SEARCH_LIMIT):
+    """
+    Query the Cortex Search Service.
+    Results come back ranked by relevance score.
+    """
+    return cortex_service.search(
+        question,
+        SEARCH_COLUMNS,
+        filter=filter_dict if filter_dict else None,
+        limit=limit
+    )
+
+#------------------------------------------------------------------------------
+# PROMPT FUNCTIONS
+#------------------------------------------------------------------------------
+
+def build_context(results):
+    """Build the context string from ranked search results"""
+    context = ""
+    for i, result in enumerate(results):
+        doc_title = result.get('relative_path', 'Unknown')
+        eff_date = result.get('eff_code_final_date', '')
+        date_display = f" (Effective Date: {eff_date})" if eff_date else ""
+        context += f"Source {i+1} - {doc_title}{date_display}:\n{result['chunk']}\n\n"
+    return context
+
+def build_source_list(results):
+    """Create source previews for citation guidance"""
+    source_list = ""
+    for i, result in enumerate(results):
+        # Get the first 100 characters of each source as a preview
+        preview = result['chunk'][:100] + "..." if len(result['chunk']) > 100 else result['chunk']
+        source_list += f"Source {i+1}: {preview}\n\n"
+    return source_list
+
+def build_rag_system_message(results, actual_num_chunks):
+    """Build the RAG system message from the selected search results"""
+    # RAG-specific system message - moved outside f-string to avoid backslash issue
+    context_section = f"Context:\n{build_context(results)}"
+    sources_section = f"Sources:\n{build_source_list(results)}"
+    return f"""You are an AI assistant specifically designed to answer questions based solely on the provided context. Your knowledge is limited to the information below.
+        
+{context_section}
+
+{sources_section}
+
+These sources are chunks from documents. Sources with the same number prefix come from the same document. The sources are already ranked by relevance, with Source 1 being the most relevant to the user's question. The sources include documents from various effective dates to provide comprehensive coverage. The number of sources provided ({actual_num_chunks}) was automatically selected based on the complexity of the question.
+
+Instructions:
+1. Carefully analyze the provided context.
+2. Answer questions only based on the above information.
+3. If the context lacks sufficient details, state specifically what information is missing. For example: "The provided sources mention X but don't specify Y, which would be needed to fully answer this question."
+4. Maintain a professional and concise tone.
+5. IMPORTANT: For each claim or piece of information in your response, add a citation marker like [1], [2], etc. that corresponds to the source number in the context. If a claim comes from multiple sources, include all relevant numbers like [1,3].
+6. Only cite sources that directly support your statement. Don't cite sources that weren't used.
+7. Be precise with your citations - make sure each citation points to a source that actually contains that specific information.
+8. Structure your answers in this format when possible:
+   - Start with a direct answer to the question
+   - Provide supporting details with proper citations
+   - If appropriate, include a brief summary at the end
+9. When answering complex questions, briefly explain your reasoning, showing how you arrived at the answer based on the provided sources.
+10. Be precise in your statements. Don't generalize beyond what the sources explicitly state. Maintain factual accuracy at all costs.
+11. Each source may include additional metadata, such as "Effective Date" which is stored as yyyy-mm-dd. If the question refers to effective dates or timeframes, use the "Effective Date" value from the relevant source(s) and cite them precisely. You can also infer the effective date from the title of the document if necessary. 
+12. When multiple sources with different effective dates contain relevant information, include information from all relevant sources and note the different effective dates in your response.
+13. Use all {actual_num_chunks} sources effectively - this number was specifically chosen based on the complexity of the question to provide comprehensive coverage.
+"""
+
+GENERAL_SYSTEM_MESSAGE = """You are an advanced AI assistant designed to provide exceptional support. You have been trained on a wide range of knowledge and can answer questions across many domains.
+
+Instructions:
+1. Answer questions to the best of your abilities using your internal knowledge.
+2. Express uncertainty when you don't know something rather than making up information.
+3. Maintain a professional and concise tone in your responses.
+4. Structure your answers in this format when possible:
+   - Start with a direct answer to the question - Format so it is easy to read and understand
+   - Provide supporting details and explanations if needed
+   - If appropriate, include a brief summary at the end - YOU DO NOT ALWAYS HAVE TO DO THIS
+5. When answering complex questions, briefly explain your reasoning to help the user understand your thought process.
+6. Be precise in your statements and make clear distinctions between facts, opinions, and speculations.
+7. Consider the context of the conversation when formulating your responses.
+8. If the user asks for creative content like code, stories, or business ideas, feel free to be imaginative while ensuring practical usefulness.
+"""
+
+def build_full_prompt(system_message, conversation_history, prompt):
+    """Combine system instructions with conversation history and the new prompt"""
+    return f"{system_message}\n{conversation_history}\nUser: {prompt}"
+
+def format_conversation_history(messages):
+    """Format prior chat messages as a User/Assistant transcript"""
+    conversation_history = ""
+    for message in messages:
+        role = "User" if message["role"] == "user" else "Assistant"
+        conversation_history += f"{role}: {message['content']}\n\n"
+    return conversation_history
+
+#------------------------------------------------------------------------------
+# COMPLETION FUNCTIONS
+#------------------------------------------------------------------------------
+
+def complete(session, full_prompt, model=FIXED_MODEL):
+    """Call the Cortex complete UDF and return the response text"""
+    response_df = session.create_dataframe([full_prompt]).select(
+        call_udf('snowflake.cortex.complete', model, concat(lit(full_prompt)))
+    )
+    return response_df.collect()[0][0]
+
+def sources_to_json(results):
+    """Convert sources to JSON for storage in CHAT_HISTORY"""
+    try:
+        sources_data = []
+        for result in results:
+            sources_data.append({
+                'chunk': result.get('chunk', ''),
+                'relative_path': result.get('relative_path', ''),
+                'eff_code_final_date': str(result.get('eff_code_final_date', ''))
+            })
+        return json.dumps(sources_data)
+    except:
+        return None
+
+#------------------------------------------------------------------------------
+# END-TO-END QUESTION ANSWERING
+#------------------------------------------------------------------------------
+
+def answer_question(session, cortex_service, question, filter_dict=None, model=FIXED_MODEL,
+                    conversation_history="", search_response=None,
+                    min_chunks=MIN_CHUNKS, max_chunks=MAX_CHUNKS, rerank=None):
+    """
+    Run search plus complete for a single question, the same way the app does.
+
+    Args:
+        session: Snowpark session used for the complete UDF
+        cortex_service: Cortex Search Service handle
+        question (str): The user's question
+        filter_dict (dict): Optional Cortex Search filter
+        model (str): Model passed to snowflake.cortex.complete
+        conversation_history (str): Prior turns formatted as a transcript
+        search_response: Optional precomputed search response (skips the search call)
+        min_chunks (int): Minimum number of chunks placed in the context
+        max_chunks (int): Maximum number of chunks placed in the context
+        rerank (dict): Overrides for the diversity reranking (see reranking.RERANK_DEFAULTS)
+
+    Returns:
+        dict: answer, selected results, chunk count and per-stage timings in seconds
+    """
+    actual_num_chunks = determine_chunk_count(question, min_chunks, max_chunks)
+
+    search_start = time.perf_counter()
+    if search_response is None:
+        search_response = search_chunks(cortex_service, question, filter_dict)
+    search_seconds = time.perf_counter() - search_start
+    results = rerank_results(search_response.results, actual_num_chunks, rerank)
+
+    system_message = build_rag_system_message(results, actual_num_chunks)
+    full_prompt = build_full_prompt(system_message, conversation_history, question)
+
+    complete_start = time.perf_counter()
+    answer = complete(session, full_prompt, model)
+    complete_seconds = time.perf_counter() - complete_start
+
+    return {
+        "answer": answer,
+        "results": results,
+        "num_chunks": actual_num_chunks,
+        "prompt_chars": len(full_prompt),
+        "search_seconds": search_seconds,
+        "complete_seconds": complete_seconds,
+    }
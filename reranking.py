@@ -0,0 +1,176 @@
+# Reranking
+# Diversity-aware selection of search results before the context is built.
+#
+# Cortex Search returns results by relevance alone, so one long publication
+# that matches strongly can fill every context slot. Maximal marginal relevance
+# (MMR) picks results one at a time, trading each candidate's relevance against
+# its redundancy with what is already selected. Redundancy combines cheap local
+# features: hashed bag-of-words text similarity, same document, same document
+# family and closeness of effective dates. Everything is computed as NumPy
+# matrices over a shortlist of the top results (50 by default), so the whole
+# step takes a few milliseconds (see benchmark_reranking.py).
+import math
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import chain
+import numpy as np
+
+# Defaults; any of these can be overridden per request with a config dict
+RERANK_DEFAULTS = {
+    "enabled": True,
+    # 1.0 is pure relevance order, lower values favor diversity
+    "lambda": 0.7,
+    # Only this many top results are considered
+    "shortlist": 50,
+    # Redundancy added for a candidate from the same file / family as a selected one
+    "same_document_penalty": 0.3,
+    "same_family_penalty": 0.15,
+    # Redundancy for effective dates close to a selected one, decaying over date_scale_days
+    "date_penalty": 0.1,
+    "date_scale_days": 365,
+}
+
+# Width of the hashed bag-of-words vectors
+HASH_DIMENSIONS = 1024
+
+# Only the start of each chunk is hashed; it is enough to spot near-duplicates
+TEXT_FEATURE_CHARS = 1000
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]{3,}")
+# File name tokens, and the trailing version / date / number tokens that
+# distinguish editions of the same publication (e.g. '24', 'v2', 'rev 3')
+_FILENAME_TOKEN_PATTERN = re.compile(r"[^-_ .]+")
+_VERSION_TOKEN_PATTERN = re.compile(r"(?:v|rev|ver|version)?\d+")
+_VERSION_MARKERS = {"v", "rev", "ver", "version"}
+
+def rerank_config(overrides=None):
+    """Merge per-request overrides into the defaults"""
+    config = dict(RERANK_DEFAULTS)
+    if overrides:
+        config.update(overrides)
+    return config
+
+@lru_cache(maxsize=4096)
+def document_family(relative_path):
+    """
+    Group editions of one publication, e.g. 'bulletins/pharmacy-bulletin-24-03.pdf'
+    and 'bulletins/pharmacy-bulletin-25-01.pdf' are both 'bulletins/pharmacy-bulletin'.
+    """
+    path = (relative_path or "").lower()
+    directory, _, filename = path.rpartition("/")
+    stem = filename.rsplit(".", 1)[0]
+    tokens = list(_FILENAME_TOKEN_PATTERN.finditer(stem))
+    # Drop trailing number tokens, and a bare marker ('v', 'rev', ...) right before one
+    dropped_number = False
+    while len(tokens) > 1:
+        token = tokens[-1].group()
+        if _VERSION_TOKEN_PATTERN.fullmatch(token):
+            dropped_number = True
+        elif not (dropped_number and token in _VERSION_MARKERS):
+            break
+        tokens.pop()
+    if tokens and _VERSION_TOKEN_PATTERN.fullmatch(tokens[-1].group()) is None:
+        # Digits run into the last word ('bulletin24') are an edition number too
+        last = tokens[-1]
+        stem = stem[:last.start()] + last.group().rstrip("0123456789")
+    return f"{directory}/{stem}"
+
+def _date_ordinal(value):
+    """Day number of an effective date (date, datetime or 'yyyy-mm-dd'), NaN if missing"""
+    if isinstance(value, datetime):
+        return float(value.toordinal())
+    if isinstance(value, date):
+        return float(value.toordinal())
+    if value:
+        try:
+            return float(date.fromisoformat(str(value)[:10]).toordinal())
+        except ValueError:
+            pass
+    return math.nan
+
+def _codes(values):
+    """Integer code per distinct value, so equality can be compared as a NumPy matrix"""
+    index = {}
+    return np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.intp, count=len(values))
+
+def text_vectors(texts, dimensions=HASH_DIMENSIONS):
+    """L2-normalized hashed term-count vectors, one row per text"""
+    tokens = [_TOKEN_PATTERN.findall((text or "")[:TEXT_FEATURE_CHARS].lower()) for text in texts]
+    lengths = np.fromiter(map(len, tokens), dtype=np.intp, count=len(tokens))
+    hashes = np.fromiter(map(hash, chain.from_iterable(tokens)), dtype=np.int64, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(texts)), lengths)
+    counts = np.bincount(rows * dimensions + hashes % dimensions, minlength=len(texts) * dimensions)
+    vectors = counts.reshape(len(texts), dimensions).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def redundancy_matrix(results, config):
+    """Pairwise redundancy between candidates (n x n), higher means more alike"""
+    vectors = text_vectors([r.get('chunk', '') for r in results])
+    redundancy = vectors @ vectors.T
+
+    path_list = [r.get('relative_path', '') or '' for r in results]
+    paths = _codes(path_list)
+    families = _codes([document_family(p) for p in path_list])
+    redundancy += config["same_document_penalty"] * (paths[:, None] == paths[None, :])
+    redundancy += config["same_family_penalty"] * (families[:, None] == families[None, :])
+
+    days = np.array([_date_ordinal(r.get('eff_code_final_date')) for r in results])
+    closeness = np.exp(-np.abs(days[:, None] - days[None, :]) / max(config["date_scale_days"], 1))
+    redundancy += config["date_penalty"] * np.nan_to_num(closeness, nan=0.0)
+    return redundancy
+
+def mmr_order(relevance, redundancy, k, mmr_lambda):
+    """
+    Greedy MMR selection.
+
+    Args:
+        relevance (ndarray): Relevance of each candidate, higher is better
+        redundancy (ndarray): Pairwise redundancy matrix
+        k (int): Number of candidates to select
+
+    Returns:
+        list: Indices of the selected candidates, in selection order
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    selected = [int(np.argmax(relevance))]
+    max_redundancy = redundancy[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(k - 1):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_redundancy, redundancy[best], out=max_redundancy)
+    return selected
+
+def rerank_results(results, k, config=None):
+    """
+    Choose k results for the context, balancing relevance and diversity.
+
+    Args:
+        results (list): Search results in relevance order
+        k (int): Number of results to keep
+        config (dict): Overrides for RERANK_DEFAULTS; {"enabled": False} keeps the top k as returned
+
+    Returns:
+        list: The selected results, in the order they should be cited
+    """
+    config = rerank_config(config)
+    results = list(results)
+    if not config["enabled"] or len(results) <= k:
+        return results[:k]
+
+    shortlist = results[:max(config["shortlist"], k)]
+    # Results arrive ranked without scores, so relevance falls off linearly with rank
+    relevance = 1.0 - np.arange(len(shortlist), dtype=np.float64) / len(shortlist)
+    redundancy = redundancy_matrix(shortlist, config)
+    order = mmr_order(relevance, redundancy, k, config["lambda"])
+    return [shortlist[i] for i in order]
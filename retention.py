@@ -0,0 +1,179 @@
+# Retention
+# Expires old CHAT_HISTORY / CHAT_FEEDBACK rows in date-bounded batches.
+#
+# Both tables are clustered on (TO_DATE(timestamp), user_id), so each batch's
+# date-range predicate only touches the micro-partitions holding those days.
+# Aged rows can be copied to compact archive tables before they are deleted.
+#
+#   python retention.py --retention-days 365 --batch-days 7 --archive
+#   python retention.py --retention-days 365 --dry-run
+#
+# The same purge runs on a schedule as the PURGE_CHAT_HISTORY procedure and
+# task defined in Chat retention.sql.
+import argparse
+import logging
+from datetime import datetime, timedelta
+from connection import DB_NAME, SCHEMA_NAME
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+
+RETENTION_DAYS = 365
+BATCH_DAYS = 7
+
+# Table -> (timestamp column, archive table, archive column list, archive select list)
+PURGE_TABLES = {
+    "CHAT_HISTORY": (
+        "created_timestamp",
+        "CHAT_HISTORY_ARCHIVE",
+        "chat_id, session_id, user_id, user_question, assistant_response, source_paths, created_timestamp",
+        # Keep only the cited document paths, not the full chunk text
+        "chat_id, session_id, user_id, user_question, assistant_response, "
+        "TRANSFORM(TRY_PARSE_JSON(sources_used)::ARRAY, s -> s:relative_path::VARCHAR), created_timestamp",
+    ),
+    "CHAT_FEEDBACK": (
+        "feedback_timestamp",
+        "CHAT_FEEDBACK_ARCHIVE",
+        "feedback_id, session_id, user_id, message_index, feedback_type, user_question, feedback_timestamp",
+        "feedback_id, session_id, user_id, message_index, feedback_type, user_question, feedback_timestamp",
+    ),
+}
+
+#------------------------------------------------------------------------------
+# SETUP
+#------------------------------------------------------------------------------
+
+def apply_clustering(session):
+    """Cluster the chat tables by day and user so date-bounded purges prune partitions"""
+    session.sql(f"ALTER TABLE {db_name}.{schema_name}.CHAT_HISTORY CLUSTER BY (TO_DATE(created_timestamp), user_id)").collect()
+    session.sql(f"ALTER TABLE {db_name}.{schema_name}.CHAT_FEEDBACK CLUSTER BY (TO_DATE(feedback_timestamp), user_id)").collect()
+
+def ensure_archive_tables(session):
+    """Create the compact archive tables if they don't exist"""
+    session.sql(f"""
+    CREATE TABLE IF NOT EXISTS {db_name}.{schema_name}.CHAT_HISTORY_ARCHIVE (
+        chat_id VARCHAR,
+        session_id VARCHAR,
+        user_id VARCHAR,
+        user_question VARCHAR(16777216),
+        assistant_response VARCHAR(16777216),
+        source_paths ARRAY,
+        created_timestamp TIMESTAMP,
+        archived_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+    )
+    CLUSTER BY (TO_DATE(created_timestamp))
+    """).collect()
+    session.sql(f"""
+    CREATE TABLE IF NOT EXISTS {db_name}.{schema_name}.CHAT_FEEDBACK_ARCHIVE (
+        feedback_id VARCHAR,
+        session_id VARCHAR,
+        user_id VARCHAR,
+        message_index INTEGER,
+        feedback_type VARCHAR,
+        user_question VARCHAR,
+        feedback_timestamp TIMESTAMP,
+        archived_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+    )
+    CLUSTER BY (TO_DATE(feedback_timestamp))
+    """).collect()
+
+#------------------------------------------------------------------------------
+# PURGE
+#------------------------------------------------------------------------------
+
+def date_batches(oldest, cutoff, batch_days=BATCH_DAYS):
+    """Split [oldest day, cutoff) into consecutive windows of batch_days days"""
+    start = datetime(oldest.year, oldest.month, oldest.day)
+    while start < cutoff:
+        end = min(start + timedelta(days=batch_days), cutoff)
+        yield start, end
+        start = end
+
+def purge_table(session, table, cutoff, batch_days=BATCH_DAYS, archive=True, dry_run=False):
+    """
+    Delete (and optionally archive) rows older than cutoff, one date window at a time.
+    Each window's archive copy and delete run in one transaction.
+    Returns the number of rows deleted (or that would be deleted on a dry run).
+    """
+    timestamp_column, archive_table, archive_columns, archive_select = PURGE_TABLES[table]
+    oldest = session.sql(f"""
+    SELECT MIN({timestamp_column}) AS oldest
+    FROM {db_name}.{schema_name}.{table}
+    WHERE {timestamp_column} < ?
+    """, params=[cutoff]).collect()[0]['OLDEST']
+    if oldest is None:
+        return 0
+
+    total = 0
+    for start, end in date_batches(oldest, cutoff, batch_days):
+        window = f"{timestamp_column} >= ? AND {timestamp_column} < ?"
+        if dry_run:
+            count = session.sql(f"SELECT COUNT(*) AS n FROM {db_name}.{schema_name}.{table} WHERE {window}", params=[start, end]).collect()[0]['N']
+            logging.info(f"[dry run] {table} {start:%Y-%m-%d} to {end:%Y-%m-%d}: {count} rows")
+            total += count
+            continue
+
+        session.sql("BEGIN").collect()
+        try:
+            if archive:
+                session.sql(f"""
+                INSERT INTO {db_name}.{schema_name}.{archive_table} ({archive_columns})
+                SELECT {archive_select}
+                FROM {db_name}.{schema_name}.{table}
+                WHERE {window}
+                """, params=[start, end]).collect()
+            deleted = session.sql(f"DELETE FROM {db_name}.{schema_name}.{table} WHERE {window}", params=[start, end]).collect()
+            session.sql("COMMIT").collect()
+        except Exception:
+            session.sql("ROLLBACK").collect()
+            raise
+        count = deleted[0][0] if deleted else 0
+        logging.info(f"{table} {start:%Y-%m-%d} to {end:%Y-%m-%d}: {count} rows purged")
+        total += count
+    return total
+
+def purge_expired(session, retention_days=RETENTION_DAYS, batch_days=BATCH_DAYS, archive=True, dry_run=False):
+    """
+    Purge chat history and feedback older than retention_days.
+    Also drops sidebar session summaries with no activity since the cutoff.
+    Returns a dict of table -> rows purged.
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    if archive and not dry_run:
+        ensure_archive_tables(session)
+
+    results = {}
+    for table in PURGE_TABLES:
+        results[table] = purge_table(session, table, cutoff, batch_days, archive, dry_run)
+
+    if not dry_run:
+        session.sql(f"""
+        DELETE FROM {db_name}.{schema_name}.CHAT_SESSIONS
+        WHERE last_activity < ?
+        """, params=[cutoff]).collect()
+    return results
+
+def purge_procedure(session, retention_days, batch_days, archive):
+    """Stored procedure handler for PURGE_CHAT_HISTORY (see Chat retention.sql)"""
+    results = purge_expired(session, retention_days, batch_days, archive)
+    return ", ".join(f"{table}: {count} rows" for table, count in results.items())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Purge chat history and feedback past the retention period")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="Keep rows newer than this many days")
+    parser.add_argument("--batch-days", type=int, default=BATCH_DAYS, help="Days purged per batch")
+    parser.add_argument("--archive", action="store_true", help="Copy purged rows to the archive tables first")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be purged")
+    parser.add_argument("--apply-clustering", action="store_true", help="Set the clustering keys before purging")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    from connection import get_session
+
+    args = parse_args()
+    session = get_session()
+    if args.apply_clustering:
+        apply_clustering(session)
+    print(purge_expired(session, args.retention_days, args.batch_days, args.archive, args.dry_run))
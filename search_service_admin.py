@@ -0,0 +1,368 @@
+# Search service admin
+# Zero-downtime refresh of the Cortex Search Service.
+#
+# Rather than `create or replace` on the service users are querying, each
+# refresh builds a new versioned service (MH_PUBLICATIONS_SEARCH_SERVICE_V<timestamp>)
+# from the current DOCS_CHUNKS_TABLE, waits for it to finish indexing, replays
+# a warm-up question set against it and checks its latency, and only then
+# points the alias at it in SEARCH_SERVICE_REGISTRY with a single MERGE. The
+# app resolves the alias through connection.get_active_service_name, so running
+# sessions move over within ACTIVE_SERVICE_TTL seconds; the previous version is
+# dropped once that grace period has passed. The original unversioned service
+# named by the alias itself is never dropped, so it stays available as the
+# fallback the app uses when the registry can't be read.
+#
+#   python search_service_admin.py --refresh
+#   python search_service_admin.py --refresh --warmup questions.txt --max-p95 1.5
+#   python search_service_admin.py --status
+#
+# LocalServiceRegistry is an in-memory stand-in with the same interface, so the
+# refresh flow can be exercised without a warehouse.
+import argparse
+import logging
+import re
+import statistics
+import threading
+import time
+from datetime import datetime
+from connection import (
+    DB_NAME, SCHEMA_NAME, SEARCH_SERVICE_NAME, SERVICE_REGISTRY_TABLE, ACTIVE_SERVICE_TTL,
+    get_search_service
+)
+from rag_pipeline import search_chunks
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+db_name = DB_NAME
+schema_name = SCHEMA_NAME
+
+# The new service is refreshed explicitly by this job, so it doesn't need a short lag
+TARGET_LAG = '365 DAYS'
+WAREHOUSE = 'AIPILOT_WH'
+
+# Give up on a build that hasn't finished indexing after this many seconds
+BUILD_TIMEOUT_SECONDS = 3600
+POLL_SECONDS = 30
+
+# Warm-up checks the new version must pass before it is switched in
+WARMUP_QUESTIONS = 20
+WARMUP_LIMIT = 15
+MAX_WARMUP_P95_SECONDS = 2.0
+MIN_WARMUP_HIT_RATE = 0.9
+
+# Used when CHAT_HISTORY has no questions yet (e.g. a fresh deployment)
+DEFAULT_WARMUP_QUESTIONS = [
+    "Who is eligible for MassHealth Standard?",
+    "What are the income limits for MassHealth coverage?",
+    "How does a provider enroll in MassHealth?",
+    "What pharmacy services require prior authorization?",
+    "What dental services are covered for adult members?",
+    "How are nursing facility services paid?",
+    "When does a member's coverage start after an application is approved?",
+    "What transportation services does MassHealth cover?",
+]
+
+# Keep the old version until every process has re-read the registry
+DROP_GRACE_SECONDS = 2 * ACTIVE_SERVICE_TTL
+
+#------------------------------------------------------------------------------
+# REGISTRIES
+#------------------------------------------------------------------------------
+
+class SnowflakeServiceRegistry:
+    """Creates, checks, queries and drops versioned services in Snowflake"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def ensure_table(self):
+        self.session.sql(f"""
+        CREATE TABLE IF NOT EXISTS {db_name}.{schema_name}.{SERVICE_REGISTRY_TABLE} (
+            alias VARCHAR,
+            service_name VARCHAR,
+            previous_service_name VARCHAR,
+            activated_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+            PRIMARY KEY (alias)
+        )
+        """).collect()
+
+    def active_service(self, alias):
+        """The service the alias points to, or None if it has never been swapped"""
+        rows = self.session.sql(f"""
+        SELECT service_name
+        FROM {db_name}.{schema_name}.{SERVICE_REGISTRY_TABLE}
+        WHERE alias = ?
+        """, params=[alias]).collect()
+        return rows[0]['SERVICE_NAME'] if rows else None
+
+    def activate(self, alias, service_name):
+        """Point the alias at service_name in one statement"""
+        self.session.sql(f"""
+        MERGE INTO {db_name}.{schema_name}.{SERVICE_REGISTRY_TABLE} t
+        USING (SELECT ? AS alias, ? AS service_name) s
+        ON t.alias = s.alias
+        WHEN MATCHED THEN UPDATE SET
+            previous_service_name = t.service_name,
+            service_name = s.service_name,
+            activated_timestamp = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT (alias, service_name)
+            VALUES (s.alias, s.service_name)
+        """, params=[alias, service_name]).collect()
+
+    def create_service(self, service_name):
+        """Build a new service over the current DOCS_CHUNKS_TABLE (same definition as date_extraction.sql)"""
+        self.session.sql(f"""
+        CREATE CORTEX SEARCH SERVICE {db_name}.{schema_name}.{service_name}
+        ON chunk
+        ATTRIBUTES RELATIVE_PATH, CHUNK_ORDER, EFF_CODE_FINAL_DATE
+        WAREHOUSE = {WAREHOUSE}
+        TARGET_LAG = '{TARGET_LAG}'
+        AS (
+            SELECT chunk,
+                relative_path,
+                chunk_order,
+                file_url,
+                eff_code_final_date
+            FROM {db_name}.{schema_name}.DOCS_CHUNKS_TABLE
+        )
+        """).collect()
+
+    def is_ready(self, service_name):
+        """True once the service has indexed its source and is serving queries"""
+        rows = self.session.sql(f"DESCRIBE CORTEX SEARCH SERVICE {db_name}.{schema_name}.{service_name}").collect()
+        if not rows:
+            return False
+        state = {key.lower(): value for key, value in rows[0].asDict().items()}
+        if state.get('indexing_error'):
+            raise RuntimeError(f"{service_name} failed to index: {state['indexing_error']}")
+        return state.get('serving_state') == 'ACTIVE' and state.get('indexing_state') == 'ACTIVE'
+
+    def search(self, service_name, question, limit):
+        return search_chunks(get_search_service(service_name), question, limit=limit)
+
+    def drop_service(self, service_name):
+        self.session.sql(f"DROP CORTEX SEARCH SERVICE IF EXISTS {db_name}.{schema_name}.{service_name}").collect()
+
+class LocalSearchResponse:
+    """Minimal stand-in for a Cortex Search response"""
+
+    def __init__(self, results):
+        self.results = results
+
+class LocalServiceRegistry:
+    """
+    In-memory stand-in for SnowflakeServiceRegistry.
+
+    Args:
+        documents (list): Chunk dicts (chunk, relative_path, eff_code_final_date)
+            that each new service snapshots when it is created
+        build_seconds (float): Time a new service takes to become ready
+        search_latency (float): Seconds each search sleeps, to exercise the latency check
+    """
+
+    def __init__(self, documents, build_seconds=0.0, search_latency=0.0):
+        self.documents = list(documents)
+        self.build_seconds = build_seconds
+        self.search_latency = search_latency
+        self.services = {}  # service_name -> (document snapshot, ready_at monotonic seconds)
+        self.aliases = {}
+        self._lock = threading.Lock()
+
+    def ensure_table(self):
+        pass
+
+    def active_service(self, alias):
+        with self._lock:
+            return self.aliases.get(alias)
+
+    def activate(self, alias, service_name):
+        with self._lock:
+            if service_name not in self.services:
+                raise RuntimeError(f"Cortex search service {service_name} does not exist")
+            self.aliases[alias] = service_name
+
+    def create_service(self, service_name):
+        with self._lock:
+            if service_name in self.services:
+                raise RuntimeError(f"Cortex search service {service_name} already exists")
+            self.services[service_name] = (list(self.documents), time.monotonic() + self.build_seconds)
+
+    def is_ready(self, service_name):
+        with self._lock:
+            return time.monotonic() >= self.services[service_name][1]
+
+    def search(self, service_name, question, limit):
+        with self._lock:
+            if service_name not in self.services:
+                raise RuntimeError(f"Cortex search service {service_name} does not exist")
+            documents = self.services[service_name][0]
+        time.sleep(self.search_latency)
+        question_tokens = set(re.findall(r"\w+", question.lower()))
+        scored = []
+        for document in documents:
+            overlap = len(question_tokens & set(re.findall(r"\w+", document['chunk'].lower())))
+            if overlap:
+                scored.append((overlap, document))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return LocalSearchResponse([dict(document) for _, document in scored[:limit]])
+
+    def drop_service(self, service_name):
+        with self._lock:
+            self.services.pop(service_name, None)
+
+#------------------------------------------------------------------------------
+# REFRESH
+#------------------------------------------------------------------------------
+
+def versioned_name(alias=SEARCH_SERVICE_NAME, now=None):
+    """Name for a new service version, e.g. MH_PUBLICATIONS_SEARCH_SERVICE_V20250701_030000"""
+    now = now or datetime.now()
+    return f"{alias}_V{now:%Y%m%d_%H%M%S}"
+
+def wait_until_ready(registry, service_name, timeout=BUILD_TIMEOUT_SECONDS, poll_seconds=POLL_SECONDS):
+    """Poll until the service is serving, raising if it takes longer than timeout"""
+    deadline = time.monotonic() + timeout
+    while not registry.is_ready(service_name):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{service_name} was not ready after {timeout} seconds")
+        time.sleep(poll_seconds)
+
+def warm_up(registry, service_name, questions, limit=WARMUP_LIMIT):
+    """
+    Run the warm-up questions against a service.
+
+    Returns:
+        dict: questions, errors, hit_rate (share of questions with any result),
+        p50_seconds and p95_seconds
+    """
+    latencies = []
+    hits = 0
+    errors = 0
+    for question in questions:
+        start = time.perf_counter()
+        try:
+            response = registry.search(service_name, question, limit)
+        except Exception as e:
+            logging.warning(f"Warm-up query failed on {service_name}: {str(e)}")
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        if response.results:
+            hits += 1
+
+    report = {"questions": len(questions), "errors": errors, "hit_rate": 0.0, "p50_seconds": None, "p95_seconds": None}
+    if latencies:
+        latencies.sort()
+        report["hit_rate"] = hits / len(questions)
+        report["p50_seconds"] = statistics.median(latencies)
+        report["p95_seconds"] = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+    return report
+
+def check_warm_up(report, max_p95_seconds=MAX_WARMUP_P95_SECONDS, min_hit_rate=MIN_WARMUP_HIT_RATE):
+    """Return a list of reasons the new version should not be switched in (empty if it passes)"""
+    problems = []
+    if report["questions"] == 0:
+        problems.append("no warm-up questions")
+    if report["errors"]:
+        problems.append(f"{report['errors']} warm-up queries failed")
+    if report["p95_seconds"] is not None and report["p95_seconds"] > max_p95_seconds:
+        problems.append(f"p95 latency {report['p95_seconds']:.2f}s is over {max_p95_seconds:.2f}s")
+    if report["questions"] and report["hit_rate"] < min_hit_rate:
+        problems.append(f"only {report['hit_rate']:.0%} of warm-up questions returned results")
+    return problems
+
+def refresh_search_service(registry, warmup_questions, alias=SEARCH_SERVICE_NAME,
+                           max_p95_seconds=MAX_WARMUP_P95_SECONDS, min_hit_rate=MIN_WARMUP_HIT_RATE,
+                           build_timeout=BUILD_TIMEOUT_SECONDS, poll_seconds=POLL_SECONDS,
+                           drop_grace_seconds=DROP_GRACE_SECONDS):
+    """
+    Build, verify and switch to a new version of the search service.
+
+    The alias keeps pointing at the current version until the new one has
+    passed its warm-up checks. A new version that fails to build or to pass is
+    dropped and the error is raised, leaving users on the old version.
+
+    Returns:
+        dict: new and previous service names plus the warm-up report
+    """
+    registry.ensure_table()
+    # Before the first swap the app reads the unversioned service under the alias itself
+    previous = registry.active_service(alias) or alias
+    new = versioned_name(alias)
+
+    logging.info(f"Building {new}")
+    registry.create_service(new)
+    try:
+        wait_until_ready(registry, new, build_timeout, poll_seconds)
+        report = warm_up(registry, new, warmup_questions)
+        logging.info(f"Warm-up of {new}: {report}")
+        problems = check_warm_up(report, max_p95_seconds, min_hit_rate)
+        if problems:
+            raise RuntimeError(f"{new} failed warm-up checks: {'; '.join(problems)}")
+    except Exception:
+        logging.error(f"Dropping {new}; {alias} stays on {previous}")
+        registry.drop_service(new)
+        raise
+
+    registry.activate(alias, new)
+    logging.info(f"{alias} now points to {new}")
+
+    # The unversioned alias service is the app's fallback, so it is kept
+    if previous not in (new, alias):
+        # Sessions that looked up the old name just before the swap may still be querying it
+        time.sleep(drop_grace_seconds)
+        registry.drop_service(previous)
+        logging.info(f"Dropped {previous}")
+    return {"service_name": new, "previous_service_name": previous, "warm_up": report}
+
+def load_warmup_questions(session, limit=WARMUP_QUESTIONS):
+    """
+    Recent distinct questions from CHAT_HISTORY, as a realistic warm-up set.
+    Falls back to DEFAULT_WARMUP_QUESTIONS when there are none.
+    """
+    rows = session.sql(f"""
+    SELECT user_question
+    FROM {db_name}.{schema_name}.CHAT_HISTORY
+    GROUP BY user_question
+    ORDER BY MAX(created_timestamp) DESC
+    LIMIT {int(limit)}
+    """).collect()
+    questions = [row['USER_QUESTION'] for row in rows if row['USER_QUESTION']]
+    if not questions:
+        logging.info("No questions in CHAT_HISTORY; warming up with the built-in question set.")
+        return list(DEFAULT_WARMUP_QUESTIONS)
+    return questions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild the Cortex Search Service and swap it in without downtime")
+    parser.add_argument("--refresh", action="store_true", help="Build, verify and switch to a new version")
+    parser.add_argument("--status", action="store_true", help="Show the version the app is using")
+    parser.add_argument("--warmup", help="File with one warm-up question per line (default: recent CHAT_HISTORY questions)")
+    parser.add_argument("--max-p95", type=float, default=MAX_WARMUP_P95_SECONDS, help="Warm-up p95 latency limit in seconds")
+    parser.add_argument("--min-hit-rate", type=float, default=MIN_WARMUP_HIT_RATE, help="Share of warm-up questions that must return results")
+    parser.add_argument("--drop-grace", type=float, default=DROP_GRACE_SECONDS, help="Seconds to wait before dropping the old version")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    from connection import get_session
+
+    args = parse_args()
+    session = get_session()
+    registry = SnowflakeServiceRegistry(session)
+
+    if args.status:
+        registry.ensure_table()
+        print(registry.active_service(SEARCH_SERVICE_NAME) or SEARCH_SERVICE_NAME)
+
+    if args.refresh:
+        if args.warmup:
+            with open(args.warmup, encoding="utf-8") as f:
+                questions = [line.strip() for line in f if line.strip()]
+        else:
+            questions = load_warmup_questions(session)
+        print(refresh_search_service(
+            registry, questions,
+            max_p95_seconds=args.max_p95,
+            min_hit_rate=args.min_hit_rate,
+            drop_grace_seconds=args.drop_grace
+        ))
@@ -0,0 +1,117 @@
+# Single flight
+# Coalesces identical in-flight Cortex Search calls across sessions.
+#
+# When a bulletin lands, many staff ask the same question within seconds. The
+# first request for a key does the call; requests for the same key that
+# arrive while it is still running wait for it and share its result (or its
+# error) instead of issuing their own. A waiter that gives up after its
+# timeout, or whose leader was interrupted rather than failing (e.g. a
+# Streamlit rerun or stop in the leader's session), makes an independent
+# call. Nothing is kept once a call finishes, so this only merges concurrent
+# duplicates; it is not a cache. Completions are coalesced by the completion
+# scheduler instead, keyed with completion_key(), so every session can follow
+# the shared job's place in the queue.
+import json
+import logging
+import re
+import threading
+from concurrent.futures import Future, wait
+
+# How long a duplicate request waits on the shared call before calling on its own
+SEARCH_WAIT_SECONDS = 30
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+class _LeaderAborted(Exception):
+    """Set on a shared call whose leader was interrupted, so waiters call on their own"""
+
+class SingleFlight:
+    """Process-wide registry of in-flight calls, keyed by request"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the call in flight
+        self._metrics = {"calls": 0, "leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key, fn, timeout):
+        """
+        Run fn for this key, or wait for the identical call already running.
+
+        Args:
+            key (str): Identifies identical requests
+            fn (callable): The call to make; takes no arguments
+            timeout (float): Seconds to wait on a shared call before calling fn directly
+
+        Returns:
+            The result of fn, from this call or the shared one
+        """
+        with self._lock:
+            self._metrics["calls"] += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._metrics["leaders"] += 1
+
+        if not leader:
+            # Wait without result() so a TimeoutError raised by the shared call
+            # itself is not mistaken for this wait timing out
+            done, _ = wait([future], timeout=timeout)
+            if not done:
+                with self._lock:
+                    self._metrics["timeouts"] += 1
+                logging.warning(f"Timed out waiting on a shared {self.name} call, calling independently.")
+                return fn()
+            if isinstance(future.exception(), _LeaderAborted):
+                logging.info(f"Shared {self.name} call was interrupted, calling independently.")
+                return fn()
+            with self._lock:
+                self._metrics["coalesced"] += 1
+            # The shared call's error, if it failed, is shared too
+            return future.result()
+
+        try:
+            result = fn()
+        except Exception as e:
+            # The call failed: waiters get the same error
+            with self._lock:
+                self._metrics["errors"] += 1
+                del self._calls[key]
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # The leader's session was interrupted (RerunException, StopException,
+            # KeyboardInterrupt): only the leader sees that, waiters retry themselves
+            with self._lock:
+                del self._calls[key]
+            future.set_exception(_LeaderAborted())
+            raise
+        with self._lock:
+            del self._calls[key]
+        future.set_result(result)
+        return result
+
+    def metrics(self):
+        """Counts so far, plus the number of calls currently in flight"""
+        with self._lock:
+            return dict(self._metrics, in_flight=len(self._calls))
+
+search_flight = SingleFlight("search")
+
+def normalize_prompt(text):
+    """Case- and whitespace-insensitive form of a question or prompt"""
+    return _WHITESPACE_PATTERN.sub(" ", (text or "").strip().lower())
+
+def search_key(question, filter_dict, service_name):
+    """Key for a Cortex Search call: the normalized question, its filter and the service"""
+    return json.dumps([service_name, normalize_prompt(question), filter_dict], sort_keys=True, default=str)
+
+def completion_key(full_prompt, model):
+    """Key for a completion job: the whole normalized prompt (history and sources included) and the model"""
+    return json.dumps([model, normalize_prompt(full_prompt)])
+
+def coalescing_metrics():
+    """Metrics for the search registry, e.g. for the Diagnostics sidebar (see the scheduler for completions)"""
+    return {"search": search_flight.metrics()}
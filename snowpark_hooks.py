@@ -0,0 +1,36 @@
+# Snowpark hooks
+# One shared wrapper around DataFrame.collect() that other modules register
+# hooks with, so query tagging (query_tags.py) and Snowflake wait timing
+# (profiling.py) don't each patch collect on top of the other.
+#
+# A hook is called with the collect() keyword arguments, which it may change
+# (e.g. to add statement_params), and returns a context manager that is
+# entered around the call.
+import threading
+from contextlib import ExitStack
+
+_hooks = {}  # name -> hook, in registration order
+_lock = threading.Lock()
+_collect_patched = False
+
+def register_collect_hook(name, hook):
+    """
+    Run hook around every DataFrame.collect(). Registering the same name again
+    replaces the hook, so modules can register on every rerun.
+    """
+    global _collect_patched
+    with _lock:
+        _hooks[name] = hook
+        if _collect_patched:
+            return
+        from snowflake.snowpark import DataFrame
+        original_collect = DataFrame.collect
+
+        def collect(self, *args, **kwargs):
+            with ExitStack() as stack:
+                for hook in list(_hooks.values()):
+                    stack.enter_context(hook(kwargs))
+                return original_collect(self, *args, **kwargs)
+
+        DataFrame.collect = collect
+        _collect_patched = True
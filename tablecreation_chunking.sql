@@ -34,19 +34,65 @@ create or replace TABLE DOCS_CHUNKS_TABLE (
     CHUNK VARCHAR(16777216) -- Piece of text
 );
 
--- USE CORTEX PARSE_DOCUMENT TO READ AND USE FUNCTION CREATED TO CHUNK
+-- REGISTER THE LAYOUT-AWARE CHUNKER (chunker.py) AS A VECTORIZED UDTF
+-- Upload chunker.py first, e.g. from SnowSQL:
+--   PUT file://chunker.py @MH_PUBLICATIONS.DATA.CODE_STAGE AUTO_COMPRESS = FALSE OVERWRITE = TRUE;
+CREATE STAGE IF NOT EXISTS MH_PUBLICATIONS.DATA.CODE_STAGE;
+
+CREATE OR REPLACE FUNCTION layout_chunker(relative_path VARCHAR, layout VARCHAR, chunk_size INTEGER, chunk_overlap INTEGER)
+RETURNS TABLE (relative_path VARCHAR, chunk_order INTEGER, chunk VARCHAR)
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.10'
+PACKAGES = ('pandas')
+IMPORTS = ('@MH_PUBLICATIONS.DATA.CODE_STAGE/chunker.py')
+HANDLER = 'chunker.LayoutChunkerUDTF';
+
+-- USE CORTEX PARSE_DOCUMENT TO READ AND layout_chunker TO CHUNK
+-- Chunk size and overlap are in tokens (512 / 64 here). The chunker reads the
+-- LAYOUT JSON itself, so chunks no longer need the '|||' / '{"content":"' /
+-- '","metadata":' cleanup in date_extraction.sql.
 insert into docs_chunks_table (relative_path, size, file_url,
                             scoped_file_url, chunk_order, chunk)
 
-    select relative_path, 
-            size,
-            file_url, 
-            build_scoped_file_url(@upload_070225, relative_path) as scoped_file_url,
-            func.chunk_order as chunk_order,
-            func.chunk as chunk
-    from 
-        directory(@upload_070225),
-        TABLE(text_chunker (TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@upload_070225, relative_path, {'mode': 'LAYOUT'})))) as func;
+    with files as (
+        select relative_path,
+                size,
+                file_url,
+                build_scoped_file_url(@upload_070225, relative_path) as scoped_file_url
+        from directory(@upload_070225)
+    ),
+    parsed as (
+        select relative_path,
+                TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@upload_070225, relative_path, {'mode': 'LAYOUT'})) as layout
+        from files
+    ),
+    chunks as (
+        select func.relative_path, func.chunk_order, func.chunk
+        from parsed,
+            TABLE(layout_chunker(parsed.relative_path, parsed.layout, 512, 64)
+                  OVER (PARTITION BY parsed.relative_path)) as func
+    )
+    select files.relative_path,
+            files.size,
+            files.file_url,
+            files.scoped_file_url,
+            chunks.chunk_order,
+            chunks.chunk
+    from chunks
+    join files on files.relative_path = chunks.relative_path;
+
+-- Previous chunking with the text_chunker UDF:
+-- insert into docs_chunks_table (relative_path, size, file_url,
+--                             scoped_file_url, chunk_order, chunk)
+--     select relative_path,
+--             size,
+--             file_url,
+--             build_scoped_file_url(@upload_070225, relative_path) as scoped_file_url,
+--             func.chunk_order as chunk_order,
+--             func.chunk as chunk
+--     from
+--         directory(@upload_070225),
+--         TABLE(text_chunker (TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@upload_070225, relative_path, {'mode': 'LAYOUT'})))) as func;
 
 -- CHECK CHUNKS TABLE
 select *
@@ -0,0 +1,32 @@
+# Tests for reading batch questions in "Search service set up.py"
+import importlib.util
+import json
+import os
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "search_service_set_up", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Search service set up.py"))
+search_service_set_up = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(search_service_set_up)
+
+def write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    return str(path)
+
+def test_zero_is_a_valid_id(tmp_path):
+    path = write_jsonl(tmp_path / "q.jsonl", [
+        {"id": 0, "question": "a"}, {"id": "", "question": "b"}, {"question": "c"}, {"id": 7, "question": " "}])
+    assert search_service_set_up.read_questions(path) == [
+        {"id": "0", "question": "a"}, {"id": "2", "question": "b"}, {"id": "3", "question": "c"}]
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    # "1" given explicitly and again as a JSON int
+    path = write_jsonl(tmp_path / "q.jsonl", [{"id": 1, "question": "a"}, {"id": "1", "question": "b"}])
+    with pytest.raises(ValueError, match="duplicate question ids"):
+        search_service_set_up.read_questions(path)
+
+def test_row_numbers_colliding_with_ids_are_rejected(tmp_path):
+    path = tmp_path / "q.csv"
+    path.write_text("id,question\n2,a\n,b\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="2 \\(rows 1, 2\\)"):
+        search_service_set_up.read_questions(str(path))
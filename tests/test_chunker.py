@@ -0,0 +1,33 @@
+# Tests for the layout-aware chunker
+import time
+from chunker import _split_words, chunk_markdown, count_tokens
+
+def test_split_words_never_exceeds_max_tokens():
+    text = " ".join(f"word{n}, x" for n in range(500))
+    pieces = list(_split_words(text, 7, count_tokens))
+    assert all(count_tokens(piece) <= 7 for piece in pieces)
+    assert " ".join(pieces) == text
+
+def test_unpunctuated_text_is_chunked_in_linear_time():
+    text = "# Form\n\n" + " ".join(["member eligibility coverage"] * 7000)
+    start = time.perf_counter()
+    chunks = list(chunk_markdown(text, 512, 64))
+    assert time.perf_counter() - start < 0.5
+    assert all(count_tokens(chunk) <= 512 for chunk in chunks)
+
+def test_consecutive_paragraph_chunks_overlap():
+    paragraphs = [" ".join(f"Paragraph {p} sentence {n} has words." for n in range(5)) for p in range(4)]
+    chunks = list(chunk_markdown("# Title\n\n" + "\n\n".join(paragraphs), chunk_size=100, overlap=25))
+    assert len(chunks) > 1
+    # The next chunk starts with the last sentences of the paragraph before it
+    assert "Paragraph 1 sentence 4 has words." in chunks[1]
+    assert chunks[1].index("Paragraph 1 sentence 4") < chunks[1].index("Paragraph 2 sentence 0")
+
+def test_split_tables_repeat_the_header_and_keep_rows_whole():
+    rows = [f"| {n} | | note {n} |" for n in range(60)]
+    chunks = list(chunk_markdown("# T\n\n| A | B | C |\n|---|---|---|\n" + "\n".join(rows), chunk_size=60, overlap=20))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        lines = chunk.split("\n")
+        assert lines[2:4] == ["| A | B | C |", "|---|---|---|"]
+        assert all(line in rows for line in lines[4:])
@@ -0,0 +1,145 @@
+# Tests for the completion scheduler: fairness, the concurrency cap,
+# timeouts, rate-limit retries and shared jobs
+import threading
+import pytest
+from completion_scheduler import CompletionScheduler, FakeCompletionBackend
+
+class BlockingBackend:
+    """Records prompts in call order; calls for blocked prompts wait for release()"""
+
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.calls = []
+        self._release = threading.Event()
+
+    def release(self):
+        self._release.set()
+
+    def __call__(self, prompt, model):
+        self.calls.append(prompt)
+        if prompt in self.blocked:
+            self._release.wait(5)
+        return f"answer to {prompt}"
+
+def test_round_robin_across_users():
+    backend = BlockingBackend(blocked={"first"})
+    scheduler = CompletionScheduler(backend, max_concurrent=1)
+    # Holds the only slot while the others queue up
+    first = scheduler.submit("x", "first", "m")
+    jobs = [scheduler.submit(user, f"{user}{n}", "m")
+            for user, count in (("a", 3), ("b", 2), ("c", 1)) for n in range(1, count + 1)]
+    assert [scheduler.position(job) for job in jobs] == [1, 4, 6, 2, 5, 3]
+    backend.release()
+    for job in [first] + jobs:
+        scheduler.wait(job, timeout=5)
+    assert backend.calls == ["first", "a1", "b1", "c1", "a2", "b2", "a3"]
+
+def test_concurrency_cap():
+    backend = FakeCompletionBackend(latency=0.05, max_concurrent=100)
+    scheduler = CompletionScheduler(backend, max_concurrent=3)
+    jobs = [scheduler.submit(f"user{n % 4}", f"prompt {n}", "m") for n in range(20)]
+    for job in jobs:
+        scheduler.wait(job, timeout=10)
+    assert backend.peak_concurrency == 3
+    assert scheduler.metrics()["completed"] == 20
+
+def test_queued_job_is_cancelled_on_timeout():
+    backend = BlockingBackend(blocked={"first"})
+    scheduler = CompletionScheduler(backend, max_concurrent=1)
+    first = scheduler.submit("a", "first", "m")
+    queued = scheduler.submit("b", "queued", "m")
+    with pytest.raises(TimeoutError):
+        scheduler.wait(queued, timeout=0.2)
+    assert queued.cancelled.is_set()
+    assert scheduler.position(queued) == 0
+    backend.release()
+    scheduler.wait(first, timeout=5)
+    # The cancelled job never reached the backend
+    assert backend.calls == ["first"]
+    assert scheduler.metrics()["timed_out"] == 1
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's RerunException / StopException"""
+
+def test_abandoned_job_gives_up_its_place():
+    backend = BlockingBackend(blocked={"first"})
+    scheduler = CompletionScheduler(backend, max_concurrent=1)
+    first = scheduler.submit("a", "first", "m")
+    abandoned = scheduler.submit("b", "abandoned", "m")
+    next_job = scheduler.submit("c", "next", "m")
+
+    def rerun(position):
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        scheduler.wait(abandoned, timeout=5, on_position=rerun)
+    assert abandoned.cancelled.is_set()
+    assert scheduler.position(next_job) == 1
+    backend.release()
+    scheduler.wait(first, timeout=5)
+    assert scheduler.wait(next_job, timeout=5) == "answer to next"
+    assert backend.calls == ["first", "next"]
+
+@pytest.mark.parametrize("failures, retries, succeeds", [(2, 3, True), (3, 3, True), (5, 3, False)])
+def test_rate_limited_call_is_retried(failures, retries, succeeds):
+    attempts = []
+
+    def backend(prompt, model):
+        attempts.append(prompt)
+        if len(attempts) <= failures:
+            raise RuntimeError("429 Too Many Requests: Cortex rate limit exceeded")
+        return "answer"
+
+    scheduler = CompletionScheduler(backend, max_concurrent=1, rate_limit_retries=retries, rate_limit_backoff=0.001)
+    if succeeds:
+        assert scheduler.complete("a", "prompt", "m", timeout=5) == ("answer", "m")
+        assert len(attempts) == failures + 1
+        assert scheduler.metrics()["rate_limited"] == failures
+    else:
+        # Retries exhausted: the last rate-limit error is the job's result
+        with pytest.raises(RuntimeError, match="429"):
+            scheduler.complete("a", "prompt", "m", timeout=5)
+        assert len(attempts) == retries + 1
+        metrics = scheduler.metrics()
+        assert metrics["rate_limited"] == retries
+        assert metrics["failed"] == 1
+
+def test_fake_backend_rate_limit_is_retried():
+    # One call per second: the second job is rejected until the window passes
+    backend = FakeCompletionBackend(latency=0.01, max_per_second=1)
+    scheduler = CompletionScheduler(backend, max_concurrent=1, rate_limit_backoff=0.4)
+    jobs = [scheduler.submit("a", "one", "m"), scheduler.submit("b", "two", "m")]
+    results = [scheduler.wait(job, timeout=10) for job in jobs]
+    assert results == ["[m] answer to: one", "[m] answer to: two"]
+    # Rejected at about 0 and 0.4 seconds, accepted after the 0.8 second backoff
+    assert backend.rejected == 2
+    assert scheduler.metrics()["rate_limited"] == 2
+
+def test_other_errors_are_not_retried():
+    attempts = []
+
+    def backend(prompt, model):
+        attempts.append(prompt)
+        raise ValueError("bad prompt")
+
+    scheduler = CompletionScheduler(backend, max_concurrent=1, rate_limit_backoff=0.01)
+    with pytest.raises(ValueError):
+        scheduler.complete("a", "prompt", "m", timeout=5)
+    assert len(attempts) == 1
+    assert scheduler.metrics()["failed"] == 1
+
+def test_requests_with_the_same_key_share_a_job():
+    backend = BlockingBackend(blocked={"prompt"})
+    scheduler = CompletionScheduler(backend, max_concurrent=1)
+    job = scheduler.submit("a", "prompt", "m", key="k")
+    assert scheduler.submit("b", "prompt", "m", key="k") is job
+    # One caller giving up leaves the job running for the other
+    with pytest.raises(TimeoutError):
+        scheduler.wait(job, timeout=0.1)
+    assert not job.cancelled.is_set()
+    backend.release()
+    assert scheduler.wait(job, timeout=5) == "answer to prompt"
+    assert backend.calls == ["prompt"]
+    assert scheduler.metrics()["coalesced"] == 1
+    # Once finished, the key starts a new job
+    assert scheduler.submit("a", "prompt", "m", key="k") is not job
@@ -0,0 +1,41 @@
+# Tests for the evaluation search cache and summary
+import evaluation
+from evaluation import SearchCache, summarize
+
+class FakeResponse:
+    def __init__(self, results):
+        self.results = results
+
+def test_search_cache_times_misses_only(tmp_path, monkeypatch):
+    calls = []
+
+    def search_chunks(cortex_service, question, filter_dict=None):
+        calls.append(question)
+        return FakeResponse([{"chunk": "text", "relative_path": "a.pdf"}])
+
+    monkeypatch.setattr(evaluation, "search_chunks", search_chunks)
+    cache = SearchCache("SVC_V1", str(tmp_path))
+    response, seconds, hit = cache.search(None, "question")
+    assert not hit and seconds is not None
+    response, seconds, hit = cache.search(None, "question")
+    assert hit and seconds is None
+    assert response.results == [{"chunk": "text", "relative_path": "a.pdf"}]
+    assert calls == ["question"]
+
+    # Another service version never reads this version's results
+    _, _, hit = SearchCache("SVC_V2", str(tmp_path)).search(None, "question")
+    assert not hit
+    assert calls == ["question", "question"]
+
+def test_summary_search_latency_excludes_cache_hits():
+    def row(search_seconds, hit, complete_seconds):
+        return {"config": "baseline", "search_seconds": search_seconds, "search_cache_hit": hit,
+                "complete_seconds": complete_seconds, "source_recall": None, "source_jaccard": None,
+                "answer_similarity": None, "prompt_tokens": 100, "completion_tokens": 20}
+
+    rows = [row(0.4, False, 1.0), row(None, True, 2.0), row(None, True, 3.0), row(0.8, False, 4.0)]
+    summary = summarize(rows, [{"name": "baseline"}])[0]
+    assert abs(summary["search_p50_seconds"] - 0.6) < 1e-9
+    assert summary["search_p95_seconds"] == 0.8
+    assert summary["search_cache_hit_rate"] == 0.5
+    assert summary["complete_p95_seconds"] == 4.0
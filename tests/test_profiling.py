@@ -0,0 +1,42 @@
+# Tests for closing per-rerun profiles that their run never finished
+import threading
+import pytest
+import profiling
+from profiling import finish_rerun_profile, start_rerun_profile
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.delenv(profiling.PROFILE_ENV_VAR, raising=False)
+
+def start_on_thread(session_key):
+    """Start a profile on a thread that ends without finishing it, like a run ended by st.stop()"""
+    started = []
+    thread = threading.Thread(target=lambda: started.append(
+        start_rerun_profile(True, "session", "sampling", session_key=session_key)))
+    thread.start()
+    thread.join()
+    return started[0]
+
+def test_next_run_closes_unfinished_profile_from_another_thread():
+    unfinished = start_on_thread("browser-1")
+    assert not unfinished.stopped
+    profile = start_rerun_profile(True, "session", "sampling", session_key="browser-1")
+    assert unfinished.stopped
+    assert "interrupted" in unfinished.summary
+    assert finish_rerun_profile(profile).startswith("Rerun")
+    assert profiling._live_profiles == {}
+
+def test_other_sessions_profiles_are_left_running():
+    other = start_on_thread("browser-2")
+    profile = start_rerun_profile(True, "session", "sampling", session_key="browser-3")
+    assert not other.stopped
+    finish_rerun_profile(profile)
+    finish_rerun_profile(other)
+    assert other.stopped
+
+def test_stale_profiles_are_closed(monkeypatch):
+    stale = start_on_thread("browser-4")
+    monkeypatch.setattr(profiling, "STALE_PROFILE_SECONDS", 0)
+    start_rerun_profile(False, "session", session_key="browser-5")
+    assert stale.stopped
@@ -0,0 +1,106 @@
+# Tests for query tags and the per-stage warehouse usage report
+import json
+import threading
+from datetime import datetime, timedelta
+from query_tags import (
+    LocalQueryHistory, build_stage_report, current_query_context, format_report,
+    query_stage, query_tag, set_query_context, use_query_context
+)
+
+def app_tag(stage, session="s1", turn=1):
+    return json.dumps({"app": "mh_publications", "stage": stage, "session": session, "turn": turn})
+
+def test_query_tag_carries_stage_session_and_turn():
+    set_query_context("s1", 2)
+    with query_stage("search"):
+        assert json.loads(query_tag()) == {"app": "mh_publications", "stage": "search", "session": "s1", "turn": 2}
+    assert json.loads(query_tag())["stage"] == "other"
+    set_query_context()
+
+def test_context_is_carried_to_worker_threads():
+    set_query_context("s1", 3)
+    with query_stage("complete"):
+        context = current_query_context()
+    tags = []
+
+    def worker():
+        with use_query_context(context):
+            tags.append(json.loads(query_tag()))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert tags[0]["stage"] == "complete" and tags[0]["session"] == "s1" and tags[0]["turn"] == 3
+    set_query_context()
+
+def test_stage_report_totals():
+    history = LocalQueryHistory()
+    history.add(app_tag("complete", "s1"), bytes_scanned=0, total_elapsed_time=4000, execution_time=3000)
+    history.add(app_tag("complete", "s2"), bytes_scanned=0, total_elapsed_time=2000, execution_time=1000)
+    history.add(app_tag("search", "s1"), bytes_scanned=2_000_000, total_elapsed_time=500,
+                execution_status="FAILED_WITH_ERROR")
+    history.add(app_tag("search", "s1"), bytes_scanned=1_000_000, total_elapsed_time=500)
+    # Not the app's, and too old: both ignored
+    history.add("some other tool", total_elapsed_time=99999)
+    history.add(app_tag("complete"), total_elapsed_time=99999, start_time=datetime.now() - timedelta(days=30))
+
+    report = build_stage_report(history.fetch(days=7))
+    assert [r["stage"] for r in report] == ["complete", "search"]
+    complete, search = report
+    assert complete["queries"] == 2
+    assert complete["sessions"] == 2
+    assert complete["elapsed_seconds"] == 6.0
+    assert complete["execution_seconds"] == 4.0
+    assert complete["mean_ms"] == 3000
+    assert complete["execution_share"] == 0.8
+    assert search["queries"] == 2
+    assert search["failed"] == 1
+    assert search["sessions"] == 1
+    assert search["bytes_scanned"] == 3_000_000
+    assert search["p95_ms"] == 500
+
+    text = format_report(report, 7)
+    assert text.startswith("# Warehouse usage by app stage (last 7 days)")
+    assert "| complete | 2 | 0 | 2 | 0.0 | 6.0 | 4.0 | 3000 | 4000 | 80.0% |" in text
+    assert "| search | 2 | 1 | 1 | 3.0 | 1.0 | 1.0 | 500 | 500 | 20.0% |" in text
+
+def test_empty_report():
+    assert "(no tagged queries)" in format_report(build_stage_report([]), 7)
+
+def test_tagging_and_profiling_share_one_collect_hook(monkeypatch, tmp_path):
+    from snowflake.snowpark import DataFrame
+    import profiling
+    import snowpark_hooks
+    from query_tags import install_query_tagging
+
+    seen = []
+    monkeypatch.setattr(DataFrame, "collect", lambda self, *args, **kwargs: seen.append(kwargs) or [])
+    monkeypatch.setattr(snowpark_hooks, "_hooks", {})
+    monkeypatch.setattr(snowpark_hooks, "_collect_patched", False)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    # Installed in either order and more than once, each hook runs once per collect
+    profile = profiling.start_rerun_profile(True, "session", "sampling", session_key="hooks")
+    install_query_tagging()
+    install_query_tagging()
+    set_query_context("s1", 1)
+    with query_stage("history_load"):
+        DataFrame.collect(object())
+    DataFrame.collect(object(), statement_params={"QUERY_TAG": "explicit"})
+    profiling.finish_rerun_profile(profile)
+    set_query_context()
+
+    assert json.loads(seen[0]["statement_params"]["QUERY_TAG"])["stage"] == "history_load"
+    assert seen[1]["statement_params"]["QUERY_TAG"] == "explicit"
+    assert profile.wait_counts == {"sql": 2}
+
+def test_prefetch_carries_the_callers_context(monkeypatch):
+    import prefetch
+
+    tags = []
+    monkeypatch.setattr(prefetch, "get_search_service", lambda service_name: tags.append(json.loads(query_tag())))
+    monkeypatch.setattr(prefetch, "search_chunks", lambda service, question, filter_dict: "results")
+    set_query_context("s1", 4)
+    assert prefetch.prefetch_search("question", None, "SVC").result(timeout=5) == "results"
+    set_query_context()
+    assert tags == [{"app": "mh_publications", "stage": "search", "session": "s1", "turn": 4}]
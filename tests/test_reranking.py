@@ -0,0 +1,74 @@
+# Tests for the diversity reranker
+import time
+import numpy as np
+import pytest
+from reranking import document_family, mmr_order, redundancy_matrix, rerank_config, rerank_results
+
+NEAR_DUPLICATE = "Members must renew MassHealth coverage every year by returning the renewal form"
+
+def result(chunk, path, date="2024-01-01"):
+    return {"chunk": chunk, "relative_path": path, "eff_code_final_date": date}
+
+def dominated_results():
+    """Top ranks are near-duplicate chunks of one bulletin's editions, then a different document"""
+    return [
+        result(NEAR_DUPLICATE + " (page 1).", "bulletins/renewal-bulletin-24-01.pdf"),
+        result(NEAR_DUPLICATE + " (page 2).", "bulletins/renewal-bulletin-24-01.pdf"),
+        result(NEAR_DUPLICATE + " (page 1).", "bulletins/renewal-bulletin-24-02.pdf"),
+        result("Dental providers bill adult cleanings under the new fee schedule.", "manuals/dental-manual.pdf",
+               "2019-06-01"),
+    ]
+
+@pytest.mark.parametrize("path, family", [
+    ("bulletins/pharmacy-bulletin-24-03.pdf", "bulletins/pharmacy-bulletin"),
+    ("a/Eligibility_Memo_v2.pdf", "a/eligibility_memo"),
+    ("x/memo rev 3.docx", "x/memo"),
+    ("x/guide_ver_10_2.pdf", "x/guide"),
+    ("x/bulletin24.pdf", "x/bulletin"),
+    ("x/appendix-b.pdf", "x/appendix-b"),
+    ("x/plan-v.pdf", "x/plan-v"),
+    # A name that is only numbers is kept whole
+    ("x/12-34.pdf", "x/12-34"),
+    ("", "/"),
+])
+def test_document_family(path, family):
+    assert document_family(path) == family
+
+def test_document_family_is_linear_on_long_suffixes():
+    path = "x/a" + "-1" * 5000 + "!.pdf"
+    start = time.perf_counter()
+    document_family(path)
+    assert time.perf_counter() - start < 0.5
+
+def test_redundancy_is_higher_within_a_family():
+    results = dominated_results()
+    redundancy = redundancy_matrix(results, rerank_config())
+    assert redundancy.shape == (4, 4)
+    # Same file > other edition of the same bulletin > a different document
+    assert redundancy[0, 1] > redundancy[0, 2] > redundancy[0, 3]
+
+def test_near_duplicates_are_pushed_down():
+    results = dominated_results()
+    selected = rerank_results(results, 2)
+    assert selected[0] is results[0]
+    assert selected[1]["relative_path"] == "manuals/dental-manual.pdf"
+
+def test_lambda_one_keeps_relevance_order():
+    results = dominated_results()
+    assert rerank_results(results, 3, {"lambda": 1.0}) == results[:3]
+
+def test_disabled_returns_input_order():
+    results = dominated_results()
+    assert rerank_results(results, 3, {"enabled": False}) == results[:3]
+
+@pytest.mark.parametrize("count, k", [(0, 5), (1, 5), (1, 1), (4, 10), (4, 0)])
+def test_small_inputs(count, k):
+    results = dominated_results()[:count]
+    assert rerank_results(results, k) == results[:k]
+
+def test_mmr_order_edge_cases():
+    assert mmr_order(np.array([]), np.zeros((0, 0)), 3, 0.7) == []
+    assert mmr_order(np.array([1.0]), np.ones((1, 1)), 3, 0.7) == [0]
+    # Candidate 1 duplicates candidate 0, so 2 is picked before it
+    redundancy = np.array([[1.0, 1.0, 0.0], [1.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+    assert mmr_order(np.array([1.0, 0.9, 0.8]), redundancy, 3, 0.5) == [0, 2, 1]
@@ -0,0 +1,87 @@
+# Tests for the zero-downtime search service refresh, on LocalServiceRegistry
+from datetime import datetime
+import itertools
+import pytest
+import search_service_admin
+from search_service_admin import (
+    LocalServiceRegistry, refresh_search_service, versioned_name
+)
+
+ALIAS = "TEST_SEARCH_SERVICE"
+
+DOCUMENTS = [
+    {"chunk": "MassHealth Standard eligibility depends on household income.",
+     "relative_path": "manuals/eligibility.pdf", "eff_code_final_date": "2024-01-01"},
+    {"chunk": "Pharmacy prior authorization is required for some drugs.",
+     "relative_path": "bulletins/pharmacy-bulletin-24-03.pdf", "eff_code_final_date": "2024-03-01"},
+]
+
+QUESTIONS = ["Who is eligible for MassHealth Standard?", "Which drugs need prior authorization?"]
+
+@pytest.fixture
+def registry():
+    registry = LocalServiceRegistry(DOCUMENTS)
+    # The original unversioned service the app used before the first swap
+    registry.create_service(ALIAS)
+    return registry
+
+@pytest.fixture(autouse=True)
+def distinct_versions(monkeypatch):
+    # Refreshes in one test run within the same second, so number the versions instead
+    counter = itertools.count(1)
+    monkeypatch.setattr(search_service_admin, "versioned_name", lambda alias: f"{alias}_V{next(counter)}")
+
+def refresh(registry, **kwargs):
+    kwargs.setdefault("poll_seconds", 0.01)
+    kwargs.setdefault("drop_grace_seconds", 0)
+    return refresh_search_service(registry, QUESTIONS, alias=ALIAS, **kwargs)
+
+def test_versioned_name():
+    assert versioned_name("SVC", datetime(2025, 7, 1, 3, 0, 0)) == "SVC_V20250701_030000"
+
+def test_first_refresh_switches_alias_and_keeps_original(registry):
+    result = refresh(registry)
+    assert result["service_name"] == f"{ALIAS}_V1"
+    assert result["previous_service_name"] == ALIAS
+    assert registry.active_service(ALIAS) == f"{ALIAS}_V1"
+    # The unversioned service is the app's fallback and is never dropped
+    assert ALIAS in registry.services
+
+def test_second_refresh_drops_previous_version(registry):
+    refresh(registry)
+    result = refresh(registry)
+    assert result["previous_service_name"] == f"{ALIAS}_V1"
+    assert registry.active_service(ALIAS) == f"{ALIAS}_V2"
+    assert f"{ALIAS}_V1" not in registry.services
+    assert ALIAS in registry.services
+
+def test_new_version_snapshots_current_documents(registry):
+    refresh(registry)
+    registry.documents.append({"chunk": "Dental coverage for adults.", "relative_path": "bulletins/dental.pdf",
+                               "eff_code_final_date": "2025-01-01"})
+    refresh(registry)
+    response = registry.search(registry.active_service(ALIAS), "adult dental coverage", 5)
+    assert response.results[0]["relative_path"] == "bulletins/dental.pdf"
+
+def test_slow_warm_up_rolls_back(registry):
+    refresh(registry)
+    registry.search_latency = 0.05
+    with pytest.raises(RuntimeError, match="failed warm-up checks"):
+        refresh(registry, max_p95_seconds=0.01)
+    # Users stay on the old version and the failed one is dropped
+    assert registry.active_service(ALIAS) == f"{ALIAS}_V1"
+    assert f"{ALIAS}_V2" not in registry.services
+
+def test_low_hit_rate_rolls_back(registry):
+    registry.documents = [{"chunk": "Unrelated text.", "relative_path": "x.pdf", "eff_code_final_date": None}]
+    with pytest.raises(RuntimeError, match="returned results"):
+        refresh(registry)
+    assert registry.active_service(ALIAS) is None
+    assert set(registry.services) == {ALIAS}
+
+def test_build_timeout_rolls_back(registry):
+    registry.build_seconds = 60
+    with pytest.raises(RuntimeError, match="was not ready"):
+        refresh(registry, build_timeout=0.05)
+    assert registry.active_service(ALIAS) is None
+    assert set(registry.services) == {ALIAS}
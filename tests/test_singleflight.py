@@ -0,0 +1,94 @@
+# Tests for coalescing identical in-flight calls
+import threading
+import time
+import pytest
+from singleflight import SingleFlight
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's RerunException / StopException"""
+
+def run_follower(flight, key, fn, results):
+    try:
+        results.append(flight.do(key, fn, timeout=5))
+    except Exception as e:
+        results.append(e)
+
+def start_leader(flight, key, leader_fn):
+    """Run leader_fn as the leader on a thread once it has started; returns (thread, errors it raised)"""
+    started = threading.Event()
+    raised = []
+
+    def leader():
+        def fn():
+            started.set()
+            return leader_fn()
+        try:
+            flight.do(key, fn, timeout=5)
+        except BaseException as e:
+            raised.append(e)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(1)
+    return thread, raised
+
+def test_followers_share_the_result():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    leader, _ = start_leader(flight, "k", lambda: release.wait(1) and "answer")
+    results = []
+    follower = threading.Thread(target=run_follower, args=(flight, "k", lambda: "own call", results))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(); follower.join()
+    assert results == ["answer"]
+    assert flight.metrics()["coalesced"] == 1
+
+def test_followers_share_an_exception():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def fail():
+        release.wait(1)
+        raise RuntimeError("search failed")
+
+    leader, raised = start_leader(flight, "k", fail)
+    results = []
+    follower = threading.Thread(target=run_follower, args=(flight, "k", lambda: "own call", results))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(); follower.join()
+    assert isinstance(raised[0], RuntimeError)
+    assert isinstance(results[0], RuntimeError)
+
+def test_interrupted_leader_does_not_leak_to_followers():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def interrupted():
+        release.wait(1)
+        raise Interrupted()
+
+    leader, raised = start_leader(flight, "k", interrupted)
+    results = []
+    follower = threading.Thread(target=run_follower, args=(flight, "k", lambda: "own call", results))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(); follower.join()
+    # Only the leader sees the interruption; the follower makes its own call
+    assert isinstance(raised[0], Interrupted)
+    assert results == ["own call"]
+    assert flight.metrics()["in_flight"] == 0
+
+def test_interrupt_in_leader_is_re_raised():
+    flight = SingleFlight("test")
+
+    def interrupted():
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        flight.do("k", interrupted, timeout=1)
+    assert flight.do("k", lambda: "next", timeout=1) == "next"